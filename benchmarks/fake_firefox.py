@@ -0,0 +1,104 @@
+import time
+import random
+import threading
+from typing import Callable, Dict, List, Optional
+
+from memories_evaluator import EVAL_JS_GENERATE_INSIGHTS_SCRIPT, EVAL_JS_PREPARE_SOURCES_SCRIPT, EVAL_JS_RELEASE_SOURCES_SCRIPT
+from stub_openai_server import parse_latency
+
+# Answer of the driver pool's health check script
+HEALTH_CHECK_RESULT = 1
+
+
+class FakeDriver:
+    """
+    Stands in for the Selenium driver, answering the evaluator's browser scripts with canned memories
+    Memories are built from the titles of each profile's visits, so the stub judge finds some related queries
+    """
+    CONTEXT_CHROME = "chrome"
+
+    def __init__(self, prepare_latency: Callable[[random.Random], float], generation_latency: Callable[[random.Random], float], memories_per_pass: int, seed: int):
+        self.prepare_latency = prepare_latency
+        self.generation_latency = generation_latency
+        self.memories_per_pass = memories_per_pass
+        self._rng = random.Random(seed)
+        self._sources = {}
+
+    def set_context(self, context: str):
+        pass
+
+    def set_script_timeout(self, timeout: float):
+        pass
+
+    def execute_script(self, script: str, *args):
+        return HEALTH_CHECK_RESULT
+
+    def canned_memories(self, titles: List[str]) -> List[Dict]:
+        """
+        One pass of memories about randomly picked visit titles
+        """
+        picked = self._rng.sample(titles, min(self.memories_per_pass, len(titles)))
+        return [
+            {"insight_summary": f"Interested in {title}", "category": "Reference", "intent": "Research / Learn", "score": self._rng.randint(1, 5)}
+            for title in picked
+        ]
+
+    def execute_async_script(self, script: str, request: Dict) -> Dict:
+        """
+        Dispatches on the script, sleeping for a simulated duration like the browser would
+        Concurrent passes of a call overlap in the browser, so a call takes as long as its slowest pass
+        """
+        if script == EVAL_JS_PREPARE_SOURCES_SCRIPT:
+            latency = self.prepare_latency(self._rng)
+            time.sleep(latency)
+            for profile_name, columns in request["profiles"].items():
+                self._sources[profile_name] = sorted(set([title for title in columns["title"] if isinstance(title, str) and title]))
+            return {
+                profile_name: {"cached": True, "timings": {"prepare_sources_ms": latency * 1000}}
+                for profile_name in request["profiles"]
+            }
+        if script == EVAL_JS_GENERATE_INSIGHTS_SCRIPT:
+            results = {}
+            slowest = 0.0
+            for profile_name, n_passes in request["nPasses"].items():
+                latencies = [self.generation_latency(self._rng) for _ in range(n_passes)]
+                slowest = max(latencies + [slowest])
+                results[profile_name] = {
+                    "passes": [self.canned_memories(self._sources[profile_name]) for _ in range(n_passes)],
+                    "timings": [{"generate_insights_ms": latency * 1000, "model_calls": []} for latency in latencies]
+                }
+            time.sleep(slowest)
+            return results
+        if script == EVAL_JS_RELEASE_SOURCES_SCRIPT:
+            for profile_name in request["profileNames"]:
+                self._sources.pop(profile_name, None)
+            return {}
+        raise ValueError("Unknown script given to the fake Firefox driver")
+
+
+class FakeFirefoxInference:
+    """
+    Drop-in for FirefoxInference that launches no browser, for FirefoxDriverPool's driver_factory
+    """
+    _launches = 0
+    _lock = threading.Lock()
+
+    def __init__(
+        self,
+        firefox_bin=None,
+        headless: bool = True,
+        ml_prefs: Optional[Dict[str, str]] = None,
+        startup_seconds: float = 0.0,
+        prepare_latency: str = "constant:0.01",
+        generation_latency: str = "constant:0.5",
+        memories_per_pass: int = 8,
+        seed: int = 0
+    ):
+        with FakeFirefoxInference._lock:
+            FakeFirefoxInference._launches += 1
+            driver_seed = seed * 1000 + FakeFirefoxInference._launches
+        time.sleep(startup_seconds)
+        self.driver = FakeDriver(parse_latency(prepare_latency), parse_latency(generation_latency), memories_per_pass, driver_seed)
+
+    def quit(self):
+        pass
@@ -0,0 +1,219 @@
+import sys
+import json
+import time
+import random
+import resource
+import itertools
+import subprocess
+import pandas as pd
+from pathlib import Path
+from functools import partial
+from argparse import SUPPRESS, ArgumentParser
+from typing import Dict, List
+
+BENCHMARKS_DIR = Path(__file__).resolve().parent
+sys.path.insert(0, str(BENCHMARKS_DIR.parent / "evaluation"))
+
+# The evaluator only imports ml-driver's firefox_inference to launch real drivers, every case here passes a fake driver factory
+from memories_evaluator import MemoryEvaluator, MemoryEvaluatorConfig
+from fake_firefox import FakeFirefoxInference
+from stub_openai_server import StubOpenAIServer
+from utils import atomic_write_json, load_json_if_valid
+
+TOPICS = [
+    "trail running shoes", "sourdough starter", "budget travel japan", "home espresso machine", "python async tutorial",
+    "indoor plant care", "electric bike commute", "marathon training plan", "mortgage refinance rates", "vegan meal prep",
+    "kids science projects", "used car prices", "noise cancelling headphones", "watercolor painting basics", "tax filing deadline"
+]
+SITES = ["www.reddit.com", "www.nytimes.com", "en.wikipedia.org", "www.youtube.com", "www.amazon.com", "medium.com"]
+SEARCH_HOST = "www.google.com"
+RECORD_COLUMNS = ["url", "host", "title", "visit_date", "category", "intent", "frecency_pct", "domain_frecency_pct"]
+
+
+def write_synthetic_personas(data_dir: Path, n_personas: int, queries_per_persona: int, pages_per_query: int, seed: int) -> Dict[str, str]:
+    """
+    Writes a websites bank and browsing records for n synthetic personas, each a search followed by page visits per query
+    """
+    rng = random.Random(seed)
+    records_dir = data_dir / f"records_{n_personas}"
+    websites_dir = data_dir / "websites"
+    records_dir.mkdir(parents=True, exist_ok=True)
+    websites_dir.mkdir(parents=True, exist_ok=True)
+    visit_date = 1_760_000_000_000_000
+    for persona_idx in range(n_personas):
+        persona = f"id_{persona_idx}_Bench-Persona"
+        persona_bank = {}
+        records = []
+        for query_idx, topic in enumerate(rng.sample(TOPICS, min(queries_per_persona, len(TOPICS)))):
+            query = f"{topic} {rng.choice(['guide', 'reviews', 'near me', 'best', 'how to'])}"
+            visit_date += rng.randint(60, 86_400) * 1_000_000
+            records.append([
+                f"https://{SEARCH_HOST}/search?q={query.replace(' ', '+')}", SEARCH_HOST, f"{query} - Google Search",
+                visit_date, "c", "i", rng.uniform(10, 90), rng.uniform(10, 90)
+            ])
+            pages = []
+            for page_idx in range(pages_per_query):
+                site = rng.choice(SITES)
+                page = {"url": f"https://{site}/{persona_idx}/{query_idx}/{page_idx}", "title": f"{topic.title()} {page_idx + 1} | {site}"}
+                pages.append(page)
+                visit_date += rng.randint(10, 600) * 1_000_000
+                records.append([page["url"], site, page["title"], visit_date, "c", "i", rng.uniform(10, 90), rng.uniform(10, 90)])
+            persona_bank[query] = pages
+        pd.DataFrame(records, columns=RECORD_COLUMNS).to_csv(records_dir / f"{persona}.csv", index=False)
+        with open(websites_dir / f"{persona}.json", "w") as _j:
+            json.dump(persona_bank, _j)
+    return {"records_path": str(records_dir), "websites_path": str(websites_dir)}
+
+
+def peak_rss_mb() -> float:
+    """
+    Peak resident set size of the current process, reported in kilobytes on Linux and bytes on macOS
+    """
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak_rss / 1024 ** 2 if sys.platform == "darwin" else peak_rss / 1024
+
+
+def run_case(case_file: str):
+    """
+    Runs one benchmark case in this process and saves its throughput next to the case file
+    """
+    with open(case_file, "r") as _j:
+        case = json.load(_j)
+    evaluator = MemoryEvaluator(
+        MemoryEvaluatorConfig(**case["config"]),
+        driver_factory=partial(FakeFirefoxInference, **case["fake_firefox"])
+    )
+    start = time.perf_counter()
+    evaluator.run()
+    wall_seconds = time.perf_counter() - start
+
+    stage_seconds = {stats["label"]: stats["wall_seconds"] for stats in evaluator.schedule_stats}
+    judge_requests = len([span for span in evaluator.tracer.spans if span["name"] == "judge_request"])
+    generation_seconds = stage_seconds.get("Memories generation", wall_seconds)
+    metrics_seconds = stage_seconds.get("Metrics computation", wall_seconds)
+    atomic_write_json(case_file.replace(".json", "_result.json"), {
+        "wall_seconds": wall_seconds,
+        "generation_seconds": generation_seconds,
+        "metrics_seconds": metrics_seconds,
+        "profiles_per_min": case["personas"] / generation_seconds * 60 if generation_seconds > 0 else 0.0,
+        "judge_requests": judge_requests,
+        "judge_requests_per_s": judge_requests / metrics_seconds if metrics_seconds > 0 else 0.0,
+        "peak_rss_mb": peak_rss_mb()
+    })
+
+
+def build_case(args, data_paths: Dict[str, str], base_url: str, outdir_prefix: str, personas: int, max_threads: int, n_passes: int) -> Dict:
+    """
+    Evaluator config and fake Firefox settings of one point of the sweep
+    """
+    return {
+        "personas": personas,
+        "config": {
+            "data": data_paths,
+            "lite_llm": {"api_key": "stub", "endpoint": base_url, "fastly_request_key": "stub", "model": "stub-insights"},
+            "firefox_repo_path": "",
+            "openai": {"api_key": "stub", "model": "stub-judge", "base_url": base_url},
+            "memories_generation": {
+                "max_threads": max_threads,
+                "n_passes": n_passes,
+                "backend": args.backend,
+                # The stub server's canned insights are not meant to match Firefox's
+                "allow_unverified_port": True
+            },
+            "metrics_computation": {
+                "max_threads": max_threads,
+                "max_concurrent_requests": args.max_concurrent_requests,
+                "judge_batch_size": args.judge_batch_size,
+                "rate_limit": {"base_delay": 0.1, "max_delay": 2.0}
+            },
+            "output": {"outdir_prefix": outdir_prefix}
+        },
+        "fake_firefox": {
+            "startup_seconds": args.driver_startup,
+            "generation_latency": args.generation_latency,
+            "memories_per_pass": args.memories_per_pass,
+            "seed": args.seed
+        }
+    }
+
+
+def parse_int_list(values: str) -> List[int]:
+    return [int(value) for value in values.split(",")]
+
+
+def get_args():
+    parser = ArgumentParser()
+    # Internal, runs a single case written by the sweep
+    parser.add_argument("--worker", default=None, help=SUPPRESS)
+    parser.add_argument("--personas", type=parse_int_list, default=[4, 16], help="comma separated persona counts to sweep")
+    parser.add_argument("--max-threads", dest="max_threads", type=parse_int_list, default=[1, 4], help="comma separated max_threads values to sweep")
+    parser.add_argument("--n-passes", dest="n_passes", type=parse_int_list, default=[1, 3], help="comma separated n_passes values to sweep")
+    parser.add_argument("--backend", choices=["firefox", "python"], default="firefox", help="firefox uses the fake driver, python calls the stub server")
+    parser.add_argument("--latency", default="lognormal:0.3:0.5", help="stub judge latency: constant:S, uniform:LOW:HIGH or lognormal:MEDIAN:SIGMA")
+    parser.add_argument("--rate-429", dest="rate_429", type=float, default=0.02, help="fraction of stub requests answered with a 429")
+    parser.add_argument("--malformed-rate", dest="malformed_rate", type=float, default=0.02, help="fraction of stub requests answered without JSON")
+    parser.add_argument("--generation-latency", dest="generation_latency", default="lognormal:2.0:0.3", help="fake Firefox latency of one generation pass")
+    parser.add_argument("--driver-startup", dest="driver_startup", type=float, default=1.0, help="fake Firefox startup time in seconds")
+    parser.add_argument("--memories-per-pass", dest="memories_per_pass", type=int, default=8)
+    parser.add_argument("--queries-per-persona", dest="queries_per_persona", type=int, default=10)
+    parser.add_argument("--pages-per-query", dest="pages_per_query", type=int, default=3)
+    parser.add_argument("--max-concurrent-requests", dest="max_concurrent_requests", type=int, default=16)
+    parser.add_argument("--judge-batch-size", dest="judge_batch_size", type=int, default=1)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workdir", default="benchmark_runs", help="directory for synthetic data, run outputs and logs")
+    parser.add_argument("--output", default="benchmark_results.csv", help="results table, one row per sweep point")
+    return parser.parse_args()
+
+
+def main():
+    args = get_args()
+    if args.worker is not None:
+        run_case(args.worker)
+        return
+
+    workdir = Path(args.workdir).resolve()
+    workdir.mkdir(parents=True, exist_ok=True)
+    server = StubOpenAIServer(latency=args.latency, rate_429=args.rate_429, malformed_rate=args.malformed_rate, seed=args.seed)
+    base_url = server.start()
+    print(f"Stub chat completions server at {base_url}")
+
+    rows = []
+    persona_data = {}
+    try:
+        for personas, max_threads, n_passes in itertools.product(args.personas, args.max_threads, args.n_passes):
+            case_name = f"p{personas}_t{max_threads}_n{n_passes}"
+            if personas not in persona_data:
+                persona_data[personas] = write_synthetic_personas(workdir / "data", personas, args.queries_per_persona, args.pages_per_query, args.seed)
+            case = build_case(args, persona_data[personas], base_url, str(workdir / case_name), personas, max_threads, n_passes)
+            case_file = workdir / f"{case_name}.json"
+            atomic_write_json(str(case_file), case)
+
+            # Each case runs in its own process, so its peak RSS is not inflated by earlier cases
+            server.reset_stats()
+            print(f"Running {case_name}: {personas} personas, max_threads={max_threads}, n_passes={n_passes}")
+            with open(workdir / f"{case_name}.log", "w") as _log:
+                completed = subprocess.run(
+                    [sys.executable, str(BENCHMARKS_DIR / "run_benchmarks.py"), "--worker", str(case_file)],
+                    cwd=workdir, stdout=_log, stderr=subprocess.STDOUT
+                )
+            result = load_json_if_valid(str(case_file).replace(".json", "_result.json"))
+            if completed.returncode != 0 or result is None:
+                print(f"  {case_name} failed, see {workdir / f'{case_name}.log'}")
+                continue
+            row = {"personas": personas, "max_threads": max_threads, "n_passes": n_passes, **result, **{f"stub_{key}": value for key, value in server.stats.items()}}
+            print(
+                f"  {row['profiles_per_min']:.1f} profiles/min, {row['judge_requests_per_s']:.1f} judge requests/s, "
+                f"peak RSS {row['peak_rss_mb']:.0f} MB, {row['wall_seconds']:.1f}s"
+            )
+            rows.append(row)
+    finally:
+        server.stop()
+
+    results_df = pd.DataFrame(rows)
+    results_df.to_csv(args.output, index=False)
+    print(results_df.to_string(index=False, float_format=lambda value: f"{value:.2f}"))
+    print(f"Saved benchmark results to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,240 @@
+import re
+import json
+import time
+import random
+import threading
+from argparse import ArgumentParser
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, List
+
+# Rough characters per token, matching the judge engine's estimate
+CHARS_PER_TOKEN = 4
+
+MALFORMED_RESPONSE = "I am unable to provide a structured answer for this request."
+WORD_REGEX = re.compile(r"[a-z0-9]+")
+
+
+def parse_latency(spec: str) -> Callable[[random.Random], float]:
+    """
+    Parses a latency distribution in seconds: constant:S, uniform:LOW:HIGH or lognormal:MEDIAN:SIGMA
+    """
+    kind, *params = spec.split(":")
+    values = [float(param) for param in params]
+    if kind == "constant" and len(values) == 1:
+        return lambda rng: values[0]
+    if kind == "uniform" and len(values) == 2:
+        return lambda rng: rng.uniform(values[0], values[1])
+    if kind == "lognormal" and len(values) == 2:
+        return lambda rng: rng.lognormvariate(0.0, values[1]) * values[0]
+    raise ValueError(f"Invalid latency distribution \"{spec}\", expected constant:S, uniform:LOW:HIGH or lognormal:MEDIAN:SIGMA")
+
+
+def words(text: str) -> set:
+    """
+    Lowercase words of a text, used to fake relatedness
+    """
+    return set(WORD_REGEX.findall(text.lower()))
+
+
+def quoted_items(section: str) -> List[str]:
+    """
+    The quoted items of a prompt's bullet list
+    """
+    return re.findall(r'^- "(.*)"$', section, re.MULTILINE)
+
+
+def related_queries(statement: str, queries: List[str]) -> List[str]:
+    """
+    Up to two queries sharing the most words with a statement, standing in for the judge's verdict
+    """
+    statement_words = words(statement)
+    overlaps = sorted([(len(statement_words & words(query)), query) for query in queries], key=lambda overlap: -overlap[0])
+    return [query for overlap, query in overlaps[:2] if overlap >= 2]
+
+
+def answer_prompt(user_prompt: str, rng: random.Random) -> str:
+    """
+    Builds a well-formed answer for each of the evaluator's prompts: query comparisons, duplicates and insight generation
+    """
+    if "Search Queries:" in user_prompt:
+        statements_section, queries_section = user_prompt.split("Search Queries:", 1)
+        queries = quoted_items(queries_section)
+        if "Statements:" in statements_section:
+            statements = re.findall(r'^\d+\. "(.*)"$', statements_section, re.MULTILINE)
+            answer = {str(idx+1): related_queries(statement, queries) for idx, statement in enumerate(statements)}
+        else:
+            statement = re.search(r'Statement: "(.*)"', statements_section)
+            answer = related_queries(statement.group(1) if statement else "", queries)
+    elif "Statement Pairs:" in user_prompt:
+        pairs = re.findall(r'^\d+\. A: "(.*)" \| B: "(.*)"$', user_prompt, re.MULTILINE)
+        answer = {str(idx+1): len(words(statement_a) & words(statement_b)) >= 3 for idx, (statement_a, statement_b) in enumerate(pairs)}
+    elif "Statements:" in user_prompt:
+        statements = quoted_items(user_prompt.split("Statements:", 1)[1])
+        groups = [statements[idx:idx+2] for idx in range(0, len(statements) - 1, 2) if rng.random() < 0.1]
+        answer = {"justification": "Stub judge verdict", "similar_statement_groups": groups}
+    elif "Top domains:" in user_prompt:
+        domains = re.findall(r"^- (\S+) \(weight", user_prompt.split("Top page titles:", 1)[0], re.MULTILINE)
+        answer = {"insights": [
+            {"insight_summary": f"Frequently visits {domain}", "category": "Reference", "intent": "Research / Learn", "score": 3}
+            for domain in domains[:5]
+        ]}
+    else:
+        answer = {}
+    return "```json\n" + json.dumps(answer) + "\n```"
+
+
+class StubHTTPServer(ThreadingHTTPServer):
+    # The judge engine opens many connections at once, more than the default listen backlog of 5
+    request_queue_size = 128
+    daemon_threads = True
+
+
+class StubOpenAIServer:
+    """
+    Local chat completions endpoint with configurable latency, 429 rate and malformed JSON rate, for benchmarks
+    """
+
+    def __init__(
+        self,
+        host: str = "127.0.0.1",
+        port: int = 0,
+        latency: str = "constant:0.05",
+        rate_429: float = 0.0,
+        malformed_rate: float = 0.0,
+        seed: int = 0
+    ):
+        self.sample_latency = parse_latency(latency)
+        self.rate_429 = rate_429
+        self.malformed_rate = malformed_rate
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self.stats = {}
+        self.reset_stats()
+        self._server = StubHTTPServer((host, port), self.make_handler())
+        self._thread = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def reset_stats(self):
+        with self._lock:
+            self.stats = {"requests": 0, "rate_limited": 0, "malformed": 0, "ok": 0}
+
+    def draw(self) -> Dict:
+        """
+        Decides the latency and outcome of one request, under the lock so runs with the same seed are comparable
+        """
+        with self._lock:
+            outcome = self._rng.random()
+            draw = {
+                "latency": max(self.sample_latency(self._rng), 0.0),
+                "outcome": "rate_limited" if outcome < self.rate_429 else "malformed" if outcome < self.rate_429 + self.malformed_rate else "ok",
+                "seed": self._rng.random()
+            }
+            self.stats["requests"] += 1
+            self.stats[draw["outcome"]] += 1
+        return draw
+
+    def make_handler(self):
+        stub = self
+
+        class ChatCompletionsHandler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, format, *args):
+                pass
+
+            def send_json(self, status: int, body: Dict, headers: Dict[str, str] = {}):
+                payload = json.dumps(body).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                for header, value in headers.items():
+                    self.send_header(header, value)
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def do_POST(self):
+                request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+                if not self.path.rstrip("/").endswith("/chat/completions"):
+                    self.send_json(404, {"error": {"message": f"Unknown path {self.path}", "type": "invalid_request_error"}})
+                    return
+                draw = stub.draw()
+                time.sleep(draw["latency"])
+                if draw["outcome"] == "rate_limited":
+                    self.send_json(
+                        429,
+                        {"error": {"message": "Rate limit reached", "type": "rate_limit_error", "code": "rate_limit_exceeded"}},
+                        {"Retry-After": "0.1"}
+                    )
+                    return
+
+                messages = request.get("messages", [])
+                user_prompt = messages[-1]["content"] if messages else ""
+                content = MALFORMED_RESPONSE if draw["outcome"] == "malformed" else answer_prompt(user_prompt, random.Random(draw["seed"]))
+                prompt_tokens = sum([len(message.get("content") or "") for message in messages]) // CHARS_PER_TOKEN + 1
+                self.send_json(200, {
+                    "id": f"chatcmpl-stub-{int(draw['seed'] * 1e12)}",
+                    "object": "chat.completion",
+                    "created": int(time.time()),
+                    "model": request.get("model", "stub"),
+                    "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+                    "usage": {
+                        "prompt_tokens": prompt_tokens,
+                        "completion_tokens": len(content) // CHARS_PER_TOKEN + 1,
+                        "total_tokens": prompt_tokens + len(content) // CHARS_PER_TOKEN + 1,
+                        "prompt_tokens_details": {"cached_tokens": 0}
+                    }
+                })
+
+        return ChatCompletionsHandler
+
+    def start(self) -> str:
+        """
+        Serves requests on a background thread and returns the base URL to give OpenAI clients
+        """
+        self._thread = threading.Thread(target=self._server.serve_forever, name="stub-openai-server", daemon=True)
+        self._thread.start()
+        return self.base_url
+
+    def serve_forever(self):
+        """
+        Serves requests on the calling thread until interrupted
+        """
+        try:
+            self._server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self._server.server_close()
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+        if self._thread is not None:
+            self._thread.join()
+
+
+def get_args():
+    parser = ArgumentParser()
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--latency", default="constant:0.05", help="constant:S, uniform:LOW:HIGH or lognormal:MEDIAN:SIGMA, in seconds")
+    parser.add_argument("--rate-429", dest="rate_429", type=float, default=0.0, help="fraction of requests answered with a 429")
+    parser.add_argument("--malformed-rate", dest="malformed_rate", type=float, default=0.0, help="fraction of requests answered without JSON")
+    parser.add_argument("--seed", type=int, default=0)
+    return parser.parse_args()
+
+
+def main():
+    args = get_args()
+    server = StubOpenAIServer(args.host, args.port, args.latency, args.rate_429, args.malformed_rate, args.seed)
+    print(f"Serving stub chat completions at {server.base_url}")
+    server.serve_forever()
+    print(f"Served {server.stats}")
+
+
+if __name__ == "__main__":
+    main()
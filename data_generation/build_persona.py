@@ -6,6 +6,7 @@ from pydantic import BaseModel
 from typing import List
 from multiprocessing import Pool
 
+from utils import record_usage
 from prompts import SYSTEM_PROMPT_PERSONA_CREATION, USER_PROMPT_PERSONA_CREATION
 
 
@@ -42,6 +43,7 @@ def create_complex_persona(id_arr):
         ],
         response_format=PersonaFormat,
     )
+    record_usage(completion, "build_persona")
 
     ret = completion.choices[0].message.parsed
     return ret
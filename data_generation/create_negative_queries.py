@@ -5,6 +5,7 @@ from pydantic import BaseModel
 from typing import List
 from multiprocessing import Pool
 
+from utils import record_usage
 from prompts import SYSTEM_PROMPT_NEGATIVE_QUERIES, USER_PROMPT_NEGATIVE_QUERIES
 
 
@@ -45,6 +46,7 @@ def create_negative_queries(file_name):
         ],
         response_format=QueryFormat,
     )
+    record_usage(completion, "create_negative_queries")
 
     ret = completion.choices[0].message.parsed
     return ret
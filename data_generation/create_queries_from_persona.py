@@ -5,6 +5,7 @@ from pydantic import BaseModel
 from typing import List
 from multiprocessing import Pool
 
+from utils import record_usage
 from prompts import SYSTEM_PROMPT_QUERIES_FROM_PERSONA, USER_PROMPT_QUERIES_FROM_PERSONA
 
 
@@ -30,6 +31,7 @@ def create_queries(file_name):
         ],
         response_format=QueryFormat,
     )
+    record_usage(completion, "create_queries_from_persona")
 
     ret = completion.choices[0].message.parsed
     return ret
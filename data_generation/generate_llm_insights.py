@@ -8,6 +8,7 @@ from pydantic import BaseModel
 from typing import List
 from multiprocessing import Process
 
+from utils import record_usage
 from prompts import (
     SYSTEM_PROMPT_GENERATE_INSIGHTS,
     USER_PROMPT_GENERATE_INSIGHTS
@@ -72,6 +73,7 @@ def generate_insights(fname, args):
         ],
         response_format=InsightFormat,
     )
+    record_usage(completion, "generate_llm_insights")
 
     insights = [
         {
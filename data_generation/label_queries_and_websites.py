@@ -6,7 +6,7 @@ from pydantic import BaseModel
 from typing import List
 from multiprocessing import Pool
 
-from utils import batch_generator
+from utils import batch_generator, record_usage
 from prompts import (
     SYSTEM_PROMPT_LABEL_QUERY,
     USER_PROMPT_LABEL_QUERY,
@@ -41,6 +41,7 @@ def label_query(query):
         ],
         response_format=LabelFormat,
     )
+    record_usage(completion, "label_query")
 
     ret = completion.choices[0].message.parsed
     return ret.category_intent
@@ -55,6 +56,7 @@ def label_website(website):
         ],
         response_format=LabelFormat,
     )
+    record_usage(completion, "label_website")
 
     ret = completion.choices[0].message.parsed
     return ret.category_intent
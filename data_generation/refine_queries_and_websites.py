@@ -6,6 +6,7 @@ from pydantic import BaseModel
 from typing import List
 from multiprocessing import Pool
 
+from utils import record_usage
 from prompts import (
     SYSTEM_PROMPT_REFINE_SEARCH_RESULTS,
     USER_PROMPT_REFINE_SEARCH_RESULTS
@@ -39,6 +40,7 @@ def _refine_helper(query, websites):
         ],
         response_format=RefinementFormat,
     )
+    record_usage(completion, "refine_queries_and_websites")
 
     title_website_mapping = dict()
     for obj in websites:
@@ -0,0 +1,64 @@
+import re
+import json
+import yaml
+import argparse
+import pandas as pd
+
+from utils import USAGE_FILE
+
+
+def _get_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--usage_file", type=str, default=USAGE_FILE,
+                        help="JSONL usage log written by the data generation scripts")
+    parser.add_argument("--prices", type=str, default=None,
+                        help="YAML file of USD per million tokens per model, e.g. gpt-5: {prompt: 1.25, completion: 10.0, cached_prompt: 0.125}")
+    parser.add_argument("--output", type=str, default="token_costs.csv",
+                        help="CSV file for the per script totals")
+    args = parser.parse_args()
+    return args
+
+
+def find_price(model, prices):
+    # responses name a dated model snapshot, e.g. gpt-5-2025-08-07 for gpt-5
+    for name, price in prices.items():
+        if model == name or re.fullmatch(rf"{re.escape(name)}-\d{{4}}-\d{{2}}-\d{{2}}", model):
+            return price
+    return None
+
+
+def call_cost(call, prices):
+    price = find_price(call["model"], prices)
+    if price is None:
+        return None
+    cached_price = price.get("cached_prompt", price["prompt"])
+    return (
+        (call["prompt_tokens"] - call["cached_tokens"]) * price["prompt"]
+        + call["cached_tokens"] * cached_price
+        + call["completion_tokens"] * price["completion"]
+    ) / 1_000_000
+
+
+def main():
+    args = _get_args()
+    prices = {}
+    if args.prices is not None:
+        with open(args.prices, "r") as f:
+            prices = yaml.safe_load(f)
+
+    with open(args.usage_file, "r") as f:
+        calls = pd.DataFrame([json.loads(line) for line in f if line.strip()])
+    calls["calls"] = 1
+    calls["cost_usd"] = pd.to_numeric(calls.apply(lambda call: call_cost(call, prices), axis=1))
+
+    columns = ["calls", "prompt_tokens", "completion_tokens", "cached_tokens", "cost_usd"]
+    summary = calls.groupby(["script", "model"], sort=True)[columns].sum(min_count=1).reset_index()
+    total = calls.assign(script="total", model="").groupby(["script", "model"])[columns].sum(min_count=1).reset_index()
+    summary = pd.concat([summary, total], ignore_index=True)
+
+    summary.to_csv(args.output, index=False)
+    print(summary.to_string(index=False, float_format=lambda cost: f"{cost:.4f}"))
+
+
+if __name__ == "__main__":
+    main()
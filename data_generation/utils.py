@@ -1,6 +1,12 @@
+import json
+import time
 from itertools import islice
 
 
+# Token usage of every OpenAI call made by the scripts, relative to the data_generation directory
+USAGE_FILE = "token_usage.jsonl"
+
+
 def batch_generator(iterable, batch_size):
     """
     Yield successive batches from an iterable.
@@ -18,3 +24,28 @@ def batch_generator(iterable, batch_size):
         if not batch:
             break
         yield batch
+
+
+def record_usage(completion, script, usage_file=USAGE_FILE):
+    """
+    Append the token usage of a chat completion to the JSONL usage log shared by the scripts.
+
+    Pool workers append whole lines in a single write, so concurrent processes can share the file.
+
+    Args:
+        completion: Chat completion returned by the OpenAI client
+        script (str): Name of the script, or script step, that made the call
+        usage_file (str): Path of the JSONL usage log
+    """
+    usage = completion.usage
+    prompt_details = getattr(usage, "prompt_tokens_details", None)
+    record = {
+        "timestamp": time.time(),
+        "script": script,
+        "model": completion.model,
+        "prompt_tokens": usage.prompt_tokens if usage is not None else 0,
+        "completion_tokens": usage.completion_tokens if usage is not None else 0,
+        "cached_tokens": getattr(prompt_details, "cached_tokens", None) or 0
+    }
+    with open(usage_file, "a") as f:
+        f.write(json.dumps(record) + "\n")
@@ -0,0 +1,159 @@
+import time
+import queue
+import threading
+from pathlib import Path
+from typing import TYPE_CHECKING, Callable, Dict, Optional
+from contextlib import contextmanager
+
+from tracing import Tracer
+
+if TYPE_CHECKING:
+    # From https://github.com/gregtatum/ml-driver/tree/main
+    from firefox_inference import FirefoxInference
+
+
+# Trivial chrome context script used to check that a driver still responds
+HEALTH_CHECK_JS_SCRIPT = "return 1;"
+
+
+class PooledDriver:
+    """
+    A warm Firefox instance owned by a FirefoxDriverPool
+    """
+
+    def __init__(self, firefox: "FirefoxInference", driver_id: int):
+        self.firefox = firefox
+        self.driver_id = driver_id
+        self.uses = 0
+
+
+class FirefoxDriverPool:
+    """
+    Keeps long-lived headless Firefox drivers with the AI Window prefs applied and reuses them across profiles
+    """
+
+    def __init__(
+        self,
+        firefox_bin: Path,
+        aiwindow_prefs: Dict[str, str],
+        max_uses: int,
+        health_check_timeout: float,
+        script_timeout: int = 180,
+        tracer: Optional[Tracer] = None,
+        driver_factory: Optional[Callable[..., "FirefoxInference"]] = None
+    ):
+
+        self.firefox_bin = firefox_bin
+        self.aiwindow_prefs = aiwindow_prefs
+        self.max_uses = max_uses
+        self.health_check_timeout = health_check_timeout
+        self.script_timeout = script_timeout
+        self.tracer = tracer if tracer is not None else Tracer()
+        # Launches drivers with FirefoxInference's arguments, a fake driver can be swapped in for benchmarks
+        if driver_factory is None:
+            # Imported here so that fake drivers and the python backend run without ml-driver and Selenium installed
+            from firefox_inference import FirefoxInference
+            driver_factory = FirefoxInference
+        self.driver_factory = driver_factory
+        self._idle = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._next_driver_id = 0
+        self._closed = False
+
+    def _launch(self) -> PooledDriver:
+        """
+        Starts a new headless Firefox driver in chrome context
+        """
+        with self._lock:
+            driver_id = self._next_driver_id
+            self._next_driver_id += 1
+        with self.tracer.span("driver_startup", driver_id=driver_id):
+            firefox = self.driver_factory(
+                firefox_bin=self.firefox_bin,
+                headless=True,
+                ml_prefs=self.aiwindow_prefs
+            )
+            firefox.driver.set_context(firefox.driver.CONTEXT_CHROME)
+            firefox.driver.set_script_timeout(self.script_timeout)
+        print(f"[Driver {driver_id}] Started Firefox driver")
+        return PooledDriver(firefox, driver_id)
+
+    def _retire(self, pooled: PooledDriver, reason: str):
+        """
+        Shuts down a driver that should no longer be handed out
+        """
+        print(f"[Driver {pooled.driver_id}] Retiring Firefox driver after {pooled.uses} uses ({reason})")
+        try:
+            pooled.firefox.quit()
+        except Exception as e:
+            print(f"[Driver {pooled.driver_id}] Failed to quit Firefox driver: {e}")
+
+    def is_healthy(self, pooled: PooledDriver) -> bool:
+        """
+        Checks that a driver answers a trivial script within the health check timeout
+        The probe runs under a script timeout of health_check_timeout, so a hung browser fails fast instead of
+        blocking for the full script_timeout, which is restored afterwards
+        """
+        driver = pooled.firefox.driver
+        start = time.monotonic()
+        try:
+            driver.set_script_timeout(self.health_check_timeout)
+            try:
+                responsive = driver.execute_script(HEALTH_CHECK_JS_SCRIPT) == 1
+            finally:
+                driver.set_script_timeout(self.script_timeout)
+        except Exception:
+            return False
+        return responsive and time.monotonic() - start <= self.health_check_timeout
+
+    def acquire(self) -> PooledDriver:
+        """
+        Hands out a healthy idle driver, or starts a new one if none are available
+        """
+        while True:
+            try:
+                pooled = self._idle.get_nowait()
+            except queue.Empty:
+                return self._launch()
+            if self.is_healthy(pooled):
+                return pooled
+            self._retire(pooled, "failed health check")
+
+    def release(self, pooled: PooledDriver, healthy: bool = True):
+        """
+        Returns a driver to the pool, recycling it once it has been used max_uses times
+        """
+        pooled.uses += 1
+        if not healthy:
+            self._retire(pooled, "errored during use")
+        elif pooled.uses >= self.max_uses:
+            self._retire(pooled, "reached max uses")
+        elif self._closed:
+            self._retire(pooled, "pool closed")
+        else:
+            self._idle.put(pooled)
+
+    @contextmanager
+    def driver(self):
+        """
+        Context manager yielding a warm FirefoxInference for the duration of one profile
+        """
+        pooled = self.acquire()
+        try:
+            yield pooled.firefox
+        except Exception:
+            self.release(pooled, healthy=False)
+            raise
+        self.release(pooled)
+
+    def close(self):
+        """
+        Shuts down every idle driver
+        """
+        self._closed = True
+        while True:
+            try:
+                pooled = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            self._retire(pooled, "pool closed")
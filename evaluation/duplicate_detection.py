@@ -0,0 +1,111 @@
+import numpy as np
+from typing import Dict, List, Tuple
+
+from text_similarity import cosine_similarity_matrix
+
+
+class UnionFind:
+    """
+    Disjoint sets over item indices, with path halving and union by size
+    """
+
+    def __init__(self, n_items: int):
+        self.parent = list(range(n_items))
+        self.size = [1] * n_items
+
+    def find(self, item: int) -> int:
+        while self.parent[item] != item:
+            self.parent[item] = self.parent[self.parent[item]]
+            item = self.parent[item]
+        return item
+
+    def union(self, item_a: int, item_b: int):
+        root_a, root_b = self.find(item_a), self.find(item_b)
+        if root_a == root_b:
+            return
+        if self.size[root_a] < self.size[root_b]:
+            root_a, root_b = root_b, root_a
+        self.parent[root_b] = root_a
+        self.size[root_a] += self.size[root_b]
+
+    def groups(self) -> List[List[int]]:
+        """
+        Sets with more than one item, in order of their first item
+        """
+        members = {}
+        for item in range(len(self.parent)):
+            members.setdefault(self.find(item), []).append(item)
+        return [group for group in members.values() if len(group) > 1]
+
+
+class DuplicateDetector:
+    """
+    Local duplicate detection: clear duplicates are merged from a pairwise similarity matrix, ambiguous pairs are left for the LLM
+    """
+
+    def __init__(self, auto_merge_threshold: float, borderline_threshold: float, max_pairs_per_request: int):
+        self.auto_merge_threshold = auto_merge_threshold
+        self.borderline_threshold = borderline_threshold
+        self.max_pairs_per_request = max_pairs_per_request
+
+    def auto_merge(self, memories: List[str]) -> Tuple[UnionFind, int, List[Tuple[int, int, float]]]:
+        """
+        Merges every pair above the auto-merge threshold and returns the borderline pairs not already merged
+        """
+        union_find = UnionFind(len(memories))
+        if len(memories) < 2:
+            return union_find, 0, []
+
+        similarity = cosine_similarity_matrix(memories, memories)
+        memories_arr = np.array(memories, dtype=object)
+        similarity[memories_arr[:, None] == memories_arr[None, :]] = 1.0
+        rows, cols = np.triu_indices(len(memories), k=1)
+        pair_similarity = similarity[rows, cols]
+
+        auto_merge_mask = pair_similarity >= self.auto_merge_threshold
+        for row, col in zip(rows[auto_merge_mask], cols[auto_merge_mask]):
+            union_find.union(int(row), int(col))
+
+        borderline_mask = (pair_similarity >= self.borderline_threshold) & ~auto_merge_mask
+        borderline_pairs = [
+            (int(row), int(col), float(pair_similarity_value))
+            for row, col, pair_similarity_value in zip(rows[borderline_mask], cols[borderline_mask], pair_similarity[borderline_mask])
+            if union_find.find(int(row)) != union_find.find(int(col))
+        ]
+        return union_find, int(auto_merge_mask.sum()), borderline_pairs
+
+    def pair_chunks(self, borderline_pairs: List[Tuple[int, int, float]]) -> List[List[Tuple[int, int, float]]]:
+        """
+        Splits borderline pairs into chunks of at most max_pairs_per_request
+        """
+        return [
+            borderline_pairs[chunk_start:chunk_start + self.max_pairs_per_request]
+            for chunk_start in range(0, len(borderline_pairs), self.max_pairs_per_request)
+        ]
+
+    def to_duplicates_out(
+        self,
+        memories: List[str],
+        union_find: UnionFind,
+        auto_merged_count: int,
+        borderline_pairs: List[Tuple[int, int, float]],
+        borderline_verdicts: List[bool]
+    ) -> Dict:
+        """
+        Builds the same similar_statement_groups artifact as the LLM-only duplicate finder
+        """
+        for (row, col, _), is_duplicate in zip(borderline_pairs, borderline_verdicts):
+            if is_duplicate:
+                union_find.union(row, col)
+        return {
+            "justification": (
+                f"Merged {auto_merged_count} pairs with similarity >= {self.auto_merge_threshold}, "
+                f"LLM confirmed {sum(borderline_verdicts)} of {len(borderline_pairs)} borderline pairs "
+                f"with similarity >= {self.borderline_threshold}"
+            ),
+            "similar_statement_groups": [[memories[item] for item in group] for group in union_find.groups()],
+            "borderline_pairs": [
+                {"statements": [memories[row], memories[col]], "similarity": pair_similarity, "duplicate": is_duplicate}
+                for (row, col, pair_similarity), is_duplicate in zip(borderline_pairs, borderline_verdicts)
+            ]
+        }
@@ -0,0 +1,64 @@
+import os
+import glob
+from typing import Dict, Iterator, List, Mapping, Optional
+
+from utils import load_json_if_valid
+
+# Saved in place of a pass's generated memories when the generator gave up on it, the pass is generated again on --resume
+GENERATION_FAILED_SUFFIX = "generation_failed.json"
+
+
+class SavedGenerations(Mapping):
+    """
+    Read-only persona -> passes mapping over a run's saved generation directory
+    A persona's pass files are only read when it is looked up, and are not kept in memory afterwards
+    Passes recorded as failed by the generator are None
+    personas restricts the mapping to a subset of the saved personas, such as a shard's
+    """
+
+    def __init__(self, generation_dir: str, n_passes: int, personas: Optional[List[str]] = None):
+        self.generation_dir = generation_dir
+        self.n_passes = n_passes
+        if not os.path.isdir(generation_dir):
+            raise ValueError(f"No generated memories directory at \"{generation_dir}\"")
+        self.personas = sorted(set([
+            os.path.basename(os.path.dirname(pass_file))
+            for file_name in ["pass_0_generated_memories.json", f"pass_0_{GENERATION_FAILED_SUFFIX}"]
+            for pass_file in glob.glob(f"{glob.escape(generation_dir)}/*/{file_name}")
+        ]))
+        if personas is not None:
+            self.personas = [persona for persona in self.personas if persona in set(personas)]
+        incomplete = [
+            persona for persona in self.personas
+            if not all([os.path.exists(self.pass_file(persona, i)) or self.pass_failed(persona, i) for i in range(n_passes)])
+        ]
+        if incomplete:
+            raise ValueError(f"Saved generations in \"{generation_dir}\" have fewer than {n_passes} passes for {incomplete}")
+
+    def pass_file(self, persona: str, pass_id: int) -> str:
+        return f"{self.generation_dir}/{persona}/pass_{pass_id}_generated_memories.json"
+
+    def failed_pass_file(self, persona: str, pass_id: int) -> str:
+        return f"{self.generation_dir}/{persona}/pass_{pass_id}_{GENERATION_FAILED_SUFFIX}"
+
+    def pass_failed(self, persona: str, pass_id: int) -> bool:
+        return not os.path.exists(self.pass_file(persona, pass_id)) and os.path.exists(self.failed_pass_file(persona, pass_id))
+
+    def __getitem__(self, persona: str) -> List[Optional[List[Dict]]]:
+        if persona not in self.personas:
+            raise KeyError(persona)
+        failed = [self.pass_failed(persona, i) for i in range(self.n_passes)]
+        passes = [None if failed[i] else load_json_if_valid(self.pass_file(persona, i)) for i in range(self.n_passes)]
+        unreadable = [i for i, memories in enumerate(passes) if not failed[i] and not isinstance(memories, list)]
+        if unreadable:
+            raise ValueError(f"Unreadable saved passes {unreadable} for \"{persona}\" in \"{self.generation_dir}\"")
+        return passes
+
+    def __contains__(self, persona: object) -> bool:
+        return persona in self.personas
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.personas)
+
+    def __len__(self) -> int:
+        return len(self.personas)
@@ -0,0 +1,125 @@
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from typing import Dict, Optional
+
+# Cache hits buffered before their last_access updates are written in one transaction
+ACCESS_FLUSH_SIZE = 256
+
+
+class JudgeResponseCache:
+    """
+    On-disk SQLite cache of judge LLM responses, keyed by a hash of the model and prompts
+    Least recently used responses are evicted once the cache grows past max_size_mb
+    The cache's total size is tracked in memory and hits' last_access updates are buffered, so neither costs a query per request
+    Calls are serialized by a lock and may come from any thread, the judge engine makes them from worker threads off its event loop
+    """
+
+    def __init__(self, path: str, max_size_mb: float):
+
+        self.max_size_bytes = int(max_size_mb * 1024 * 1024)
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "key TEXT PRIMARY KEY, response TEXT NOT NULL, size INTEGER NOT NULL, last_access REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS responses_last_access ON responses (last_access)")
+        self._conn.commit()
+        self.total_size = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        self._pending_access = {}
+
+    @staticmethod
+    def make_key(model: str, system_prompt: str, user_prompt: str) -> str:
+        """
+        Builds the content address of a judge request
+        """
+        return hashlib.sha256(json.dumps([model, system_prompt, user_prompt]).encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        """
+        Returns a cached response and marks it as recently used, the access is written with the next flush
+        """
+        with self._lock:
+            row = self._conn.execute("SELECT response FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._pending_access[key] = time.time()
+            if len(self._pending_access) >= ACCESS_FLUSH_SIZE:
+                self._flush_access()
+                self._conn.commit()
+            return row[0]
+
+    def put(self, key: str, response: str):
+        """
+        Stores a response, evicting least recently used entries if the cache is over its size limit
+        """
+        with self._lock:
+            size = len(response.encode("utf-8"))
+            self.total_size += size - self._stored_size(key)
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses (key, response, size, last_access) VALUES (?, ?, ?, ?)",
+                (key, response, size, time.time())
+            )
+            self._pending_access.pop(key, None)
+            if self.total_size > self.max_size_bytes:
+                self._flush_access()
+                self._evict()
+            self._conn.commit()
+
+    def delete(self, key: str):
+        """
+        Drops a cached response, e.g. one that no longer parses
+        """
+        with self._lock:
+            self.total_size -= self._stored_size(key)
+            self._pending_access.pop(key, None)
+            self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+            self._conn.commit()
+
+    def _stored_size(self, key: str) -> int:
+        row = self._conn.execute("SELECT size FROM responses WHERE key = ?", (key,)).fetchone()
+        return 0 if row is None else row[0]
+
+    def _flush_access(self):
+        """
+        Writes the buffered last_access updates of cache hits
+        """
+        if not self._pending_access:
+            return
+        self._conn.executemany(
+            "UPDATE responses SET last_access = ? WHERE key = ?",
+            [(last_access, key) for key, last_access in self._pending_access.items()]
+        )
+        self._pending_access = {}
+
+    def _evict(self):
+        """
+        Deletes least recently used entries until the cache fits in max_size_bytes
+        """
+        evicted_keys = []
+        for key, size in self._conn.execute("SELECT key, size FROM responses ORDER BY last_access ASC"):
+            if self.total_size <= self.max_size_bytes:
+                break
+            evicted_keys.append((key,))
+            self.total_size -= size
+        self._conn.executemany("DELETE FROM responses WHERE key = ?", evicted_keys)
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Hit and miss counts since the cache was opened
+        """
+        return {"hits": self.hits, "misses": self.misses}
+
+    def close(self):
+        with self._lock:
+            self._flush_access()
+            self._conn.commit()
+            self._conn.close()
@@ -0,0 +1,555 @@
+import re
+import json
+import time
+import asyncio
+import hashlib
+import threading
+from openai import AsyncOpenAI
+from typing import Any, Callable, Coroutine, Dict, List, Optional, Tuple
+
+from judge_cache import JudgeResponseCache
+from duplicate_detection import DuplicateDetector
+from rate_limiting import AsyncRateLimiter, RetryPolicy, get_retry_after
+from token_accounting import TokenLedger, read_usage
+from tracing import Tracer, traced
+
+
+# Markdown JSON extraction regex
+JSON_REGEX = re.compile(r"(?:```json)?([\[\{].*[\}\]])(?:```)?", re.DOTALL)
+
+# Rough characters per token, used to keep batched judge prompts inside the context budget
+CHARS_PER_TOKEN = 4
+# Tokens reserved in the context budget for each memory's answer in a batched comparison
+BATCH_RESPONSE_TOKENS_PER_MEMORY = 48
+
+# Client errors worth retrying, other 4xx responses fail immediately
+RETRYABLE_STATUS_CODES = (408, 409, 429)
+
+# Judge system prompts
+COMPARISON_SYSTEM_PROMPT = "You are an expert at finding relationships between statements and search queries."
+DUPLICATES_SYSTEM_PROMPT = "You are an expert at finding groups of similar statements."
+
+
+def extract_and_parse_json_response(response: str) -> Dict:
+    """
+    Finds and extract JSON markdown content from an LLM response
+    """
+    return json.loads(JSON_REGEX.findall(response)[0])
+
+
+def build_comparison_prompt(memory: str, used_queries: List[str]) -> str:
+    """
+    Builds the prompt comparing a single memory to a persona's search queries
+    """
+    return f"""
+Determine if any of the below Search Queries are related to the Statement. You may find multiple related queries, but be strict in your assessment.
+For a query to be related to the Statement, it must:
+1. Be highly semantically similar to the Statement.
+2. Reference identical or similar entities, topics, or concepts as the Statement.
+3. Can be used as evidence for the Statement.
+
+Statement: "{memory}"
+
+Search Queries:
+- {"\n- ".join(['"' + query + '"' for query in used_queries])}
+
+BE STRICT IN YOUR ASSESEMENT AND ADHERE TO THE ABOVE CRITERIA. Prefer to return an empty list than loosely or partially related queries.
+
+Give your answer as a JSON list in the following format:
+```json
+[
+    "Related Query 1",
+    "Related Query 2",
+    ...
+]
+```
+"""
+
+
+def build_batch_comparison_prompt(memories: List[str], used_queries: List[str]) -> str:
+    """
+    Builds the prompt comparing a numbered batch of memories to a persona's search queries in one request
+    """
+    return f"""
+Determine, for each numbered Statement below, if any of the below Search Queries are related to it. You may find multiple related queries for a Statement, but be strict in your assessment.
+For a query to be related to a Statement, it must:
+1. Be highly semantically similar to the Statement.
+2. Reference identical or similar entities, topics, or concepts as the Statement.
+3. Can be used as evidence for the Statement.
+
+Statements:
+{"\n".join([f'{idx+1}. "{memory}"' for idx, memory in enumerate(memories)])}
+
+Search Queries:
+- {"\n- ".join(['"' + query + '"' for query in used_queries])}
+
+BE STRICT IN YOUR ASSESEMENT AND ADHERE TO THE ABOVE CRITERIA. Prefer to return an empty list for a Statement than loosely or partially related queries.
+
+Give your answer as a JSON object mapping every Statement number to its list of related queries, in the following format:
+```json
+{{
+    "1": ["Related Query 1", "Related Query 2"],
+    "2": [],
+    ...
+}}
+```
+"""
+
+
+def parse_batch_comparison(batch_json_out: Dict, n_memories: int, used_queries: List[str]) -> List[List[str]]:
+    """
+    Validates a batched comparison response and orders it by statement number
+    """
+    missing_statements = [str(idx+1) for idx in range(n_memories) if str(idx+1) not in batch_json_out]
+    if missing_statements:
+        raise ValueError(f"Missing statements {missing_statements} in batched response")
+    return [
+        [query for query in batch_json_out[str(idx+1)] if query in used_queries]
+        for idx in range(n_memories)
+    ]
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Estimates the token count of a prompt from its length
+    """
+    return len(text) // CHARS_PER_TOKEN + 1
+
+
+def plan_comparison_batches(memories: List[str], used_queries: List[str], max_batch_size: int, context_tokens: int) -> List[List[int]]:
+    """
+    Splits memory indices into consecutive batches of at most max_batch_size that fit the model's context budget
+    """
+    base_tokens = estimate_tokens(build_batch_comparison_prompt([], used_queries))
+    batches = []
+    batch = []
+    batch_tokens = base_tokens
+    for memory_idx, memory in enumerate(memories):
+        memory_tokens = estimate_tokens(memory) + BATCH_RESPONSE_TOKENS_PER_MEMORY
+        if batch and (len(batch) == max_batch_size or batch_tokens + memory_tokens > context_tokens):
+            batches.append(batch)
+            batch = []
+            batch_tokens = base_tokens
+        batch.append(memory_idx)
+        batch_tokens += memory_tokens
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+def build_duplicates_prompt(memories: List[str]) -> str:
+    """
+    Builds the prompt grouping semantic duplicates in a set of memories
+    """
+    return """
+Examine the list of statements below and determine if there are any groups of statements that express the exact same semantic meaning with different wording.
+If you identify such groups, provide them as lists below. Each statement must only belong to a single list, so if you want to add a statement to multiple lists, combine the lists.
+
+Statements:""" + f"""
+- {"\n- ".join(['"' + memory + '"' for memory in memories])}""" + """
+
+Along with your answer, provide your justification and reasoning.
+Give your answer as a JSON object in the following format:
+```json
+{
+    "justification": "your justification here",
+    "similar_statement_groups": [
+        ["Duplicate Statement 1.1", "Duplicate Statement 1.2", "Duplicate Statement 1.3"],
+        ["Duplicate Statement 2.1", "Duplicate Statement 2.2"],
+        ...
+    ]
+}
+```
+If you do not identify any groups of such statements, simply return an empty list with your justification.
+"""
+
+
+def build_duplicate_pairs_prompt(statement_pairs: List[Tuple[str, str]]) -> str:
+    """
+    Builds the prompt asking whether each numbered pair of statements are semantic duplicates
+    """
+    return f"""
+Examine each numbered pair of statements below and determine if the two statements express the exact same semantic meaning with different wording.
+
+Statement Pairs:
+{"\n".join([f'{idx+1}. A: "{statement_a}" | B: "{statement_b}"' for idx, (statement_a, statement_b) in enumerate(statement_pairs)])}
+
+Give your answer as a JSON object mapping every pair number to true if the statements are duplicates and false otherwise, in the following format:
+```json
+{{
+    "1": true,
+    "2": false,
+    ...
+}}
+```
+"""
+
+
+def parse_duplicate_pairs(pairs_json_out: Dict, n_pairs: int) -> List[bool]:
+    """
+    Validates a duplicate pairs response and orders it by pair number
+    """
+    missing_pairs = [str(idx+1) for idx in range(n_pairs) if str(idx+1) not in pairs_json_out]
+    if missing_pairs:
+        raise ValueError(f"Missing pairs {missing_pairs} in duplicate pairs response")
+    return [bool(pairs_json_out[str(idx+1)]) for idx in range(n_pairs)]
+
+
+def parse_duplicate_groups(dup_json_out: Dict, memories: List[str]) -> Dict:
+    """
+    Validates a duplicates response, whose groups list statements or their 0-based indices, and returns it with statement groups
+    """
+    if not isinstance(dup_json_out, dict) or "similar_statement_groups" not in dup_json_out:
+        raise JudgeParseError("Missing similar_statement_groups in duplicates response")
+    groups = dup_json_out["similar_statement_groups"]
+    if not isinstance(groups, list) or not all([isinstance(group, list) for group in groups]):
+        raise JudgeParseError(f"similar_statement_groups is not a list of lists: {groups!r}")
+    statement_groups = []
+    for group in groups:
+        statement_group = []
+        for statement in group:
+            if isinstance(statement, bool) or not isinstance(statement, (str, int)):
+                raise JudgeParseError(f"Duplicate group item {statement!r} is neither a statement nor an index")
+            if isinstance(statement, int):
+                if not 0 <= statement < len(memories):
+                    raise JudgeParseError(f"Duplicate group index {statement} is out of range for {len(memories)} statements")
+                statement = memories[statement]
+            statement_group.append(statement)
+        statement_groups.append(statement_group)
+    return {**dup_json_out, "similar_statement_groups": statement_groups}
+
+
+class JudgeRequestError(Exception):
+    """
+    A judge request that failed on every allowed attempt
+    """
+
+
+class JudgeParseError(JudgeRequestError):
+    """
+    A judge request given up on because its responses did not parse, rather than because the API kept failing
+    """
+
+
+class JudgeBudgetError(JudgeRequestError):
+    """
+    A judge request not sent because the run's token or cost budget is used up
+    """
+
+
+class AsyncJudgeEngine:
+    """
+    Runs LLM judge requests concurrently on a shared background event loop and connection pool
+    """
+
+    def __init__(
+        self,
+        api_key: str,
+        model: str,
+        max_concurrent_requests: int,
+        batch_size: int = 1,
+        context_tokens: int = 16000,
+        cache: Optional[JudgeResponseCache] = None,
+        retry_policy: Optional[RetryPolicy] = None,
+        rate_limiter: Optional[AsyncRateLimiter] = None,
+        failures_path: Optional[str] = None,
+        tracer: Optional[Tracer] = None,
+        token_ledger: Optional[TokenLedger] = None,
+        base_url: Optional[str] = None
+    ):
+
+        self.model = model
+        self.batch_size = batch_size
+        self.context_tokens = context_tokens
+        self.cache = cache
+        self.retry_policy = retry_policy if retry_policy is not None else RetryPolicy(max_attempts=6, base_delay=1.0, max_delay=60.0)
+        self.rate_limiter = rate_limiter if rate_limiter is not None else AsyncRateLimiter()
+        self.failures_path = failures_path
+        self.tracer = tracer if tracer is not None else Tracer()
+        self.token_ledger = token_ledger if token_ledger is not None else TokenLedger({})
+        self._loop = asyncio.new_event_loop()
+        self._loop_thread = threading.Thread(target=self._loop.run_forever, name="judge-engine", daemon=True)
+        self._loop_thread.start()
+        # Retries are handled by the engine's shared retry policy and rate limiter
+        self._client = AsyncOpenAI(api_key=api_key, base_url=base_url, max_retries=0)
+        self._semaphore = asyncio.Semaphore(max_concurrent_requests)
+
+    def run(self, coroutine: Coroutine) -> Any:
+        """
+        Runs a coroutine on the engine's event loop and blocks the calling thread until it completes
+        """
+        return asyncio.run_coroutine_threadsafe(coroutine, self._loop).result()
+
+    def close(self):
+        """
+        Closes the shared client and stops the event loop
+        """
+        self.run(self._client.close())
+        if self.cache is not None:
+            self.cache.close()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._loop_thread.join()
+
+    def record_failure(self, failure_message: str, user_prompt: str, attempts: int, error: Exception):
+        """
+        Appends a judge call that ran out of attempts to the failures artifact
+        """
+        if self.failures_path is None:
+            return
+        with open(self.failures_path, "a") as _o:
+            _o.write(json.dumps({
+                "timestamp": time.time(),
+                "request": failure_message,
+                "prompt_sha256": hashlib.sha256(user_prompt.encode("utf-8")).hexdigest(),
+                "attempts": attempts,
+                "error_type": type(error).__name__,
+                "error": str(error)
+            }) + "\n")
+
+    async def chat_json(
+        self,
+        system_prompt: str,
+        user_prompt: str,
+        parse: Callable[[Dict], Any],
+        failure_message: str,
+        request_kind: str,
+        max_parse_attempts: Optional[int] = None
+    ) -> Any:
+        """
+        Sends a judge request through the shared rate limiter, retrying API errors and unparseable responses with backoff
+        Raises JudgeRequestError once the retry policy's attempts, or max_parse_attempts parse failures, are used up,
+        and JudgeBudgetError instead of sending a request once the token ledger's budget is used up
+        """
+        cache_key = None
+        if self.cache is not None:
+            cache_key = JudgeResponseCache.make_key(self.model, system_prompt, user_prompt)
+            # The cache's SQLite reads and writes, with their access flushes and evictions, run in worker threads so they
+            # never block the event loop the other in-flight judge requests share
+            cached_response = await asyncio.to_thread(self.cache.get, cache_key)
+            if cached_response is not None:
+                try:
+                    return parse(extract_and_parse_json_response(cached_response))
+                except Exception as e:
+                    print(f"{failure_message} from cached response, requesting again: {e}")
+                    await asyncio.to_thread(self.cache.delete, cache_key)
+
+        prompt_tokens = estimate_tokens(system_prompt) + estimate_tokens(user_prompt)
+        parse_failures = 0
+        for attempt in range(1, self.retry_policy.max_attempts + 1):
+            retry_after = None
+            parse_failed = False
+            try:
+                await self.rate_limiter.acquire(prompt_tokens)
+                async with self._semaphore:
+                    # Requests already queued when the budget ran out are not sent
+                    if self.token_ledger.budget_exceeded():
+                        raise JudgeBudgetError(f"{failure_message}: token budget reached")
+                    with self.tracer.span("judge_request", request=request_kind, attempt=attempt) as span_tags:
+                        resp = await self._client.chat.completions.create(
+                            model=self.model,
+                            messages=[
+                                {"role": "system", "content": system_prompt},
+                                {"role": "user", "content": user_prompt},
+                            ],
+                        )
+                        usage = getattr(resp, "usage", None)
+                        span_tags["prompt_tokens"] = getattr(usage, "prompt_tokens", None)
+                        span_tags["completion_tokens"] = getattr(usage, "completion_tokens", None)
+                        self.token_ledger.record(f"judge_{request_kind}", self.model, usage)
+                        # The limiter only took the estimated prompt tokens, the completion and any underestimate are charged now
+                        used_tokens = read_usage(usage)
+                        self.rate_limiter.settle(prompt_tokens, used_tokens["prompt_tokens"] + used_tokens["completion_tokens"])
+            except JudgeBudgetError:
+                raise
+            except Exception as e:
+                error = e
+                status_code = getattr(e, "status_code", None)
+                if status_code is not None and 400 <= status_code < 500 and status_code not in RETRYABLE_STATUS_CODES:
+                    break
+                retry_after = get_retry_after(e)
+                if status_code == 429:
+                    self.rate_limiter.pause(retry_after if retry_after is not None else self.retry_policy.backoff(attempt))
+            else:
+                response = resp.choices[0].message.content
+                try:
+                    parsed = parse(extract_and_parse_json_response(response))
+                except Exception as e:
+                    error = e
+                    parse_failed = True
+                    parse_failures += 1
+                    if max_parse_attempts is not None and parse_failures >= max_parse_attempts:
+                        break
+                else:
+                    if cache_key is not None:
+                        await asyncio.to_thread(self.cache.put, cache_key, response)
+                    return parsed
+            print(f"{failure_message} (attempt {attempt}/{self.retry_policy.max_attempts}): {error}")
+            if attempt < self.retry_policy.max_attempts:
+                await asyncio.sleep(self.retry_policy.backoff(attempt, retry_after))
+
+        print(f"{failure_message}, giving up after {attempt} attempts: {error}")
+        self.record_failure(failure_message, user_prompt, attempt, error)
+        if parse_failed:
+            raise JudgeParseError(f"{failure_message}: {error}") from error
+        raise JudgeRequestError(f"{failure_message}: {error}") from error
+
+    @staticmethod
+    async def unless_failed(judging: Coroutine[Any, Any, Any], failed: Any = None) -> Any:
+        """
+        Awaits judge requests, returning failed in place of their result when they are given up on
+        The failure is already recorded by chat_json, callers mark the affected memories or runs instead of saving a fallback
+        """
+        try:
+            return await judging
+        except JudgeRequestError:
+            return failed
+
+    async def compare_memory_to_queries(self, memory: str, used_queries: List[str]) -> List[str]:
+        """
+        Prompts an LLM to compare a single generated memory to existing search queries to find related sets
+        """
+        return await self.chat_json(
+            COMPARISON_SYSTEM_PROMPT,
+            build_comparison_prompt(memory, used_queries),
+            lambda comparison_json_out: [query for query in comparison_json_out if query in used_queries],
+            "Failed to extract insight/query comparison data",
+            "comparison"
+        )
+
+    async def compare_memory_batch_to_queries(self, memories: List[str], used_queries: List[str]) -> List[List[str]]:
+        """
+        Compares a batch of memories to the search queries in one request, splitting the batch in half when the response fails to parse
+        or leaves out statements, API errors that outlast the retry policy are raised as splitting would only add requests
+        """
+        if len(memories) == 1:
+            return [await self.compare_memory_to_queries(memories[0], used_queries)]
+        try:
+            return await self.chat_json(
+                COMPARISON_SYSTEM_PROMPT,
+                build_batch_comparison_prompt(memories, used_queries),
+                lambda batch_json_out: parse_batch_comparison(batch_json_out, len(memories), used_queries),
+                f"Failed to extract batched insight/query comparison data for {len(memories)} memories",
+                "batch_comparison",
+                max_parse_attempts=1
+            )
+        except JudgeParseError:
+            split_idx = len(memories) // 2
+            first_half, second_half = await asyncio.gather(
+                self.unless_failed(self.compare_memory_batch_to_queries(memories[:split_idx], used_queries), [None] * split_idx),
+                self.unless_failed(self.compare_memory_batch_to_queries(memories[split_idx:], used_queries), [None] * (len(memories) - split_idx))
+            )
+            return first_half + second_half
+
+    async def compare_memories_to_queries(self, memories: List[str], used_queries: List[str]) -> List[List[str]]:
+        """
+        Compares every memory to the search queries concurrently, preserving memory order
+        Memories whose requests were given up on get None rather than an empty list, so they are not mistaken for judged ones
+        """
+        if self.batch_size == 1:
+            return list(await asyncio.gather(*[self.unless_failed(self.compare_memory_to_queries(memory, used_queries)) for memory in memories]))
+        batches = plan_comparison_batches(memories, used_queries, self.batch_size, self.context_tokens)
+        batch_results = await asyncio.gather(*[
+            self.unless_failed(self.compare_memory_batch_to_queries([memories[memory_idx] for memory_idx in batch], used_queries), [None] * len(batch))
+            for batch in batches
+        ])
+        return [related_queries for batch_result in batch_results for related_queries in batch_result]
+
+    async def compare_memories_to_candidate_queries(self, memories: List[str], candidate_queries: List[List[str]]) -> List[List[str]]:
+        """
+        Compares each memory only to its shortlist of candidate queries, skipping memories without candidates
+        Batched requests judge their memories against the union of the batch's candidates
+        Memories whose requests were given up on get None
+        """
+        related = [[] for _ in memories]
+        judged_idx = [memory_idx for memory_idx, queries in enumerate(candidate_queries) if queries]
+        if self.batch_size == 1:
+            judged_results = await asyncio.gather(*[
+                self.unless_failed(self.compare_memory_to_queries(memories[memory_idx], candidate_queries[memory_idx])) for memory_idx in judged_idx
+            ])
+            for memory_idx, related_queries in zip(judged_idx, judged_results):
+                related[memory_idx] = related_queries
+            return related
+
+        all_candidates = list(dict.fromkeys([query for memory_idx in judged_idx for query in candidate_queries[memory_idx]]))
+        batches = [
+            [judged_idx[batch_idx] for batch_idx in batch]
+            for batch in plan_comparison_batches([memories[memory_idx] for memory_idx in judged_idx], all_candidates, self.batch_size, self.context_tokens)
+        ]
+        batch_results = await asyncio.gather(*[
+            self.unless_failed(
+                self.compare_memory_batch_to_queries(
+                    [memories[memory_idx] for memory_idx in batch],
+                    list(dict.fromkeys([query for memory_idx in batch for query in candidate_queries[memory_idx]]))
+                ),
+                [None] * len(batch)
+            )
+            for batch in batches
+        ])
+        for batch, batch_result in zip(batches, batch_results):
+            for memory_idx, related_queries in zip(batch, batch_result):
+                related[memory_idx] = related_queries
+        return related
+
+    async def find_duplicates(self, memories: List[str]) -> Dict:
+        """
+        Prompts an LLM to identify close or identical semantic duplicates in a set of memories
+        """
+        return await self.chat_json(
+            DUPLICATES_SYSTEM_PROMPT,
+            build_duplicates_prompt(memories),
+            lambda dup_json_out: parse_duplicate_groups(dup_json_out, memories),
+            "Failed to extract duplicates list",
+            "duplicates"
+        )
+
+    async def judge_duplicate_pairs(self, statement_pairs: List[Tuple[str, str]]) -> List[bool]:
+        """
+        Prompts an LLM to decide whether each pair of statements are semantic duplicates
+        """
+        return await self.chat_json(
+            DUPLICATES_SYSTEM_PROMPT,
+            build_duplicate_pairs_prompt(statement_pairs),
+            lambda pairs_json_out: parse_duplicate_pairs(pairs_json_out, len(statement_pairs)),
+            "Failed to extract duplicate pair verdicts",
+            "duplicate_pairs"
+        )
+
+    async def find_duplicates_with_detector(self, memories: List[str], detector: DuplicateDetector) -> Dict:
+        """
+        Groups duplicates locally and only escalates borderline pairs to the LLM
+        """
+        with self.tracer.span("duplicate_auto_merge", memories=len(memories)):
+            union_find, auto_merged_count, borderline_pairs = detector.auto_merge(memories)
+        chunk_verdicts = await asyncio.gather(*[
+            self.judge_duplicate_pairs([(memories[row], memories[col]) for row, col, _ in chunk])
+            for chunk in detector.pair_chunks(borderline_pairs)
+        ])
+        borderline_verdicts = [is_duplicate for verdicts in chunk_verdicts for is_duplicate in verdicts]
+        return detector.to_duplicates_out(memories, union_find, auto_merged_count, borderline_pairs, borderline_verdicts)
+
+    async def find_run_duplicates(self, memories: List[str], detector: Optional[DuplicateDetector] = None) -> Dict:
+        """
+        Finds duplicates within one run's memories
+        Uses the local detector with LLM escalation when one is given, otherwise a single LLM request
+        """
+        with self.tracer.span("duplicate_detection", memories=len(memories)):
+            if detector is not None:
+                return await self.find_duplicates_with_detector(memories, detector)
+            return await self.find_duplicates(memories)
+
+    async def find_duplicates_in_runs(
+        self,
+        runs_memories: List[List[str]],
+        detector: Optional[DuplicateDetector] = None,
+        run_ids: Optional[List[int]] = None
+    ) -> List[Dict]:
+        """
+        Finds duplicates within each run's memories concurrently, preserving run order
+        Runs whose requests were given up on get None
+        run_ids tag each run's spans with its pass, defaulting to the runs' positions
+        """
+        run_ids = run_ids if run_ids is not None else list(range(len(runs_memories)))
+        return list(await asyncio.gather(*[
+            self.unless_failed(traced(self.find_run_duplicates(memories, detector), pass_id=run_id))
+            for run_id, memories in zip(run_ids, runs_memories)
+        ]))
@@ -2,20 +2,39 @@ import os
 import re
 import glob
 import json
+import time
+import queue
 import yaml
 import shutil
 import logging
-import numpy as np
+import configparser
 import pandas as pd
 from pathlib import Path
-from openai import OpenAI
 from pydantic import BaseModel
+from contextlib import contextmanager
 from argparse import ArgumentParser
-from typing import Dict, List, Union
-from concurrent.futures import ThreadPoolExecutor, as_completed
-
-# From https://github.com/gregtatum/ml-driver/tree/main
-from firefox_inference import FirefoxInference
+from typing import TYPE_CHECKING, Callable, Dict, List, Literal, Mapping, Optional, Tuple
+from concurrent.futures import ThreadPoolExecutor
+
+from generation_store import GENERATION_FAILED_SUFFIX, SavedGenerations
+from judge_engine import AsyncJudgeEngine
+from judge_cache import JudgeResponseCache
+from metrics import METRICS_COLUMNS, compute_metrics_frame
+from offline_insights import InsightsGenerationError, OfflineInsightsGenerator, check_parity_report, prepare_sources
+from query_index import find_used_queries, load_query_index
+from query_prefilter import shortlist_queries, shortlist_recall
+from duplicate_detection import DuplicateDetector
+from rate_limiting import AsyncRateLimiter, RetryPolicy
+from run_history import RUN_INFO_FILE, RunHistory, run_info
+from results_io import METRICS_OUTPUT, RESULTS_OUTPUT, import_pyarrow, open_output_writers
+from scheduler import format_schedule_stats, run_work_queue
+from sharding import SHARD_FILE, parse_shard, shard_outdir_prefix, shard_personas
+from token_accounting import TOKEN_COSTS_FILE, TOKEN_USAGE_FILE, TokenLedger
+from tracing import Tracer, summarize_spans, to_chrome_trace, trace_tags
+from utils import atomic_write_csv, atomic_write_json, load_json_if_valid
+
+if TYPE_CHECKING:
+    from firefox_inference import FirefoxInference
 
 
 # Turn off httpx logging from openai
@@ -26,6 +45,7 @@ logging.getLogger("httpx").setLevel(logging.ERROR)
 class DataConfig(BaseModel):
     records_path: str
     websites_path: str
+    query_index_path: Optional[str] = None
 
 class LiteLLMConfig(BaseModel):
     api_key: str
@@ -36,16 +56,86 @@ class LiteLLMConfig(BaseModel):
 class OpenAIConfig(BaseModel):
     api_key: str
     model: str
+    base_url: Optional[str] = None
+
+class GenerationRetryConfig(BaseModel):
+    max_attempts: int = 3
+    base_delay: float = 1.0
+    max_delay: float = 30.0
 
 class MemoriesGenerationConfig(BaseModel):
     max_threads: int
     n_passes: int
+    backend: Literal["firefox", "python"] = "firefox"
+    driver_max_uses: int = 20
+    driver_health_check_timeout: float = 5.0
+    profiles_per_driver: int = 1
+    concurrent_passes: bool = False
+    # Retries of the python backend's insight generation requests
+    retry: GenerationRetryConfig = GenerationRetryConfig()
+    # offline_parity.py report showing the python backend's approximation matching Firefox, required to generate with it
+    parity_report: Optional[str] = None
+    # Generates with the python backend without a matching parity report, e.g. for benchmarks, its metrics are not comparable to Firefox's
+    allow_unverified_port: bool = False
+
+class PrefilterConfig(BaseModel):
+    top_k: int = 10
+    min_similarity: float = 0.05
+    audit: bool = False
+
+class DuplicateDetectionConfig(BaseModel):
+    auto_merge_threshold: float = 0.85
+    borderline_threshold: float = 0.4
+    max_pairs_per_request: int = 50
+
+class JudgeRateLimitConfig(BaseModel):
+    requests_per_minute: Optional[int] = None
+    tokens_per_minute: Optional[int] = None
+    max_attempts: int = 6
+    base_delay: float = 1.0
+    max_delay: float = 60.0
 
 class MetricsComputationConfig(BaseModel):
     max_threads: int
+    max_concurrent_requests: int = 16
+    judge_batch_size: int = 1
+    judge_context_tokens: int = 16000
+    prefilter: Optional[PrefilterConfig] = None
+    duplicate_detection: Optional[DuplicateDetectionConfig] = None
+    rate_limit: JudgeRateLimitConfig = JudgeRateLimitConfig()
+
+class JudgeCacheConfig(BaseModel):
+    path: str
+    max_size_mb: float = 512
+
+class SchedulerConfig(BaseModel):
+    longest_job_first: bool = False
+
+class TracingConfig(BaseModel):
+    enabled: bool = True
+
+class ModelPriceConfig(BaseModel):
+    # USD per million tokens, cached prompt tokens are billed at the prompt price when no cached price is given
+    prompt: float
+    completion: float
+    cached_prompt: Optional[float] = None
+
+class TokenAccountingConfig(BaseModel):
+    prices: Dict[str, ModelPriceConfig] = {}
+    max_cost_usd: Optional[float] = None
+    max_tokens: Optional[int] = None
+
+class PipelineConfig(BaseModel):
+    streaming: bool = False
+    queue_size: int = 16
 
 class OutputConfig(BaseModel):
     outdir_prefix: str
+    # Formats the metrics and results are saved in, parquet keeps list columns as lists and persona_id dictionary-encoded
+    formats: List[Literal["csv", "parquet"]] = ["csv"]
+    parquet_compression: Literal["zstd", "snappy", "gzip", "none"] = "zstd"
+    # Run history SQLite file the run's metrics and results are ingested into when it completes, see run_history.py
+    history_db: Optional[str] = None
 
 class MemoryEvaluatorConfig(BaseModel):
     data: DataConfig
@@ -55,8 +145,17 @@ class MemoryEvaluatorConfig(BaseModel):
     memories_generation: MemoriesGenerationConfig
     metrics_computation: MetricsComputationConfig
     output: OutputConfig
-
-# Firefox Selenium driver JS script template
+    judge_cache: Optional[JudgeCacheConfig] = None
+    pipeline: PipelineConfig = PipelineConfig()
+    scheduler: SchedulerConfig = SchedulerConfig()
+    tracing: TracingConfig = TracingConfig()
+    token_accounting: TokenAccountingConfig = TokenAccountingConfig()
+
+# Firefox Selenium driver JS scripts
+# Every script is the shared header followed by one of the bodies below. The scripts are constant, the
+# per-call request is passed as the first script argument with profile rows in a columnar layout.
+# Aggregated history sources are computed once per profile and cached on the chrome window, so each
+# pass only re-runs the stochastic generateInsights step. Several profiles run as concurrent promises.
 EVAL_JS_SCRIPT_HEADER = """
 var callback = arguments[arguments.length - 1];
 
@@ -77,18 +176,50 @@ const { generateInsights } = ChromeUtils.importESModule(
   "moz-src:///browser/components/aiwindow/models/Insights.sys.mjs"
 );
 
-async function runCallback() {
+// Sources cache shared across script calls, keyed by profile name
+const sourcesCache = (window.insightsEvalSourcesCache ??= new Map());
+
+function columnsToRows(columns) {
+  const names = Object.keys(columns);
+  const length = names.length ? columns[names[0]].length : 0;
+  return Array.from(
+    {length},
+    (_, idx) => Object.fromEntries(names.map(name => [name, columns[name][idx]]))
+  );
+}
+
+function collectOutcomes(profileNames, outcomes) {
+  const results = {};
+  outcomes.forEach((outcome, idx) => {
+    results[profileNames[idx]] = outcome.status === "fulfilled"
+      ? outcome.value
+      : {error: String(outcome.reason)};
+  });
+  return results;
+}
+
+// Runs a pipeline stage and records how long it took in milliseconds
+async function timeStage(timings, stage, fn) {
+  const start = performance.now();
+  try {
+    return await fn();
+  } finally {
+    timings[`${stage}_ms`] = performance.now() - start;
+  }
+}
 
-  // Prep synthetic history
-  const rows = """
+const request = arguments[0];
+"""
 
-EVAL_JS_SCRIPT_FOOTER = """
-  const sessionized = sessionizeVisits(rows);
-  const profilePreparedInputs = generateProfileInputs(sessionized);
-  const [domainAgg, titleAgg, searchAgg] = aggregateSessions(
+EVAL_JS_PREPARE_SOURCES_SCRIPT = EVAL_JS_SCRIPT_HEADER + """
+async function prepareSources(columns, timings) {
+  const rows = columnsToRows(columns);
+  const sessionized = await timeStage(timings, "sessionize_visits", () => sessionizeVisits(rows));
+  const profilePreparedInputs = await timeStage(timings, "generate_profile_inputs", () => generateProfileInputs(sessionized));
+  const [domainAgg, titleAgg, searchAgg] = await timeStage(timings, "aggregate_sessions", () => aggregateSessions(
       profilePreparedInputs
-  );
-  const [domainItems, titleItems, searchItems] = await topkAggregates(
+  ));
+  const [domainItems, titleItems, searchItems] = await timeStage(timings, "topk_aggregates", () => topkAggregates(
     domainAgg,
     titleAgg,
     searchAgg,
@@ -98,17 +229,92 @@ EVAL_JS_SCRIPT_FOOTER = """
       k_searches: 10,
       now: undefined,
     }
+  ));
+  return {history: [domainItems, titleItems, searchItems]};
+}
+
+async function runCallback() {
+  const profileNames = Object.keys(request.profiles);
+  const outcomes = await Promise.allSettled(
+    profileNames.map(async profileName => {
+      const timings = {};
+      sourcesCache.set(profileName, await prepareSources(request.profiles[profileName], timings));
+      return {cached: true, timings};
+    })
   );
-  const sources = {history: [domainItems, titleItems, searchItems]};
+  return collectOutcomes(profileNames, outcomes);
+}
+runCallback().then(result => callback(result));
+"""
 
-  // Generate memories
-  const engine = await openAIEngine.build("smart-openai", "ai");
+EVAL_JS_GENERATE_INSIGHTS_SCRIPT = EVAL_JS_SCRIPT_HEADER + """
+// Wraps the engine so that every promise-returning call made by generateInsights, i.e. each model request, is timed
+// along with the token usage of its response when the engine returns one
+function timeEngineCalls(engine, modelCalls) {
+  return new Proxy(engine, {
+    get(target, property) {
+      const value = Reflect.get(target, property);
+      if (typeof value !== "function") {
+        return value;
+      }
+      return (...args) => {
+        const start = performance.now();
+        const result = value.apply(target, args);
+        if (result && typeof result.then === "function") {
+          return result.then(
+            response => {
+              modelCalls.push({method: String(property), ms: performance.now() - start, usage: response?.usage ?? null});
+              return response;
+            },
+            error => {
+              modelCalls.push({method: String(property), ms: performance.now() - start, usage: null});
+              throw error;
+            }
+          );
+        }
+        return result;
+      };
+    },
+  });
+}
 
-  return await generateInsights(engine, sources, []);
+async function generatePass(sources) {
+  const timings = {model_calls: []};
+  const engine = await timeStage(timings, "build_engine", () => openAIEngine.build("smart-openai", "ai"));
+  const insights = await timeStage(
+    timings,
+    "generate_insights",
+    () => generateInsights(timeEngineCalls(engine, timings.model_calls), sources, [])
+  );
+  return {insights, timings};
+}
+
+async function generatePasses(profileName) {
+  const sources = sourcesCache.get(profileName);
+  if (!sources) {
+    throw new Error(`No cached sources for profile ${profileName}`);
+  }
+  const results = await Promise.all(
+    Array.from({length: request.nPasses[profileName]}, () => generatePass(sources))
+  );
+  return {passes: results.map(result => result.insights), timings: results.map(result => result.timings)};
+}
+
+async function runCallback() {
+  const profileNames = Object.keys(request.nPasses);
+  const outcomes = await Promise.allSettled(profileNames.map(generatePasses));
+  return collectOutcomes(profileNames, outcomes);
 }
 runCallback().then(result => callback(result));
 """
 
+EVAL_JS_RELEASE_SOURCES_SCRIPT = EVAL_JS_SCRIPT_HEADER + """
+for (const profileName of request.profileNames) {
+  sourcesCache.delete(profileName);
+}
+callback({});
+"""
+
 # Search engine regex
 SEARCH_ENGINE_DOMAINS = [
   "google",
@@ -125,13 +331,16 @@ SEARCH_ENGINE_REGEX = re.compile(
     rf"(?:^|\.){'|'.join(SEARCH_ENGINE_DOMAINS)}\.", re.IGNORECASE
 )
 
-# Markdown JSON extraction regex
-JSON_REGEX = re.compile(r"(?:```json)?([\[\{].*[\}\]])(?:```)?", re.DOTALL)
-
 # Output directories
 OUTDIR_SUFFIX = "memories_eval_results"
 MEMORIES_GENERATION = "1.memories_generation"
 METRICS_ARTIFACTS = "2.metrics_artifacts"
+JUDGE_FAILURES = "judge_failures.jsonl"
+TRACE_FILE = "trace.jsonl"
+GENERATION_SOURCE_FILE = "generation_source.json"
+
+# Pipeline stages in run order, a run executes a contiguous range of them
+STAGES = ["generate", "judge", "metrics"]
 
 
 class MemoryEvaluator:
@@ -141,23 +350,154 @@ class MemoryEvaluator:
 
     def __init__(
         self,
-        config: MemoryEvaluatorConfig
+        config: MemoryEvaluatorConfig,
+        resume: bool = False,
+        driver_factory: Optional[Callable[..., "FirefoxInference"]] = None,
+        stages: List[str] = STAGES,
+        from_generation: Optional[str] = None,
+        shard: Optional[Tuple[int, int]] = None
     ):
 
         self.config = config
-        self.outdir = MemoryEvaluator.setup_output_dir(config.output.outdir_prefix)
+        self.stages = MemoryEvaluator.check_stages(stages, from_generation)
+        if "parquet" in config.output.formats:
+            # Fail before any work is done rather than once the first outputs are written
+            import_pyarrow()
+        self.from_generation = from_generation
+        self.shard = shard
+        outdir_prefix = shard_outdir_prefix(config.output.outdir_prefix, *shard) if shard is not None else config.output.outdir_prefix
+        if from_generation is not None and os.path.realpath(MemoryEvaluator.output_dir_path(outdir_prefix)) == os.path.realpath(from_generation):
+            raise ValueError(f"The output directory must differ from the --from-generation directory \"{from_generation}\"")
+        self.outdir = MemoryEvaluator.setup_output_dir(outdir_prefix, resume)
+        self.schedule_stats = []
+        self.tracer = Tracer(f"{self.outdir}/{TRACE_FILE}" if config.tracing.enabled else None)
+        self.token_ledger = TokenLedger(
+            prices={model: price.model_dump() for model, price in config.token_accounting.prices.items()},
+            path=f"{self.outdir}/{TOKEN_USAGE_FILE}",
+            max_cost_usd=config.token_accounting.max_cost_usd,
+            max_tokens=config.token_accounting.max_tokens
+        )
+        # Per-persona outputs are appended to these as they are computed, see open_output_writers
+        self.metrics_writers = []
+        self.results_writers = []
         self.aiwindow_prefs = MemoryEvaluator.set_aiwindow_prefs(config.lite_llm)
-        self.firefox_bin = MemoryEvaluator.get_firefox_bin_path(config.firefox_repo_path)
-        self.openai_client = OpenAI(api_key=config.openai.api_key)
+        if config.memories_generation.backend == "firefox":
+            # Only the firefox backend needs the driver pool and, unless a driver factory is given, ml-driver and Selenium
+            from driver_pool import FirefoxDriverPool
+            # A custom driver factory, such as the benchmarks' fake Firefox, does not need a local build
+            self.firefox_bin = MemoryEvaluator.get_firefox_bin_path(config.firefox_repo_path) if driver_factory is None else None
+            self.driver_pool = FirefoxDriverPool(
+                firefox_bin=self.firefox_bin,
+                aiwindow_prefs=self.aiwindow_prefs,
+                max_uses=config.memories_generation.driver_max_uses,
+                health_check_timeout=config.memories_generation.driver_health_check_timeout,
+                tracer=self.tracer,
+                driver_factory=driver_factory
+            )
+            self.insights_generator = None
+        else:
+            # Headless Python approximation of the insights pipeline, calling the LiteLLM endpoint directly
+            if "generate" in self.stages:
+                MemoryEvaluator.check_python_backend(config.memories_generation)
+            self.firefox_bin = None
+            self.driver_pool = None
+            self.insights_generator = OfflineInsightsGenerator(
+                endpoint=config.lite_llm.endpoint,
+                api_key=config.lite_llm.api_key,
+                model=config.lite_llm.model,
+                extra_headers={"X-FASTLY-REQUEST": config.lite_llm.fastly_request_key},
+                token_ledger=self.token_ledger,
+                retry_policy=RetryPolicy(
+                    max_attempts=config.memories_generation.retry.max_attempts,
+                    base_delay=config.memories_generation.retry.base_delay,
+                    max_delay=config.memories_generation.retry.max_delay
+                )
+            )
+        duplicate_detection_conf = config.metrics_computation.duplicate_detection
+        self.duplicate_detector = DuplicateDetector(
+            auto_merge_threshold=duplicate_detection_conf.auto_merge_threshold,
+            borderline_threshold=duplicate_detection_conf.borderline_threshold,
+            max_pairs_per_request=duplicate_detection_conf.max_pairs_per_request
+        ) if duplicate_detection_conf is not None else None
+        self.query_index = load_query_index(config.data.websites_path, config.data.query_index_path)
+        rate_limit_conf = config.metrics_computation.rate_limit
+        self.judge = AsyncJudgeEngine(
+            api_key=config.openai.api_key,
+            model=config.openai.model,
+            max_concurrent_requests=config.metrics_computation.max_concurrent_requests,
+            batch_size=config.metrics_computation.judge_batch_size,
+            context_tokens=config.metrics_computation.judge_context_tokens,
+            cache=JudgeResponseCache(
+                path=config.judge_cache.path,
+                max_size_mb=config.judge_cache.max_size_mb
+            ) if config.judge_cache is not None else None,
+            retry_policy=RetryPolicy(
+                max_attempts=rate_limit_conf.max_attempts,
+                base_delay=rate_limit_conf.base_delay,
+                max_delay=rate_limit_conf.max_delay
+            ),
+            rate_limiter=AsyncRateLimiter(
+                requests_per_minute=rate_limit_conf.requests_per_minute,
+                tokens_per_minute=rate_limit_conf.tokens_per_minute
+            ),
+            failures_path=f"{self.outdir}/{JUDGE_FAILURES}",
+            tracer=self.tracer,
+            token_ledger=self.token_ledger,
+            base_url=config.openai.base_url
+        )
+        atomic_write_json(f"{self.outdir}/{RUN_INFO_FILE}", run_info(
+            config,
+            self.stages,
+            MemoryEvaluator.get_firefox_build(self.firefox_bin) if self.firefox_bin is not None else None,
+            from_generation=os.path.abspath(from_generation) if from_generation is not None else None,
+            shard=list(shard) if shard is not None else None
+        ))
+
+    @staticmethod
+    def check_python_backend(generation_conf: MemoriesGenerationConfig):
+        """
+        Refuses to generate with the python backend unless a parity report shows it matching Firefox, or it is explicitly allowed
+        """
+        try:
+            check_parity_report(generation_conf.parity_report)
+        except ValueError as e:
+            if not generation_conf.allow_unverified_port:
+                raise ValueError(f"{e}. Set memories_generation.allow_unverified_port to generate anyway") from e
+            print(f"WARNING: {e}")
+            print("WARNING: generating with the unverified python backend, its metrics are not comparable to Firefox runs")
+
+    @staticmethod
+    def check_stages(stages: List[str], from_generation: Optional[str]) -> List[str]:
+        """
+        Validates the stages to run, which must be contiguous and start after generation when reading saved generations
+        """
+        unknown_stages = [stage for stage in stages if stage not in STAGES]
+        if unknown_stages or not stages:
+            raise ValueError(f"Unknown stages {unknown_stages}, expected a subset of {STAGES}")
+        stage_ids = sorted(set([STAGES.index(stage) for stage in stages]))
+        if stage_ids != list(range(stage_ids[0], stage_ids[-1] + 1)):
+            raise ValueError(f"Stages {stages} skip a stage in between, expected a contiguous range of {STAGES}")
+        if ("generate" in stages) == (from_generation is not None):
+            raise ValueError("Saved generations are read with --from-generation exactly when the generate stage is not run")
+        return [STAGES[stage_id] for stage_id in stage_ids]
+
+    @staticmethod
+    def output_dir_path(outdir_prefix: str) -> str:
+        return f"{outdir_prefix.strip('_')}_{OUTDIR_SUFFIX}"
 
     @staticmethod
-    def setup_output_dir(outdir_prefix: str) -> str:
-        outdir = f"{outdir_prefix.strip('_')}_{OUTDIR_SUFFIX}"
+    def setup_output_dir(outdir_prefix: str, resume: bool = False) -> str:
+        """
+        Creates a fresh output directory, or keeps an existing one to resume from its saved artifacts
+        """
+        outdir = MemoryEvaluator.output_dir_path(outdir_prefix)
         if os.path.isdir(outdir):
-            shutil.rmtree(outdir)
-        os.mkdir(outdir)
+            if resume:
+                print(f"Resuming from existing output directory \"{outdir}\"")
+            else:
+                shutil.rmtree(outdir)
         for subdir in [MEMORIES_GENERATION, METRICS_ARTIFACTS]:
-            os.mkdir(f"{outdir}/{subdir}")
+            os.makedirs(f"{outdir}/{subdir}", exist_ok=True)
         return outdir
 
     @staticmethod
@@ -180,6 +520,18 @@ class MemoryEvaluator:
         bin_dir_opts = glob.glob(f"{firefox_repo_path}/obj-*/dist/Nightly.app/Contents/MacOS/firefox")
         return Path(max(bin_dir_opts, key=os.path.getctime))
 
+    @staticmethod
+    def get_firefox_build(firefox_bin: Path) -> Optional[Dict[str, str]]:
+        """
+        Reads the version, build ID and source revision of a Firefox build from its application.ini
+        """
+        parser = configparser.ConfigParser()
+        firefox_bin = Path(firefox_bin)
+        for ini_path in [firefox_bin.parent.parent / "Resources" / "application.ini", firefox_bin.parent / "application.ini"]:
+            if parser.read(ini_path) and parser.has_section("App"):
+                return dict(parser["App"])
+        return None
+
     @staticmethod
     def is_search_engine_url(url: str) -> str:
         """
@@ -189,312 +541,797 @@ class MemoryEvaluator:
             return "search"
         return "history"
 
-    def generate_memories(self, profile_files: List[str], batch_id: int) -> Dict[str, List]:
+    @staticmethod
+    def run_eval_js_script(
+        firefox,
+        script_name: str,
+        script: str,
+        request: Dict,
+        script_calls: List[Dict],
+        tracer: Optional[Tracer] = None,
+        **span_tags
+    ) -> Dict[str, Dict]:
         """
-        Generates memories for a batch of profile files
+        Runs an eval JS script in the browser and records its latency
+        Profiles that failed in the script get an {"error": ...} result, the other profiles' results are unaffected
         """
-        log_header = f"[Thread {batch_id}]"
-        all_results = {}
-        total_profiles = len(profile_files)
-        for profile_id, profile_file in enumerate(profile_files):
-            profile_name = profile_file.split("/")[-1].replace(".csv", "")
-            profile_log_header = log_header + f"[{profile_id+1}/{total_profiles}]"
-            print(f"{profile_log_header} Generating memories for profile \"{profile_name}\"")
-            profile_dir = f"{self.outdir}/{MEMORIES_GENERATION}/{profile_name}"
-            os.mkdir(profile_dir)
-
-            profile_data = pd.read_csv(profile_file)
-            profile_data = profile_data.drop(["category", "intent"], axis=1)
-            profile_data.columns = ["url", "domain", "title", "visitDateMicros", "frequencyPct", "domainFrequencyPct"]
-            profile_data["source"] = profile_data["url"].map(lambda url: MemoryEvaluator.is_search_engine_url(url))
-            profile_data.to_csv(f"{profile_dir}/memories_generation_input.csv")
-
-            # Render eval JS script with data injected
-            eval_js_script = EVAL_JS_SCRIPT_HEADER + profile_data.to_json(orient="records") + EVAL_JS_SCRIPT_FOOTER
-
-            # Set up the Selenium Firefox driver
-            firefox = FirefoxInference(
-                firefox_bin=self.firefox_bin,
-                headless=True,
-                ml_prefs=self.aiwindow_prefs
-            )
-            firefox.driver.set_context(firefox.driver.CONTEXT_CHROME)
-            firefox.driver.set_script_timeout(180)
+        tracer = tracer if tracer is not None else Tracer()
+        start = time.perf_counter()
+        with tracer.span(f"js_{script_name}", **span_tags):
+            results = firefox.driver.execute_async_script(script, request)
+        script_calls.append({"script": script_name, "seconds": time.perf_counter() - start})
+        return results
 
-            results = []
-            for i in range(self.config.memories_generation.n_passes):
-                memories = firefox.driver.execute_async_script(eval_js_script)
-                results.append(memories)
-                with open(f"{profile_dir}/pass_{i}_generated_memories.json", "w") as _o:
-                    json.dump(memories, _o, indent=2)
-
-            firefox.quit()
-            all_results[profile_name] = results
-            print(f"{profile_log_header} Completed memories for \"{profile_name}\"")
-        return all_results
-
-    def batch_generate_memories(self) -> Dict:
+    @staticmethod
+    def failed_passes(n_passes: int, error: str) -> Dict:
         """
-        Orchestrates multiprocessing for running memory generation from profile file batches
+        A profile's pass results when all of its passes failed with the same error, as saved by save_generated_passes
         """
+        return {"passes": [None] * n_passes, "errors": [error] * n_passes}
 
-        mem_gen_conf = self.config.memories_generation
-
-        profile_files = glob.glob(f"{self.config.data.records_path}/*.csv")
-
-        profile_file_batches = np.array_split(np.array(profile_files), min(len(profile_files), mem_gen_conf.max_threads))
-
-        tasks = []
-        generated_memories = {}
-        with ThreadPoolExecutor(max_workers=mem_gen_conf.max_threads) as executor:
-            for batch_id, profile_file_batch in enumerate(profile_file_batches):
-                tasks.append(
-                    executor.submit(
-                        self.generate_memories,
-                        profile_file_batch,
-                        batch_id
-                    )
-                )
-            for task in as_completed(tasks):
-                generated_memories |= task.result()
-
-        return generated_memories
+    @staticmethod
+    def to_columnar_rows(profile_data: pd.DataFrame) -> Dict[str, List]:
+        """
+        Converts profile rows to a column name -> values mapping, with missing values as nulls
+        """
+        return profile_data.astype(object).where(profile_data.notna(), None).to_dict(orient="list")
 
     @staticmethod
-    def extract_and_parse_json_response(response: str) -> Dict:
+    def load_profile_rows(profile_file: str) -> pd.DataFrame:
         """
-        Finds and extract JSON markdown content from an LLM response
+        Loads a profile file into the row format expected by the Firefox insights pipeline
         """
-        return json.loads(JSON_REGEX.findall(response)[0])
+        profile_data = pd.read_csv(profile_file)
+        profile_data = profile_data.drop(["category", "intent"], axis=1)
+        profile_data.columns = ["url", "domain", "title", "visitDateMicros", "frequencyPct", "domainFrequencyPct"]
+        profile_data["source"] = profile_data["url"].map(lambda url: MemoryEvaluator.is_search_engine_url(url))
+        return profile_data
 
-    def compare_memory_to_queries(self, memory: str, used_queries: List[str]) -> List[str]:
+    def prepare_profile(self, profile_file: str) -> Tuple[str, str, pd.DataFrame]:
         """
-        Prompts an LLM to compare a single generated memory to existing search queries to find related sets
+        Loads a profile file and saves the rows given to the insights pipeline in its output directory
         """
+        profile_name = profile_file.split("/")[-1].replace(".csv", "")
+        profile_dir = f"{self.outdir}/{MEMORIES_GENERATION}/{profile_name}"
+        os.makedirs(profile_dir, exist_ok=True)
 
-        prompt = f"""
-Determine if any of the below Search Queries are related to the Statement. You may find multiple related queries, but be strict in your assessment.
-For a query to be related to the Statement, it must:
-1. Be highly semantically similar to the Statement.
-2. Reference identical or similar entities, topics, or concepts as the Statement.
-3. Can be used as evidence for the Statement.
+        profile_data = MemoryEvaluator.load_profile_rows(profile_file)
+        with self.tracer.span("csv_write", file="memories_generation_input.csv"):
+            atomic_write_csv(profile_data, f"{profile_dir}/memories_generation_input.csv")
+        return profile_name, profile_dir, profile_data
 
-Statement: "{memory}"
+    def load_completed_passes(self, profile_name: str) -> List[Optional[List]]:
+        """
+        Loads the generated memories of every pass already saved for a profile, with None for missing passes
+        """
+        profile_dir = f"{self.outdir}/{MEMORIES_GENERATION}/{profile_name}"
+        passes = []
+        for i in range(self.config.memories_generation.n_passes):
+            memories = load_json_if_valid(f"{profile_dir}/pass_{i}_generated_memories.json")
+            passes.append(memories if isinstance(memories, list) else None)
+        return passes
+
+    def next_pass_counts(self, missing_passes: Dict[str, List[int]]) -> Dict[str, int]:
+        """
+        Number of passes to generate per profile in the next round, all missing passes at once when concurrent_passes is set
+        """
+        return {
+            profile_name: len(pass_ids) if self.config.memories_generation.concurrent_passes else 1
+            for profile_name, pass_ids in missing_passes.items() if pass_ids
+        }
 
-Search Queries:
-- {"\n- ".join(['"' + query + '"' for query in used_queries])}
+    def save_generated_passes(
+        self,
+        pass_results: Dict[str, Dict],
+        group_profiles: Dict[str, Tuple[str, pd.DataFrame]],
+        missing_passes: Dict[str, List[int]],
+        group_results: Dict[str, List],
+        prepare_timings: Dict[str, Dict]
+    ):
+        """
+        Saves newly generated passes into their missing slots, along with the stage timings of each pass when there are any
+        Failed passes, None in pass_results, are recorded with their error instead, so they are generated again on --resume
+        """
+        for profile_name, profile_result in pass_results.items():
+            profile_dir, _ = group_profiles[profile_name]
+            pass_timings = profile_result.get("timings") or [None] * len(profile_result["passes"])
+            pass_errors = profile_result.get("errors") or [None] * len(profile_result["passes"])
+            for memories, generate_timings, error in zip(profile_result["passes"], pass_timings, pass_errors):
+                i = missing_passes[profile_name].pop(0)
+                group_results[profile_name][i] = memories
+                if memories is None:
+                    print(f"Failed to generate pass {i} of \"{profile_name}\", it is left out of the metrics: {error}")
+                    atomic_write_json(f"{profile_dir}/pass_{i}_{GENERATION_FAILED_SUFFIX}", {"error": error})
+                    if os.path.exists(f"{profile_dir}/pass_{i}_generated_memories.json"):
+                        os.remove(f"{profile_dir}/pass_{i}_generated_memories.json")
+                else:
+                    atomic_write_json(f"{profile_dir}/pass_{i}_generated_memories.json", memories)
+                    if os.path.exists(f"{profile_dir}/pass_{i}_{GENERATION_FAILED_SUFFIX}"):
+                        os.remove(f"{profile_dir}/pass_{i}_{GENERATION_FAILED_SUFFIX}")
+                if generate_timings is not None:
+                    atomic_write_json(f"{profile_dir}/pass_{i}_timings.json", {
+                        "prepare": prepare_timings.get(profile_name, {}),
+                        "generate": generate_timings
+                    })
+                elif os.path.exists(f"{profile_dir}/pass_{i}_timings.json"):
+                    os.remove(f"{profile_dir}/pass_{i}_timings.json")
+                # Judgments saved for a previous version of this pass are stale now
+                for stale_artifact in glob.glob(f"{self.outdir}/{METRICS_ARTIFACTS}/{glob.escape(profile_name)}/pass_{i}_*"):
+                    os.remove(stale_artifact)
 
-BE STRICT IN YOUR ASSESEMENT AND ADHERE TO THE ABOVE CRITERIA. Prefer to return an empty list than loosely or partially related queries.
+    def generate_firefox_passes(
+        self,
+        group_profiles: Dict[str, Tuple[str, pd.DataFrame]],
+        missing_passes: Dict[str, List[int]],
+        group_results: Dict[str, List]
+    ) -> Dict:
+        """
+        Generates a group's missing passes in a pooled Firefox driver and returns the script stats
+        """
+        # Aggregate each profile's history once, then only run insight generation per pass
+        profile_names = list(group_profiles.keys())
+        prepare_request = {
+            "profiles": {
+                profile_name: MemoryEvaluator.to_columnar_rows(profile_data)
+                for profile_name, (_, profile_data) in group_profiles.items()
+            }
+        }
+        script_stats = {
+            "payload_bytes": {
+                "columnar": len(json.dumps(prepare_request)),
+                "records": sum([len(profile_data.to_json(orient="records")) for _, profile_data in group_profiles.values()])
+            },
+            "script_calls": []
+        }
 
-Give your answer as a JSON list in the following format:
-```json
-[
-    "Related Query 1",
-    "Related Query 2",
-    ...
-]
-```
-"""
-        while True:
+        # Borrow a warm Selenium Firefox driver from the pool
+        with self.driver_pool.driver() as firefox:
             try:
-                resp = self.openai_client.chat.completions.create(
-                    model=self.config.openai.model,
-                    messages=[
-                        {"role": "system", "content": "You are an expert at finding relationships between statements and search queries."},
-                        {"role": "user", "content": prompt},
-                    ],
+                prepare_results = MemoryEvaluator.run_eval_js_script(
+                    firefox, "prepare_sources", EVAL_JS_PREPARE_SOURCES_SCRIPT, prepare_request, script_stats["script_calls"], self.tracer
                 )
-                comparison_json_out = [query for query in MemoryEvaluator.extract_and_parse_json_response(resp.choices[0].message.content) if query in used_queries]
-                break
-            except Exception as e:
-                print(f"Failed to extract insight/query comparison data: {e}")
-                continue
-        return comparison_json_out
+                prepare_timings = {profile_name: prepare_result.get("timings", {}) for profile_name, prepare_result in prepare_results.items()}
+                # Every missing pass of a profile whose sources could not be prepared fails, like failed offline passes
+                failed_prepares = {
+                    profile_name: MemoryEvaluator.failed_passes(len(missing_passes[profile_name]), f"Preparing sources failed: {prepare_result['error']}")
+                    for profile_name, prepare_result in prepare_results.items() if "error" in prepare_result
+                }
+                self.save_generated_passes(failed_prepares, group_profiles, missing_passes, group_results, prepare_timings)
+                while any(missing_passes.values()):
+                    generate_request = {"nPasses": self.next_pass_counts(missing_passes)}
+                    pass_ids = {profile_name: missing_passes[profile_name][:n_passes] for profile_name, n_passes in generate_request["nPasses"].items()}
+                    pass_results = MemoryEvaluator.run_eval_js_script(
+                        firefox, "generate_insights", EVAL_JS_GENERATE_INSIGHTS_SCRIPT, generate_request, script_stats["script_calls"], self.tracer,
+                        pass_id=pass_ids
+                    )
+                    pass_results = {
+                        profile_name: MemoryEvaluator.failed_passes(len(pass_ids[profile_name]), profile_result["error"])
+                        if "error" in profile_result else profile_result
+                        for profile_name, profile_result in pass_results.items()
+                    }
+                    self.record_firefox_usage(pass_results, pass_ids)
+                    self.save_generated_passes(pass_results, group_profiles, missing_passes, group_results, prepare_timings)
+            finally:
+                try:
+                    MemoryEvaluator.run_eval_js_script(
+                        firefox, "release_sources", EVAL_JS_RELEASE_SOURCES_SCRIPT, {"profileNames": profile_names}, script_stats["script_calls"], self.tracer
+                    )
+                except Exception as e:
+                    # The driver may have died, which must not hide the error that generation raised
+                    print(f"Failed to release the cached sources of {profile_names}: {e!r}")
+        return script_stats
 
-    def find_duplicates(self, memories: List[str]) -> List[List[str]]:
+    def record_firefox_usage(self, pass_results: Dict[str, Dict], pass_ids: Dict[str, List[int]]):
         """
-        Prompts an LLM to identify close or identical semantic duplicates in a set of memories
+        Records the token usage of the model calls timed in the browser, for engines that return it
         """
+        for profile_name, profile_result in pass_results.items():
+            for pass_id, generate_timings in zip(pass_ids[profile_name], profile_result.get("timings") or []):
+                for model_call in generate_timings.get("model_calls", []):
+                    if model_call.get("usage"):
+                        self.token_ledger.record("generation", self.config.lite_llm.model, model_call["usage"], persona=profile_name, pass_id=pass_id)
 
-        prompt = """
-Examine the list of statements below and determine if there are any groups of statements that express the exact same semantic meaning with different wording.
-If you identify such groups, provide them as lists below. Each statement must only belong to a single list, so if you want to add a statement to multiple lists, combine the lists.
-
-Statements:""" + f"""
-- {"\n- ".join(['"' + memory + '"' for memory in memories])}""" + """
-
-Along with your answer, provide your justification and reasoning.
-Give your answer as a JSON object in the following format:
-```json
-{
-    "justification": "your justification here",
-    "similar_statement_groups": [
-        ["Duplicate Statement 1.1", "Duplicate Statement 1.2", "Duplicate Statement 1.3"],
-        ["Duplicate Statement 2.1", "Duplicate Statement 2.2"],
-        ...
-    ]
-}
-```
-If you do not identify any groups of such statements, simply return an empty list with your justification.
-"""
-        while True:
+    def generate_offline_pass(self, profile_name: str, pass_id: int, sources: Dict[str, List]) -> Tuple[Optional[List[Dict]], Dict, Optional[str]]:
+        """
+        Runs one offline insight generation pass, traced with its profile and pass, and returns it with its stage timings
+        A pass the generator gave up on is returned as None with its error
+        """
+        timings = {}
+        insights, error = None, None
+        start = time.perf_counter()
+        # Executor threads do not inherit the caller's trace tags, so the pass sets its own for spans and token usage
+        with trace_tags(persona=profile_name, pass_id=pass_id), self.tracer.span("offline_generate_insights"):
             try:
-                resp = self.openai_client.chat.completions.create(
-                    model=self.config.openai.model,
-                    messages=[
-                        {"role": "system", "content": "You are an expert at finding groups of similar statements."},
-                        {"role": "user", "content": prompt}
-                    ]
-                )
-                dup_json_out = MemoryEvaluator.extract_and_parse_json_response(resp.choices[0].message.content)
-                break
-            except Exception as e:
-                print(f"Failed to extract duplicates list: {e}")
-                continue
-
-        return dup_json_out
+                insights = self.insights_generator.generate(sources, timings)
+            except InsightsGenerationError as e:
+                error = str(e)
+        timings["generate_insights_ms"] = (time.perf_counter() - start) * 1000
+        return insights, timings, error
 
-    def compute_metrics(self, results_df: pd.DataFrame, used_queries: List[str], profile_dir: str):
+    def generate_offline_passes(
+        self,
+        group_profiles: Dict[str, Tuple[str, pd.DataFrame]],
+        missing_passes: Dict[str, List[int]],
+        group_results: Dict[str, List]
+    ) -> Dict:
         """
-        Computes evaluation metrics for a profile's generated memories
+        Generates a group's missing passes with the Python port of the insights pipeline and returns the script stats
         """
+        script_stats = {"script_calls": []}
+
+        start = time.perf_counter()
+        prepare_timings = {profile_name: {} for profile_name in group_profiles}
+        with self.tracer.span("offline_prepare_sources"):
+            group_sources = {
+                profile_name: prepare_sources(profile_data, timings=prepare_timings[profile_name])
+                for profile_name, (_, profile_data) in group_profiles.items()
+            }
+        script_stats["script_calls"].append({"script": "prepare_sources", "seconds": time.perf_counter() - start})
+
+        while any(missing_passes.values()):
+            start = time.perf_counter()
+            pass_counts = self.next_pass_counts(missing_passes)
+            with ThreadPoolExecutor(max_workers=sum(pass_counts.values())) as executor:
+                pass_tasks = {
+                    profile_name: [
+                        executor.submit(self.generate_offline_pass, profile_name, pass_id, group_sources[profile_name])
+                        for pass_id in missing_passes[profile_name][:n_passes]
+                    ]
+                    for profile_name, n_passes in pass_counts.items()
+                }
+                pass_outputs = {profile_name: [task.result() for task in tasks] for profile_name, tasks in pass_tasks.items()}
+            pass_results = {
+                profile_name: {
+                    "passes": [insights for insights, _, _ in outputs],
+                    "timings": [timings for _, timings, _ in outputs],
+                    "errors": [error for _, _, error in outputs]
+                }
+                for profile_name, outputs in pass_outputs.items()
+            }
+            script_stats["script_calls"].append({"script": "generate_insights", "seconds": time.perf_counter() - start})
+            self.save_generated_passes(pass_results, group_profiles, missing_passes, group_results, prepare_timings)
+        return script_stats
+
+    def generate_memories(
+        self,
+        profile_files: List[str],
+        log_header: str,
+        on_profile_complete: Optional[Callable[[str, List], None]] = None
+    ) -> Dict[str, List]:
+        """
+        Generates memories for a group of up to profiles_per_driver profile files, run at once in one browser
+        Passes already saved in the output directory are reused rather than generated again
+        on_profile_complete is called with each profile's passes as soon as they are all available
+        """
+        group_profiles = {}
+        group_results = {}
+        missing_passes = {}
+        profile_names = [profile_file.split("/")[-1].replace(".csv", "") for profile_file in profile_files]
+        with trace_tags(persona=profile_names[0] if len(profile_names) == 1 else profile_names), self.tracer.span("profile_generation"):
+            for profile_file in profile_files:
+                profile_name, profile_dir, profile_data = self.prepare_profile(profile_file)
+                print(f"{log_header} Generating memories for profile \"{profile_name}\"")
+                group_profiles[profile_name] = (profile_dir, profile_data)
+                group_results[profile_name] = self.load_completed_passes(profile_name)
+                missing_passes[profile_name] = [i for i, memories in enumerate(group_results[profile_name]) if memories is None]
+
+            if self.insights_generator is not None:
+                script_stats = self.generate_offline_passes(group_profiles, missing_passes, group_results)
+            else:
+                script_stats = self.generate_firefox_passes(group_profiles, missing_passes, group_results)
+
+        for profile_dir, _ in group_profiles.values():
+            atomic_write_json(f"{profile_dir}/script_stats.json", script_stats)
+
+        for profile_name in group_profiles:
+            print(f"{log_header} Completed memories for \"{profile_name}\"")
+            if on_profile_complete is not None:
+                on_profile_complete(profile_name, group_results[profile_name])
+        return group_results
 
-        run_ids = set(results_df["run_idx"].tolist())
-        results = []
-
-        for run_id in sorted(run_ids):
-            run_df = results_df[results_df["run_idx"] == run_id]
-            total_rows = len(run_df)
+    @staticmethod
+    def count_records(profile_file: str) -> int:
+        """
+        Counts the history records of a profile file, used as its generation cost
+        """
+        with open(profile_file, "r") as _f:
+            return sum([1 for _ in _f]) - 1
 
-            # Coverage -> each memory has at least 1 query
-            memories_with_at_least_one_query = len(run_df[run_df["count_related_queries"] > 0])
+    def batch_generate_memories(self, on_profile_complete: Optional[Callable[[str, List], None]] = None) -> SavedGenerations:
+        """
+        Orchestrates multithreading for memory generation, threads pull one profile group at a time from a shared queue
+        Every pass is saved as soon as it is generated, the generated profiles are returned as a lazy view over the saved passes
+        """
 
-            # Extra -> memories without a query
-            memories_without_a_query = len(run_df[run_df["count_related_queries"] == 0])
+        mem_gen_conf = self.config.memories_generation
 
-            # Missing -> queries without an memory
-            query_coverage_counts = {query: set() for query in used_queries}
-            for _, row in run_df.iterrows():
-                for related_query in row["related_queries"]:
-                    query_coverage_counts[related_query].add(row["insight_summary"])
-            queries_without_a_memory = [query for query, related_memory_set in query_coverage_counts.items() if len(related_memory_set) == 0]
-            queries_without_a_memory_count = len(queries_without_a_memory)
+        profile_files = sorted(glob.glob(f"{self.config.data.records_path}/*.csv"))
+        shard_profiles = set(self.select_shard([profile_file.split("/")[-1].replace(".csv", "") for profile_file in profile_files]))
+        profile_files = [profile_file for profile_file in profile_files if profile_file.split("/")[-1].replace(".csv", "") in shard_profiles]
 
-            # Duplicates -> memories mapped to the same query
-            generated_memories = run_df["insight_summary"].tolist()
-            duplicates_out = self.find_duplicates(generated_memories)
-            with open(f"{profile_dir}/pass_{run_id}_duplicates_results.json", "w") as _o:
-                json.dump(duplicates_out, _o, indent=2)
-            duplicate_memories = set()
-            for similar_statement_group in duplicates_out["similar_statement_groups"]:
-                duplicate_memories |= set([similar_memory for similar_memory in similar_statement_group if similar_memory in generated_memories])
+        # Resume from saved passes, only profiles with missing passes need a browser
+        generated_profiles = []
+        pending_files = []
+        for profile_file in profile_files:
+            profile_name = profile_file.split("/")[-1].replace(".csv", "")
+            completed_passes = self.load_completed_passes(profile_name)
+            if all([memories is not None for memories in completed_passes]):
+                print(f"Reusing saved memories for profile \"{profile_name}\"")
+                generated_profiles.append(profile_name)
+                if on_profile_complete is not None:
+                    on_profile_complete(profile_name, completed_passes)
+            else:
+                pending_files.append(profile_file)
+
+        if self.config.scheduler.longest_job_first:
+            pending_files.sort(key=MemoryEvaluator.count_records, reverse=True)
+        profile_groups = [
+            pending_files[group_start:group_start + mem_gen_conf.profiles_per_driver]
+            for group_start in range(0, len(pending_files), mem_gen_conf.profiles_per_driver)
+        ]
+
+        try:
+            group_results, schedule_stats = run_work_queue(
+                profile_groups,
+                lambda profile_group, log_header: list(self.generate_memories(profile_group, log_header, on_profile_complete)),
+                n_workers=mem_gen_conf.max_threads,
+                label="Memories generation",
+                should_stop=self.token_ledger.budget_exceeded
+            )
+        finally:
+            if self.driver_pool is not None:
+                self.driver_pool.close()
+        self.record_schedule_stats(schedule_stats)
+        for group_result in group_results:
+            # Groups skipped once the token budget ran out have no result
+            if group_result is not None:
+                generated_profiles += group_result
+
+        return SavedGenerations(f"{self.outdir}/{MEMORIES_GENERATION}", mem_gen_conf.n_passes, personas=generated_profiles)
+
+    def judge_memories(self, memories: List[str], used_queries: List[str], profile_dir: str, run_ids: List[int]) -> List[List[str]]:
+        """
+        Finds the related queries of every memory, optionally shortlisting candidate queries with the local prefilter first
+        run_ids gives each memory's pass, the prefilter's candidates and audit are saved per pass so resumed runs keep earlier passes'
+        Memories the judge gave up on get None
+        """
+        prefilter_conf = self.config.metrics_computation.prefilter
+        if prefilter_conf is None:
+            return self.judge.run(self.judge.compare_memories_to_queries(memories, used_queries))
+
+        candidate_queries = shortlist_queries(memories, used_queries, prefilter_conf.top_k, prefilter_conf.min_similarity)
+        pass_memory_idx = {}
+        for memory_idx, run_id in enumerate(run_ids):
+            pass_memory_idx.setdefault(run_id, []).append(memory_idx)
+        for run_id, memory_idx in pass_memory_idx.items():
+            atomic_write_json(f"{profile_dir}/pass_{run_id}_prefilter_candidates.json", [candidate_queries[idx] for idx in memory_idx])
+        related_queries = self.judge.run(self.judge.compare_memories_to_candidate_queries(memories, candidate_queries))
+
+        if prefilter_conf.audit:
+            full_related_queries = self.judge.run(self.judge.compare_memories_to_queries(memories, used_queries))
+            for run_id, memory_idx in pass_memory_idx.items():
+                pass_related = [related_queries[idx] for idx in memory_idx]
+                pass_full_related = [full_related_queries[idx] for idx in memory_idx]
+                if None in pass_related or None in pass_full_related:
+                    print(f"Skipping the prefilter audit of pass {run_id} of \"{profile_dir}\", some memories could not be judged")
+                    continue
+                atomic_write_json(
+                    f"{profile_dir}/pass_{run_id}_prefilter_recall.json",
+                    shortlist_recall([candidate_queries[idx] for idx in memory_idx], pass_related, pass_full_related)
+                )
+        return related_queries
 
-            results.append({
-                "run_id": run_id,
-                "total_memories_generated": total_rows,
-                "total_queries": len(used_queries),
-                "coverage_count": memories_with_at_least_one_query,
-                "coverage_perc": memories_with_at_least_one_query / total_rows,
-                "extra_count": memories_without_a_query,
-                "extra_perc": memories_without_a_query / total_rows,
-                "missing_count": queries_without_a_memory_count,
-                "missing_perc": queries_without_a_memory_count / len(used_queries),
-                "queries_without_a_memory": queries_without_a_memory,
-                "duplicate_count": len(duplicate_memories),
-                "duplicate_perc": len(duplicate_memories) / total_rows
-            })
+    def judge_runs(self, results_df: pd.DataFrame, used_queries: List[str], profile_dir: str) -> pd.Series:
+        """
+        Finds the related queries of every memory, reusing per-pass judgments saved by an earlier run
+        Passes with memories the judge gave up on are not saved and get None for all their memories, so they are left out of
+        the metrics and judged again on --resume
+        """
+        related_queries = pd.Series([None] * len(results_df), index=results_df.index, dtype=object)
+        missing_run_ids = []
+        for run_id in sorted(set(results_df["run_idx"].tolist())):
+            run_mask = results_df["run_idx"] == run_id
+            saved_judgments = load_json_if_valid(f"{profile_dir}/pass_{run_id}_related_queries.json")
+            if isinstance(saved_judgments, dict) and saved_judgments.get("memories") == results_df[run_mask]["insight_summary"].tolist():
+                related_queries[run_mask] = pd.Series(
+                    [[query for query in queries if query in used_queries] for queries in saved_judgments["related_queries"]],
+                    index=results_df.index[run_mask],
+                    dtype=object
+                )
+            else:
+                missing_run_ids.append(run_id)
+
+        if missing_run_ids:
+            self.check_judging(missing_run_ids, profile_dir)
+            missing_df = results_df[results_df["run_idx"].isin(missing_run_ids)]
+            with self.tracer.span("query_judging", pass_id=missing_run_ids, memories=len(missing_df)):
+                judged = pd.Series(
+                    self.judge_memories(missing_df["insight_summary"].tolist(), used_queries, profile_dir, missing_df["run_idx"].tolist()),
+                    index=missing_df.index,
+                    dtype=object
+                )
+            for run_id in missing_run_ids:
+                run_mask = missing_df["run_idx"] == run_id
+                if judged[run_mask].isna().any():
+                    print(f"Failed to judge pass {run_id} of \"{profile_dir}\", it is left out of the metrics")
+                    judged[run_mask] = None
+                    continue
+                atomic_write_json(f"{profile_dir}/pass_{run_id}_related_queries.json", {
+                    "memories": missing_df[run_mask]["insight_summary"].tolist(),
+                    "related_queries": judged[run_mask].tolist()
+                })
+            related_queries[judged.index] = judged
+        return related_queries
+
+    def check_judging(self, missing_run_ids: List[int], profile_dir: str):
+        """
+        Raises when judgments are missing but the judge stage is not run, as only it may call the judge
+        """
+        if "judge" not in self.stages:
+            raise RuntimeError(f"No saved judgments for passes {missing_run_ids} in \"{profile_dir}\", run the judge stage to create them")
 
-        final_results = pd.DataFrame(results)
+    def report_tracing(self):
+        """
+        Exports the run's spans as a Chrome trace and prints p50/p95/p99 latency per stage
+        """
+        self.tracer.close()
+        if not self.tracer.spans:
+            return
+        atomic_write_json(f"{self.outdir}/trace.chrome.json", to_chrome_trace(self.tracer.spans))
+        stage_latency_df = summarize_spans(self.tracer.spans)
+        atomic_write_csv(stage_latency_df, f"{self.outdir}/stage_latency.csv")
+        print(f"Stage latency in seconds:\n{stage_latency_df.to_string(float_format=lambda seconds: f'{seconds:.3f}')}")
+
+    def report_token_usage(self):
+        """
+        Saves and prints tokens and cost per stage, per persona and for the whole run
+        """
+        token_costs_df = self.token_ledger.summary()
+        if token_costs_df.empty:
+            return
+        atomic_write_csv(token_costs_df, f"{self.outdir}/{TOKEN_COSTS_FILE}")
+        print(f"Token usage:\n{token_costs_df.to_string(index=False, float_format=lambda cost: f'{cost:.4f}')}")
+        if self.token_ledger.budget_exceeded():
+            print("Token budget reached, work left unscheduled can be completed with --resume and a larger budget")
+
+    def report_generation_latency(self):
+        """
+        Collects the stage timings saved with every pass into p50/p95/p99 latency per generation stage, in milliseconds
+        """
+        stage_samples = []
+        seen_prepare_timings = set()
+        for timings_file in sorted(glob.glob(f"{self.outdir}/{MEMORIES_GENERATION}/*/pass_*_timings.json")):
+            pass_timings = load_json_if_valid(timings_file)
+            if not isinstance(pass_timings, dict):
+                continue
+            # Passes of a profile share its prepare timings, count them once
+            prepare_key = (timings_file.split("/")[-2], json.dumps(pass_timings.get("prepare", {}), sort_keys=True))
+            timed_sections = [pass_timings.get("generate", {})]
+            if prepare_key not in seen_prepare_timings:
+                seen_prepare_timings.add(prepare_key)
+                timed_sections.append(pass_timings.get("prepare", {}))
+            for section in timed_sections:
+                stage_samples.extend([
+                    {"name": stage[:-len("_ms")], "duration": ms}
+                    for stage, ms in section.items() if stage.endswith("_ms") and isinstance(ms, (int, float))
+                ])
+            stage_samples.extend([
+                {"name": f"model_call:{model_call['method']}", "duration": model_call["ms"]}
+                for model_call in pass_timings.get("generate", {}).get("model_calls", [])
+            ])
+        if not stage_samples:
+            return
+        generation_latency_df = summarize_spans(stage_samples)
+        atomic_write_csv(generation_latency_df, f"{self.outdir}/generation_latency.csv")
+        print(f"Generation stage latency in milliseconds:\n{generation_latency_df.to_string(float_format=lambda ms: f'{ms:.1f}')}")
+
+    def report_prefilter_recall(self):
+        """
+        Collects per-pass prefilter audits into a recall report against the full-LLM judgments
+        """
+        audits = []
+        for audit_file in sorted(glob.glob(f"{self.outdir}/{METRICS_ARTIFACTS}/*/pass_*_prefilter_recall.json")):
+            with open(audit_file, "r") as _j:
+                run_id = int(audit_file.split("/")[-1].split("_")[1])
+                audits.append({"persona_id": audit_file.split("/")[-2], "run_id": run_id, **json.load(_j)})
+        if not audits:
+            return
+        audits_df = pd.DataFrame(audits)
+        atomic_write_csv(audits_df, f"{self.outdir}/prefilter_recall.csv")
+        full_pairs = audits_df["full_llm_pairs"].sum()
+        print(
+            f"Prefilter shortlist recall: {audits_df['full_llm_pairs_shortlisted'].sum() / max(full_pairs, 1):.3f}, "
+            f"judge recall: {audits_df['full_llm_pairs_matched'].sum() / max(full_pairs, 1):.3f} "
+            f"over {full_pairs} full-LLM memory/query matches"
+        )
+
+    def judge_duplicates(self, results_df: pd.DataFrame, profile_dir: str) -> Dict[int, Dict]:
+        """
+        Finds the duplicates within each of a profile's runs, saved to the profile's artifacts for reuse
+        Runs the judge gave up on are neither saved nor returned
+        """
 
-        return final_results
+        memories_by_run = results_df.groupby("run_idx", sort=True)["insight_summary"].agg(list)
+        run_ids = memories_by_run.index.tolist()
+
+        # Reuse duplicates saved by an earlier run, find the rest for every run concurrently
+        duplicates_outs = {}
+        for run_id in run_ids:
+            saved_duplicates = load_json_if_valid(f"{profile_dir}/pass_{run_id}_duplicates_results.json")
+            if isinstance(saved_duplicates, dict) and "similar_statement_groups" in saved_duplicates:
+                duplicates_outs[run_id] = saved_duplicates
+        missing_run_ids = [run_id for run_id in run_ids if run_id not in duplicates_outs]
+        if missing_run_ids:
+            self.check_judging(missing_run_ids, profile_dir)
+        found_duplicates = self.judge.run(self.judge.find_duplicates_in_runs(
+            [memories_by_run[run_id] for run_id in missing_run_ids],
+            self.duplicate_detector,
+            missing_run_ids
+        ))
+        for run_id, duplicates_out in zip(missing_run_ids, found_duplicates):
+            if duplicates_out is None:
+                print(f"Failed to find duplicates of pass {run_id} of \"{profile_dir}\", it is left out of the metrics")
+                continue
+            atomic_write_json(f"{profile_dir}/pass_{run_id}_duplicates_results.json", duplicates_out)
+            duplicates_outs[run_id] = duplicates_out
+        return duplicates_outs
 
-    def aggregate_metrics(self, personas: List[str], generated_memories: Dict[str, List[List[str]]], batch_id: str) -> Union[List, List]:
+    def compute_metrics(
+        self,
+        persona: str,
+        results_df: pd.DataFrame,
+        used_queries: List[str],
+        duplicates_outs: Dict[int, Dict],
+        failed_run_ids: List[int]
+    ) -> pd.DataFrame:
+        """
+        Computes evaluation metrics for a profile's judged memories, every run at once
+        Runs that failed to generate, given in failed_run_ids, or could not be fully judged get a row of missing metrics,
+        so they are excluded from aggregates
         """
-        Aggregates eval metrics for a batch of personas
+        if not results_df.empty:
+            failed_run_ids = sorted(
+                set(failed_run_ids)
+                | set(results_df[results_df["related_queries"].isna()]["run_idx"].tolist())
+                | (set(results_df["run_idx"].tolist()) - set(duplicates_outs))
+            )
+        judged_df = results_df[~results_df["run_idx"].isin(failed_run_ids)] if not results_df.empty else results_df
+        failed_metrics_df = pd.DataFrame({"persona_id": persona, "run_id": failed_run_ids}).reindex(columns=METRICS_COLUMNS)
+        if judged_df.empty:
+            print(f"No judged passes for \"{persona}\", its metrics are missing")
+            return failed_metrics_df
+        metrics_df = compute_metrics_frame(
+            judged_df,
+            {persona: used_queries},
+            {(persona, run_id): duplicates_out["similar_statement_groups"] for run_id, duplicates_out in duplicates_outs.items() if run_id not in failed_run_ids}
+        )
+        if not failed_run_ids:
+            return metrics_df
+        int_columns = metrics_df.select_dtypes("integer").columns
+        metrics_df = pd.concat([metrics_df, failed_metrics_df], ignore_index=True)
+        metrics_df[int_columns] = metrics_df[int_columns].astype("Int64")
+        return metrics_df.sort_values("run_id", kind="stable").reset_index(drop=True)
+
+    @contextmanager
+    def open_output_writers(self):
+        """
+        Streams the metrics and results of the enclosed block to their files, moved into place once it completes
+        """
+        output_conf = self.config.output
+        if "metrics" in self.stages:
+            self.metrics_writers = open_output_writers(self.outdir, METRICS_OUTPUT, output_conf.formats, output_conf.parquet_compression)
+        self.results_writers = open_output_writers(self.outdir, RESULTS_OUTPUT, output_conf.formats, output_conf.parquet_compression)
+        writers = self.metrics_writers + self.results_writers
+        try:
+            yield
+        except BaseException:
+            for writer in writers:
+                writer.discard()
+            raise
+        finally:
+            self.metrics_writers = []
+            self.results_writers = []
+        for writer in writers:
+            with self.tracer.span("output_write", file=os.path.basename(writer.path)) as span_tags:
+                span_tags["rows"] = writer.close()
+
+    def write_persona_outputs(self, persona_metrics_df: Optional[pd.DataFrame], persona_results_df: pd.DataFrame):
         """
+        Appends a persona's metrics and judged memories to the run's output files, skipping a persona without memories' results
+        """
+        for writer, persona_df in [(writer, persona_metrics_df) for writer in self.metrics_writers] + [(writer, persona_results_df) for writer in self.results_writers]:
+            if persona_df.empty and persona_df.columns.empty:
+                continue
+            with self.tracer.span("output_append", file=os.path.basename(writer.path)):
+                writer.append(persona_df)
 
-        log_header = f"[Thread {batch_id}]"
-        all_metrics = []
-        all_results = []
-        total_personas = len(personas)
-        for persona_id, persona in enumerate(personas):
-            persona_log_header = log_header + f"[{persona_id+1}/{total_personas}]"
-            print(f"{persona_log_header} Aggregating metrics for \"{persona}\"")
+    def aggregate_persona_metrics(self, persona: str, persona_passes: List[Optional[List[Dict]]], log_header: str):
+        """
+        Judges a persona's generated memories and computes its metrics, appended to the output CSVs
+        Passes that failed to generate, None in persona_passes, only get a row of missing metrics
+        """
+        with trace_tags(persona=persona), self.tracer.span("persona_metrics"):
+            print(f"{log_header} Aggregating metrics for \"{persona}\"")
             persona_source_data = pd.read_csv(f"{self.config.data.records_path}/{persona}.csv")
-            with open(f"{self.config.data.websites_path}/{persona}.json", "r") as _j:
-                persona_metadata = json.load(_j)
             profile_dir = f"{self.outdir}/{METRICS_ARTIFACTS}/{persona}"
-            os.mkdir(profile_dir)
+            os.makedirs(profile_dir, exist_ok=True)
 
-            persona_used_queries = [
-                query for query, pages in persona_metadata.items() if len(set([page["url"] for page in pages]).intersection(set(persona_source_data["url"].tolist()))) > 0
-            ]
-            with open(f"{profile_dir}/queries.json", "w") as _o:
-                json.dump(persona_used_queries, _o, indent=2)
+            persona_used_queries = find_used_queries(self.query_index["personas"][persona], persona_source_data["url"].tolist())
+            atomic_write_json(f"{profile_dir}/queries.json", persona_used_queries)
 
+            failed_run_ids = [run_idx for run_idx, batch in enumerate(persona_passes) if batch is None]
             persona_results_list = []
-            for run_idx, batch in enumerate(generated_memories[persona]):
-                for memory in batch:
+            for run_idx, batch in enumerate(persona_passes):
+                for memory in batch or []:
                     persona_results_list.append({
                         "run_idx": run_idx,
                         **memory
                     })
             persona_results_df = pd.DataFrame(persona_results_list)
-            persona_results_df["related_queries"] = persona_results_df["insight_summary"].map(
-                lambda memory_summary: self.compare_memory_to_queries(memory_summary, persona_used_queries)
+            duplicates_outs = {}
+            if not persona_results_df.empty:
+                persona_results_df.insert(0, "persona_id", [persona] * len(persona_results_df))
+                persona_results_df["related_queries"] = self.judge_runs(persona_results_df, persona_used_queries, profile_dir)
+                persona_results_df["count_related_queries"] = persona_results_df["related_queries"].map(
+                    lambda related_queries: None if related_queries is None else len(related_queries)
+                ).astype("Int64")
+                duplicates_outs = self.judge_duplicates(persona_results_df, profile_dir)
+            persona_metrics_df = (
+                self.compute_metrics(persona, persona_results_df, persona_used_queries, duplicates_outs, failed_run_ids)
+                if "metrics" in self.stages else None
             )
-            persona_results_df["count_related_queries"] = persona_results_df["related_queries"].map(lambda related_queries: len(related_queries))
-            persona_metrics_df = self.compute_metrics(persona_results_df, persona_used_queries, profile_dir)
+            self.write_persona_outputs(persona_metrics_df, persona_results_df)
 
-            persona_metrics_df.insert(0, "persona_id", [persona] * len(persona_metrics_df))
-            persona_results_df.insert(0, "persona_id", [persona] * len(persona_results_df))
+            print(f"{log_header} Completed aggregating metrics for \"{persona}\"")
 
-            print(f"{persona_log_header} Completed aggregating metrics for \"{persona}\"")
-            all_metrics.append(persona_metrics_df)
-            all_results.append(persona_results_df)
-        return all_metrics, all_results
+    def consume_generated_profiles(self, completed_profiles: queue.Queue, consumer_id: int) -> List[Exception]:
+        """
+        Computes metrics for profiles as generation completes them, until a None sentinel is received
+        Errors are collected rather than raised so the queue keeps draining and generation never blocks on a dead consumer
+        """
+        log_header = f"[Metrics thread {consumer_id}]"
+        errors = []
+        while (completed_profile := completed_profiles.get()) is not None:
+            persona, persona_passes = completed_profile
+            if self.token_ledger.budget_exceeded():
+                print(f"{log_header} Token budget reached, skipping metrics for \"{persona}\"")
+                continue
+            try:
+                self.aggregate_persona_metrics(persona, persona_passes, log_header)
+            except Exception as e:
+                print(f"{log_header} Failed aggregating metrics for \"{persona}\": {e}")
+                errors.append(e)
+        return errors
 
-    def batch_aggregate_metrics(self, generated_memories: Dict[str, List[List[str]]]) -> pd.DataFrame:
+    def run_streaming(self):
         """
-        Orchestrates multiprocessing for eval metrics aggregation
+        Overlaps memory generation with metric computation through a bounded queue of completed profiles
         """
 
-        metrics_comp_conf = self.config.metrics_computation
-        all_personas = list(generated_memories.keys())
-        persona_batches = np.array_split(np.array(all_personas), min(len(all_personas), metrics_comp_conf.max_threads))
-
-        tasks = []
-        computed_metrics = []
-        all_results = []
-        with ThreadPoolExecutor(max_workers=metrics_comp_conf.max_threads) as executor:
-            for batch_id, persona_batch in enumerate(persona_batches):
-                tasks.append(
-                    executor.submit(
-                        self.aggregate_metrics,
-                        persona_batch,
-                        generated_memories,
-                        batch_id
-                    )
+        n_consumers = self.config.metrics_computation.max_threads
+        completed_profiles = queue.Queue(maxsize=self.config.pipeline.queue_size)
+
+        errors = []
+        with ThreadPoolExecutor(max_workers=n_consumers) as executor:
+            consumers = [
+                executor.submit(self.consume_generated_profiles, completed_profiles, consumer_id)
+                for consumer_id in range(n_consumers)
+            ]
+            try:
+                self.batch_generate_memories(
+                    on_profile_complete=lambda profile_name, passes: completed_profiles.put((profile_name, passes))
                 )
-            for task in as_completed(tasks):
-                task_metrics, task_results = task.result()
-                computed_metrics += task_metrics
-                all_results += task_results
-        return pd.concat(computed_metrics), pd.concat(all_results)
+            finally:
+                for _ in consumers:
+                    completed_profiles.put(None)
+            for consumer in consumers:
+                errors += consumer.result()
+        if errors:
+            raise errors[0]
+
+    def select_shard(self, personas: List[str]) -> List[str]:
+        """
+        Keeps the personas of this run's shard, recorded in the shard manifest for merging, or all personas when unsharded
+        """
+        if self.shard is None:
+            return personas
+        personas = shard_personas(personas, *self.shard)
+        atomic_write_json(f"{self.outdir}/{SHARD_FILE}", {"shard_id": self.shard[0], "n_shards": self.shard[1], "personas": personas})
+        print(f"Shard {self.shard[0]}/{self.shard[1]}: {len(personas)} profiles")
+        return personas
+
+    def load_saved_generations(self) -> SavedGenerations:
+        """
+        Lazily reads the generated memories of an earlier run for the downstream stages, leaving that run's directory untouched
+        Without the judge stage, the earlier run's judgments are copied over to compute metrics from
+        """
+        generation_dir = f"{self.from_generation}/{MEMORIES_GENERATION}"
+        generations = SavedGenerations(generation_dir, self.config.memories_generation.n_passes)
+        if self.shard is not None:
+            generations = SavedGenerations(generation_dir, self.config.memories_generation.n_passes, personas=self.select_shard(generations.personas))
+        print(f"Reading generated memories of {len(generations)} profiles from \"{self.from_generation}\"")
+        if "judge" not in self.stages:
+            shutil.copytree(f"{self.from_generation}/{METRICS_ARTIFACTS}", f"{self.outdir}/{METRICS_ARTIFACTS}", dirs_exist_ok=True)
+        atomic_write_json(f"{self.outdir}/{GENERATION_SOURCE_FILE}", {
+            "from_generation": os.path.abspath(self.from_generation),
+            "stages": self.stages
+        })
+        return generations
+
+    def persona_metrics_cost(self, persona: str, persona_passes: List[List[Dict]]) -> int:
+        """
+        Estimates a persona's judging cost as its number of memories times its number of bank queries
+        """
+        n_queries = len(self.query_index["personas"][persona]["queries"])
+        return sum([len(memories) for memories in persona_passes if memories is not None]) * n_queries
+
+    def batch_aggregate_metrics(self, generated_memories: Mapping[str, List[List[Dict]]]):
+        """
+        Orchestrates multithreading for eval metrics aggregation, threads pull one persona at a time from a shared queue
+        """
+
+        metrics_comp_conf = self.config.metrics_computation
+        all_personas = sorted(generated_memories.keys())
+        if self.config.scheduler.longest_job_first:
+            all_personas.sort(key=lambda persona: self.persona_metrics_cost(persona, generated_memories[persona]), reverse=True)
+
+        _, schedule_stats = run_work_queue(
+            all_personas,
+            lambda persona, log_header: self.aggregate_persona_metrics(persona, generated_memories[persona], log_header),
+            n_workers=metrics_comp_conf.max_threads,
+            label="Metrics computation",
+            should_stop=self.token_ledger.budget_exceeded
+        )
+        self.record_schedule_stats(schedule_stats)
+
+    def record_schedule_stats(self, schedule_stats: Dict):
+        """
+        Prints a work queue's throughput and utilization and keeps it for the run's scheduler report
+        """
+        print(format_schedule_stats(schedule_stats))
+        self.schedule_stats.append(schedule_stats)
 
     def run(self) -> pd.DataFrame:
         """
         Main runner function
         """
 
-        generated_memories = self.batch_generate_memories()
-        metrics_df, results_df =  self.batch_aggregate_metrics(generated_memories)
-        metrics_df.to_csv(f"{self.outdir}/memories_eval_metrics.csv")
-        results_df.to_csv(f"{self.outdir}/memories_eval_results.csv")
+        try:
+            if self.config.pipeline.streaming and "generate" in self.stages and "judge" in self.stages:
+                with self.open_output_writers(), self.tracer.span("streaming_pipeline"):
+                    self.run_streaming()
+            else:
+                if "generate" in self.stages:
+                    with self.tracer.span("memories_generation"):
+                        generated_memories = self.batch_generate_memories()
+                else:
+                    generated_memories = self.load_saved_generations()
+                if "judge" in self.stages or "metrics" in self.stages:
+                    with self.open_output_writers(), self.tracer.span("metrics_computation"):
+                        self.batch_aggregate_metrics(generated_memories)
+        finally:
+            if self.judge.cache is not None:
+                print(f"Judge response cache: {self.judge.cache.stats()}")
+            self.judge.close()
+            self.report_tracing()
+            self.report_token_usage()
+        self.report_generation_latency()
+        self.report_prefilter_recall()
+        atomic_write_json(f"{self.outdir}/scheduler_stats.json", self.schedule_stats)
+        if self.config.output.history_db is not None and "metrics" in self.stages:
+            history = RunHistory(self.config.output.history_db)
+            try:
+                history.ingest(self.outdir)
+            finally:
+                history.close()
 
 def get_args():
     parser = ArgumentParser()
     parser.add_argument("-c", "--config", required=True, help="Memories evaluation config file")
+    parser.add_argument("--resume", action="store_true", help="Resume from the saved artifacts of an interrupted run instead of starting over")
+    parser.add_argument("--stages", type=lambda stages: stages.split(","), default=STAGES, help=f"comma separated stages to run, from {','.join(STAGES)}")
+    parser.add_argument("--shard", type=parse_shard, default=None, help="only evaluate shard i of N of the profiles, as i/N with 0 <= i < N, see sharding.py to merge the shards")
+    parser.add_argument("--from-generation", dest="from_generation", default=None, help="output directory of an earlier run whose generated memories are judged again, required without the generate stage")
     return parser.parse_args()
 
 def main():
@@ -502,7 +1339,7 @@ def main():
     with open(args.config, "r") as _y:
         config = MemoryEvaluatorConfig(**yaml.safe_load(_y))
     print(config)
-    memories_evalutor = MemoryEvaluator(config)
+    memories_evalutor = MemoryEvaluator(config, resume=args.resume, stages=args.stages, from_generation=args.from_generation, shard=args.shard)
     memories_evalutor.run()
 
 
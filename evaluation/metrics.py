@@ -0,0 +1,82 @@
+import pandas as pd
+from typing import Dict, List, Tuple
+
+RUN_KEYS = ["persona_id", "run_idx"]
+METRICS_COLUMNS = [
+    "persona_id", "run_id", "total_memories_generated", "total_queries", "coverage_count", "coverage_perc", "extra_count",
+    "extra_perc", "missing_count", "missing_perc", "queries_without_a_memory", "duplicate_count", "duplicate_perc"
+]
+
+
+def compute_metrics_frame(
+    results_df: pd.DataFrame,
+    used_queries: Dict[str, List[str]],
+    duplicate_groups: Dict[Tuple[str, int], List[List[str]]]
+) -> pd.DataFrame:
+    """
+    Computes coverage, extra, missing and duplicate metrics for every persona and run of a results frame at once
+    results_df holds one row per memory with persona_id, run_idx, insight_summary and related_queries
+    used_queries maps each persona to its bank queries, duplicate_groups maps (persona_id, run_idx) to its similar statement groups
+    """
+    memories_df = results_df[RUN_KEYS + ["insight_summary"]].assign(
+        covered=results_df["related_queries"].str.len() > 0
+    )
+    metrics_df = memories_df.groupby(RUN_KEYS, sort=True).agg(
+        total_memories_generated=("insight_summary", "size"),
+        coverage_count=("covered", "sum")
+    )
+    metrics_df["total_queries"] = metrics_df.index.get_level_values("persona_id").map(
+        {persona: len(queries) for persona, queries in used_queries.items()}
+    )
+    metrics_df["extra_count"] = metrics_df["total_memories_generated"] - metrics_df["coverage_count"]
+
+    # Missing -> bank queries of each run that no memory maps to, kept in bank order
+    bank_df = pd.DataFrame(
+        [(persona, query) for persona, queries in used_queries.items() for query in queries],
+        columns=["persona_id", "query"]
+    )
+    run_queries_df = metrics_df.index.to_frame(index=False).merge(bank_df, on="persona_id")
+    covered_queries_df = (
+        results_df[RUN_KEYS + ["related_queries"]]
+        .explode("related_queries")
+        .dropna(subset=["related_queries"])
+        .rename(columns={"related_queries": "query"})
+        .drop_duplicates()
+    )
+    run_queries_df = run_queries_df.merge(covered_queries_df, on=RUN_KEYS + ["query"], how="left", indicator=True)
+    queries_without_a_memory = (
+        run_queries_df[run_queries_df["_merge"] == "left_only"]
+        .groupby(RUN_KEYS, sort=False)["query"]
+        .agg(list)
+        .reindex(metrics_df.index)
+    )
+    metrics_df["queries_without_a_memory"] = queries_without_a_memory.map(
+        lambda queries: queries if isinstance(queries, list) else []
+    )
+    metrics_df["missing_count"] = metrics_df["queries_without_a_memory"].str.len()
+
+    # Duplicates -> distinct memories of each run that belong to a similar statement group
+    grouped_memories_df = pd.DataFrame(
+        [
+            (persona, run_idx, statement)
+            for (persona, run_idx), groups in duplicate_groups.items()
+            for group in groups
+            for statement in group
+        ],
+        columns=RUN_KEYS + ["insight_summary"]
+    )
+    duplicate_counts = (
+        memories_df[RUN_KEYS + ["insight_summary"]]
+        .drop_duplicates()
+        .merge(grouped_memories_df.drop_duplicates(), on=RUN_KEYS + ["insight_summary"])
+        .groupby(RUN_KEYS)
+        .size()
+    )
+    metrics_df["duplicate_count"] = duplicate_counts.reindex(metrics_df.index, fill_value=0)
+
+    metrics_df["coverage_perc"] = metrics_df["coverage_count"] / metrics_df["total_memories_generated"]
+    metrics_df["extra_perc"] = metrics_df["extra_count"] / metrics_df["total_memories_generated"]
+    metrics_df["missing_perc"] = metrics_df["missing_count"] / metrics_df["total_queries"]
+    metrics_df["duplicate_perc"] = metrics_df["duplicate_count"] / metrics_df["total_memories_generated"]
+
+    return metrics_df.reset_index().rename(columns={"run_idx": "run_id"})[METRICS_COLUMNS]
@@ -0,0 +1,377 @@
+import re
+import time
+import numpy as np
+import pandas as pd
+from openai import OpenAI
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, urlsplit
+
+from judge_engine import extract_and_parse_json_response
+from rate_limiting import RetryPolicy, get_retry_after
+from token_accounting import TokenLedger
+from utils import load_json_if_valid
+
+# This module approximates InsightsHistorySource.sys.mjs, whose sources are not in this repo. The session boundaries and
+# recency half-life below are the port's own guesses, not read from Firefox, so the python backend is only used once
+# offline_parity.py has shown that its sessions and top-k aggregates match a Firefox build's, see check_parity_report
+
+# Session boundaries, a new session starts after a long gap or once a session gets too long
+SESSION_GAP_SECONDS = 900
+MAX_SESSION_SECONDS = 7200
+
+# Top-k sizes and recency half-life used when ranking aggregates, the top-k sizes match EVAL_JS_PREPARE_SOURCES_SCRIPT
+K_DOMAINS = 100
+K_TITLES = 60
+K_SEARCHES = 10
+HALF_LIFE_DAYS = 14.0
+
+MS_PER_DAY = 86_400_000
+
+# Constants a parity report was made with, a report made before any of them changed no longer vouches for the port
+PORT_CONSTANTS = {
+    "session_gap_seconds": SESSION_GAP_SECONDS,
+    "max_session_seconds": MAX_SESSION_SECONDS,
+    "k_domains": K_DOMAINS,
+    "k_titles": K_TITLES,
+    "k_searches": K_SEARCHES,
+    "half_life_days": HALF_LIFE_DAYS
+}
+
+# Query string parameters holding the search terms of each supported search engine
+SEARCH_QUERY_PARAMS = ["q", "p", "query", "text", "wd"]
+SEARCH_TITLE_REGEX = re.compile(r"^.*?search\s*[:\-|]\s*", re.IGNORECASE)
+
+# Written for this port, not taken from Firefox: the browser's insight generation prompt is not available to it, so
+# insights generated offline can differ from the browser's in wording, count and scores even on identical sources
+INSIGHTS_SYSTEM_PROMPT = """
+You are tasked to generate a list of insights about a user from a summary of their browsing history.
+An insight must include 'insight_summary', 'category', 'intent' and a 'score'
+- insight_summary: A concise human-readable label capturing the main theme or goal behind a cluster of browsing activities. For example, "Trip Plans to Italy"
+- category: The high-level domain of user interest from VALID_CATEGORIES that best represents the browsing behavior
+- intent: The underlying purpose of the user's behavior from VALID_INTENTS
+- score: How strongly the browsing history supports this insight, ranged from 1 to 5
+
+VALID_CATEGORIES = [
+  "Arts & Entertainment",
+  "Autos & Vehicles",
+  "Beauty & Fitness",
+  "Books & Literature",
+  "Business & Industrial",
+  "Computers & Electronics",
+  "Food & Drink",
+  "Games",
+  "Hobbies & Leisure",
+  "Home & Garden",
+  "Internet & Telecom",
+  "Jobs & Education",
+  "Law & Government",
+  "News",
+  "Online Communities",
+  "People & Society",
+  "Pets & Animals",
+  "Real Estate",
+  "Reference",
+  "Science",
+  "Shopping",
+  "Sports",
+  "Travel & Transportation",
+]
+
+VALID_INTENTS = [
+  "Research / Learn",
+  "Compare / Evaluate",
+  "Plan / Organize",
+  "Buy / Acquire",
+  "Create / Produce",
+  "Communicate / Share",
+  "Monitor / Track",
+  "Entertain / Relax",
+  "Resume / Revisit",
+]
+
+Guidelines:
+- Insights should group related activities into a meaningful purpose.
+- Should not generate similar insights.
+- Do not fabricate details not supported by the browsing history.
+- Use only categories and intents from the provided lists.
+"""
+
+
+def sessionize_visits(
+    profile_data: pd.DataFrame,
+    gap_seconds: float = SESSION_GAP_SECONDS,
+    max_session_seconds: float = MAX_SESSION_SECONDS
+) -> pd.DataFrame:
+    """
+    Approximation of sessionizeVisits: sorts visits by time and assigns each one the start time of its session as session_id
+    """
+    visits = profile_data[profile_data["visitDateMicros"].notna()].copy()
+    visits["visitTimeMs"] = (visits["visitDateMicros"] // 1000).astype("int64")
+    visits = visits.sort_values("visitTimeMs", kind="stable").reset_index(drop=True)
+    visit_ms = visits["visitTimeMs"].to_numpy()
+    if len(visit_ms) == 0:
+        visits["session_id"] = pd.Series(dtype="int64")
+        return visits
+
+    # Split on gaps first, then only walk the rare gap sessions that run past the maximum session length
+    max_session_ms = max_session_seconds * 1000
+    gap_session = np.cumsum(np.diff(visit_ms, prepend=visit_ms[0]) > gap_seconds * 1000)
+    visit_times = pd.Series(visit_ms).groupby(gap_session)
+    session_start = visit_times.transform("min").to_numpy().copy()
+    session_span = visit_times.transform("max").to_numpy() - session_start
+    for long_session in np.unique(gap_session[session_span > max_session_ms]):
+        session_idx = np.flatnonzero(gap_session == long_session)
+        current_start = visit_ms[session_idx[0]]
+        for idx in session_idx:
+            if visit_ms[idx] - current_start > max_session_ms:
+                current_start = visit_ms[idx]
+            session_start[idx] = current_start
+    visits["session_id"] = session_start
+    return visits
+
+
+def extract_search_query(url: str, title: Optional[str]) -> Optional[str]:
+    """
+    Reads the search terms from a search engine URL, falling back to the page title
+    """
+    params = parse_qs(urlsplit(url).query)
+    for param in SEARCH_QUERY_PARAMS:
+        terms = [value.strip() for value in params.get(param, []) if value.strip()]
+        if terms:
+            return terms[0]
+    if isinstance(title, str) and title.strip():
+        return SEARCH_TITLE_REGEX.sub("", title).strip() or None
+    return None
+
+
+def generate_profile_inputs(sessionized: pd.DataFrame) -> Dict[str, pd.DataFrame]:
+    """
+    Approximation of generateProfileInputs: per-session title and domain scores, search events and session times
+    Scores are the highest frecency percentile seen for a title or domain within a session
+    """
+    sessions = sessionized.groupby("session_id", sort=True).agg(
+        session_start_ms=("visitTimeMs", "min"),
+        session_end_ms=("visitTimeMs", "max")
+    ).reset_index()
+
+    history = sessionized[sessionized["source"] == "history"]
+    titled = history[history["title"].notna() & (history["title"].astype(str).str.len() > 0)]
+    title_scores = titled.assign(score=titled["frequencyPct"].fillna(0)).groupby(
+        ["session_id", "title"], sort=True
+    )["score"].max().reset_index()
+    hosted = history[history["domain"].notna() & (history["domain"].astype(str).str.len() > 0)]
+    domain_scores = hosted.assign(score=hosted["domainFrequencyPct"].fillna(0)).groupby(
+        ["session_id", "domain"], sort=True
+    )["score"].max().reset_index()
+
+    searches = sessionized[sessionized["source"] == "search"]
+    search_events = pd.DataFrame({
+        "session_id": searches["session_id"],
+        "query": [extract_search_query(url, title) for url, title in zip(searches["url"], searches["title"])],
+        "visitTimeMs": searches["visitTimeMs"]
+    }).dropna(subset=["query"]).reset_index(drop=True)
+
+    return {
+        "sessions": sessions,
+        "title_scores": title_scores,
+        "domain_scores": domain_scores,
+        "search_events": search_events
+    }
+
+
+def aggregate_sessions(profile_inputs: Dict[str, pd.DataFrame]) -> Tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame]:
+    """
+    Approximation of aggregateSessions: sums session scores per domain and title and counts hits per search query
+    Every aggregate also keeps its number of sessions and when it was last seen
+    """
+    session_ends = profile_inputs["sessions"][["session_id", "session_end_ms"]]
+    domain_agg = profile_inputs["domain_scores"].merge(session_ends, on="session_id").groupby("domain", sort=True).agg(
+        score=("score", "sum"),
+        num_sessions=("session_id", "nunique"),
+        last_seen=("session_end_ms", "max")
+    )
+    title_agg = profile_inputs["title_scores"].merge(session_ends, on="session_id").groupby("title", sort=True).agg(
+        score=("score", "sum"),
+        num_sessions=("session_id", "nunique"),
+        last_seen=("session_end_ms", "max")
+    )
+    search_agg = profile_inputs["search_events"].groupby("query", sort=True).agg(
+        score=("visitTimeMs", "size"),
+        num_sessions=("session_id", "nunique"),
+        last_seen=("visitTimeMs", "max")
+    )
+    return domain_agg, title_agg, search_agg
+
+
+def rank_aggregate(agg: pd.DataFrame, k: int, now_ms: float, half_life_days: float) -> List[List]:
+    """
+    Decays an aggregate's scores by the age of its last visit and keeps the k best as [key, rank, num_sessions] items
+    """
+    age_days = np.maximum(now_ms - agg["last_seen"].to_numpy(dtype=float), 0) / MS_PER_DAY
+    ranked = pd.DataFrame({
+        "key": agg.index.to_numpy(),
+        "rank": agg["score"].to_numpy(dtype=float) * 0.5 ** (age_days / half_life_days),
+        "num_sessions": agg["num_sessions"].to_numpy()
+    }).sort_values(["rank", "key"], ascending=[False, True], kind="stable").head(k)
+    return [[key, float(rank), int(num_sessions)] for key, rank, num_sessions in ranked.itertuples(index=False)]
+
+
+def topk_aggregates(
+    domain_agg: pd.DataFrame,
+    title_agg: pd.DataFrame,
+    search_agg: pd.DataFrame,
+    k_domains: int = K_DOMAINS,
+    k_titles: int = K_TITLES,
+    k_searches: int = K_SEARCHES,
+    now: Optional[float] = None,
+    half_life_days: float = HALF_LIFE_DAYS
+) -> Tuple[List[List], List[List], List[List]]:
+    """
+    Approximation of topkAggregates: the top domains, titles and searches ranked by recency-decayed score
+    now is in milliseconds since the epoch and defaults to the current time
+    """
+    now_ms = now if now is not None else time.time() * 1000
+    return (
+        rank_aggregate(domain_agg, k_domains, now_ms, half_life_days),
+        rank_aggregate(title_agg, k_titles, now_ms, half_life_days),
+        rank_aggregate(search_agg, k_searches, now_ms, half_life_days)
+    )
+
+
+def prepare_sources(profile_data: pd.DataFrame, now: Optional[float] = None, timings: Optional[Dict] = None) -> Dict[str, List]:
+    """
+    Runs the whole approximated input pipeline on a profile, like prepareSources in EVAL_JS_PREPARE_SOURCES_SCRIPT
+    Stage durations are added to timings in milliseconds, with the same keys as the browser script
+    """
+    timings = timings if timings is not None else {}
+    start = time.perf_counter()
+    sessionized = sessionize_visits(profile_data)
+    timings["sessionize_visits_ms"] = (time.perf_counter() - start) * 1000
+    start = time.perf_counter()
+    profile_inputs = generate_profile_inputs(sessionized)
+    timings["generate_profile_inputs_ms"] = (time.perf_counter() - start) * 1000
+    start = time.perf_counter()
+    domain_agg, title_agg, search_agg = aggregate_sessions(profile_inputs)
+    timings["aggregate_sessions_ms"] = (time.perf_counter() - start) * 1000
+    start = time.perf_counter()
+    topk_items = topk_aggregates(domain_agg, title_agg, search_agg, now=now)
+    timings["topk_aggregates_ms"] = (time.perf_counter() - start) * 1000
+    return {"history": list(topk_items)}
+
+
+def check_parity_report(path: Optional[str]) -> Dict:
+    """
+    Loads an offline_parity.py report and raises ValueError unless it shows the port matching Firefox on every profile
+    with the port's current constants
+    """
+    if path is None:
+        raise ValueError("No parity report given in memories_generation.parity_report, run offline_parity.py to make one")
+    report = load_json_if_valid(path)
+    if not isinstance(report, dict) or not isinstance(report.get("profiles"), dict):
+        raise ValueError(f"\"{path}\" is not a parity report from offline_parity.py")
+    if report.get("port_constants") != PORT_CONSTANTS:
+        raise ValueError(f"Parity report \"{path}\" was made with constants {report.get('port_constants')}, the port now uses {PORT_CONSTANTS}")
+    if not report["profiles"]:
+        raise ValueError(f"Parity report \"{path}\" compared no profiles")
+    mismatches = sorted([profile for profile, profile_diff in report["profiles"].items() if not profile_diff.get("match")])
+    if mismatches:
+        raise ValueError(f"Parity report \"{path}\" has {len(mismatches)} profiles that differ from Firefox: {mismatches}")
+    return report
+
+
+def build_insights_prompt(sources: Dict[str, List]) -> str:
+    """
+    Renders a profile's top domains, titles and searches as the user prompt for insight generation
+    The layout is the port's own, like INSIGHTS_SYSTEM_PROMPT, only the sources it renders match the browser's
+    """
+    domain_items, title_items, search_items = sources["history"]
+    sections = []
+    for heading, items in [
+        ("Top domains", domain_items),
+        ("Top page titles", title_items),
+        ("Top searches", search_items)
+    ]:
+        lines = [f"- {key} (weight {rank:.2f}, {num_sessions} sessions)" for key, rank, num_sessions in items]
+        sections.append(f"{heading}:\n" + ("\n".join(lines) if lines else "- none"))
+    return "\n\n".join(sections) + """
+
+Return the insights as JSON in the following format:
+{"insights": [{"insight_summary": "...", "category": "...", "intent": "...", "score": 1}]}
+"""
+
+
+def parse_insights(response: Optional[str]) -> List[Dict]:
+    """
+    Reads the insights of a generation response, raising ValueError when it holds no JSON list of insights
+    """
+    try:
+        insights = extract_and_parse_json_response(response)
+    except (IndexError, TypeError, ValueError) as e:
+        raise ValueError(f"No JSON insights in the response: {e!r}") from e
+    if isinstance(insights, dict):
+        insights = insights.get("insights")
+    if not isinstance(insights, list):
+        raise ValueError("The response's JSON has no list of insights")
+    return [insight for insight in insights if isinstance(insight, dict) and "insight_summary" in insight]
+
+
+class InsightsGenerationError(Exception):
+    """
+    An insight generation pass given up on after its retry policy's attempts
+    """
+
+
+class OfflineInsightsGenerator:
+    """
+    Generates insights from prepared sources by calling the LiteLLM-compatible endpoint directly, without a browser
+    Prompts with the port's own INSIGHTS_SYSTEM_PROMPT rather than Firefox's
+    API errors and responses that do not parse are retried with backoff, up to the retry policy's attempts
+    """
+
+    def __init__(
+        self,
+        endpoint: str,
+        api_key: str,
+        model: str,
+        extra_headers: Optional[Dict[str, str]] = None,
+        token_ledger: Optional[TokenLedger] = None,
+        retry_policy: Optional[RetryPolicy] = None
+    ):
+        self.client = OpenAI(base_url=endpoint, api_key=api_key, default_headers=extra_headers, max_retries=0)
+        self.model = model
+        self.token_ledger = token_ledger if token_ledger is not None else TokenLedger({})
+        self.retry_policy = retry_policy if retry_policy is not None else RetryPolicy(max_attempts=3, base_delay=1.0, max_delay=30.0)
+
+    def generate(self, sources: Dict[str, List], timings: Optional[Dict] = None) -> List[Dict]:
+        """
+        Runs one insight generation pass over a profile's prepared sources, raising InsightsGenerationError once every attempt failed
+        Each model call's duration is added to timings in milliseconds, like the browser script's model_calls
+        """
+        timings = timings if timings is not None else {}
+        messages = [
+            {"role": "system", "content": INSIGHTS_SYSTEM_PROMPT},
+            {"role": "user", "content": build_insights_prompt(sources)}
+        ]
+        error = None
+        for attempt in range(1, self.retry_policy.max_attempts + 1):
+            retry_after = None
+            start = time.perf_counter()
+            try:
+                response = self.client.chat.completions.create(model=self.model, messages=messages)
+            except Exception as e:
+                error = e
+                retry_after = get_retry_after(e)
+            else:
+                self.token_ledger.record("generation", self.model, getattr(response, "usage", None))
+                try:
+                    return parse_insights(response.choices[0].message.content)
+                except ValueError as e:
+                    error = e
+            finally:
+                timings.setdefault("model_calls", []).append({"method": "chat.completions.create", "ms": (time.perf_counter() - start) * 1000})
+
+            print(f"Failed to generate insights (attempt {attempt}/{self.retry_policy.max_attempts}): {error}")
+            if attempt < self.retry_policy.max_attempts:
+                time.sleep(self.retry_policy.backoff(attempt, retry_after))
+
+        raise InsightsGenerationError(f"Failed to generate insights after {self.retry_policy.max_attempts} attempts: {error}") from error
@@ -0,0 +1,214 @@
+import sys
+import glob
+import math
+import time
+import yaml
+from argparse import ArgumentParser
+from typing import Any, Dict, FrozenSet, List, Set
+
+from driver_pool import FirefoxDriverPool
+from memories_evaluator import EVAL_JS_SCRIPT_HEADER, MemoryEvaluator, MemoryEvaluatorConfig
+from offline_insights import K_DOMAINS, K_SEARCHES, K_TITLES, PORT_CONSTANTS, aggregate_sessions, generate_profile_inputs, sessionize_visits, topk_aggregates
+from utils import atomic_write_json
+
+EVAL_JS_DUMP_AGGREGATES_SCRIPT = EVAL_JS_SCRIPT_HEADER + """
+function toPlain(value) {
+  if (value instanceof Map) {
+    return Object.fromEntries([...value].map(([key, item]) => [key, toPlain(item)]));
+  }
+  if (value instanceof Set) {
+    return [...value].map(toPlain);
+  }
+  if (Array.isArray(value)) {
+    return value.map(toPlain);
+  }
+  if (value && typeof value === "object") {
+    return Object.fromEntries(Object.entries(value).map(([key, item]) => [key, toPlain(item)]));
+  }
+  return value;
+}
+
+async function dumpAggregates(columns) {
+  const sessionized = sessionizeVisits(columnsToRows(columns));
+  const [domainAgg, titleAgg, searchAgg] = aggregateSessions(
+    generateProfileInputs(sessionized)
+  );
+  const topk = await topkAggregates(domainAgg, titleAgg, searchAgg, {
+    k_domains: request.kDomains,
+    k_titles: request.kTitles,
+    k_searches: request.kSearches,
+    now: request.now,
+  });
+  return toPlain({
+    sessions: sessionized.map(row => [row.url, row.visitDateMicros, row.session_id]),
+    topk,
+  });
+}
+
+async function runCallback() {
+  const profileNames = Object.keys(request.profiles);
+  const outcomes = await Promise.allSettled(
+    profileNames.map(profileName => dumpAggregates(request.profiles[profileName]))
+  );
+  return collectOutcomes(profileNames, outcomes);
+}
+runCallback().then(result => callback(result));
+"""
+
+TOPK_SOURCES = ["domains", "titles", "searches"]
+
+
+def session_partition(sessions: List[List]) -> Set[FrozenSet]:
+    """
+    Groups visits by session, ignoring how each side names its sessions
+    """
+    members = {}
+    for url, visit_date_micros, session_id in sessions:
+        members.setdefault(session_id, set()).add((url, int(visit_date_micros)))
+    return {frozenset(visits) for visits in members.values()}
+
+
+def values_match(python_value: Any, browser_value: Any, tolerance: float) -> bool:
+    """
+    Compares JSON values, with numbers matching within a relative and absolute tolerance
+    """
+    if isinstance(python_value, bool) or isinstance(browser_value, bool):
+        return python_value == browser_value
+    if isinstance(python_value, (int, float)) and isinstance(browser_value, (int, float)):
+        return math.isclose(python_value, browser_value, rel_tol=tolerance, abs_tol=tolerance)
+    if isinstance(python_value, list) and isinstance(browser_value, list):
+        return len(python_value) == len(browser_value) and all(
+            [values_match(python_item, browser_item, tolerance) for python_item, browser_item in zip(python_value, browser_value)]
+        )
+    if isinstance(python_value, dict) and isinstance(browser_value, dict):
+        return python_value.keys() == browser_value.keys() and all(
+            [values_match(python_value[key], browser_value[key], tolerance) for key in python_value]
+        )
+    return python_value == browser_value
+
+
+def item_key(item: Any) -> Any:
+    """
+    The domain, title or query a top-k item is about
+    """
+    if isinstance(item, list) and item:
+        return item[0]
+    if isinstance(item, dict):
+        for key in ["domain", "title", "q", "query", "key"]:
+            if key in item:
+                return item[key]
+    return str(item)
+
+
+def diff_topk_items(python_items: List, browser_items: List, tolerance: float) -> Dict:
+    """
+    Diffs one top-k list: items only one side kept, ranking order and values of the shared items
+    """
+    python_keys = [item_key(item) for item in python_items]
+    browser_keys = [item_key(item) for item in browser_items]
+    browser_by_key = dict(zip(browser_keys, browser_items))
+    value_mismatches = [
+        {"key": key, "python": item, "browser": browser_by_key[key]}
+        for key, item in zip(python_keys, python_items)
+        if key in browser_by_key and not values_match(item, browser_by_key[key], tolerance)
+    ]
+    items_diff = {
+        "python_only": [key for key in python_keys if key not in set(browser_keys)],
+        "browser_only": [key for key in browser_keys if key not in set(python_keys)],
+        "order_match": python_keys == browser_keys,
+        "value_mismatches": value_mismatches
+    }
+    items_diff["match"] = items_diff["order_match"] and not value_mismatches
+    return items_diff
+
+
+def diff_profile(python_out: Dict, browser_out: Dict, tolerance: float) -> Dict:
+    """
+    Diffs the sessions and top-k aggregates of one profile
+    """
+    python_sessions = session_partition(python_out["sessions"])
+    browser_sessions = session_partition(browser_out["sessions"])
+    profile_diff = {
+        "sessions": {
+            "python_count": len(python_sessions),
+            "browser_count": len(browser_sessions),
+            "match": python_sessions == browser_sessions
+        },
+        "topk": {
+            source: diff_topk_items(python_items, browser_items, tolerance)
+            for source, python_items, browser_items in zip(TOPK_SOURCES, python_out["topk"], browser_out["topk"])
+        }
+    }
+    profile_diff["match"] = profile_diff["sessions"]["match"] and all([source_diff["match"] for source_diff in profile_diff["topk"].values()])
+    return profile_diff
+
+
+def run_python_pipeline(profile_rows, now: float) -> Dict:
+    """
+    Runs the Python port on a profile and returns the same sessions and top-k dump as the browser script
+    Only this input pipeline is ported from Firefox, the insight generation prompts are the port's own and are not compared
+    """
+    sessionized = sessionize_visits(profile_rows)
+    domain_agg, title_agg, search_agg = aggregate_sessions(generate_profile_inputs(sessionized))
+    return {
+        "sessions": sessionized[["url", "visitDateMicros", "session_id"]].values.tolist(),
+        "topk": list(topk_aggregates(domain_agg, title_agg, search_agg, now=now))
+    }
+
+
+def get_args():
+    parser = ArgumentParser()
+    parser.add_argument("-c", "--config", required=True, help="Memories evaluation config file")
+    parser.add_argument("--max-profiles", dest="max_profiles", type=int, default=None, help="only compare the first N profiles")
+    parser.add_argument("--now", type=float, default=None, help="reference time given to both top-k rankings, in milliseconds since the epoch")
+    parser.add_argument("--tolerance", type=float, default=1e-6, help="relative and absolute tolerance for numeric values")
+    parser.add_argument("--output", default="parity_report.json", help="report file")
+    return parser.parse_args()
+
+
+def main():
+    args = get_args()
+    with open(args.config, "r") as _y:
+        config = MemoryEvaluatorConfig(**yaml.safe_load(_y))
+    now = args.now if args.now is not None else time.time() * 1000
+
+    driver_pool = FirefoxDriverPool(
+        firefox_bin=MemoryEvaluator.get_firefox_bin_path(config.firefox_repo_path),
+        aiwindow_prefs=MemoryEvaluator.set_aiwindow_prefs(config.lite_llm),
+        max_uses=config.memories_generation.driver_max_uses,
+        health_check_timeout=config.memories_generation.driver_health_check_timeout
+    )
+    profile_files = sorted(glob.glob(f"{config.data.records_path}/*.csv"))[:args.max_profiles]
+    report = {"now": now, "tolerance": args.tolerance, "port_constants": PORT_CONSTANTS, "profiles": {}}
+    try:
+        for idx, profile_file in enumerate(profile_files):
+            profile_name = profile_file.split("/")[-1].replace(".csv", "")
+            profile_rows = MemoryEvaluator.load_profile_rows(profile_file)
+            request = {
+                "profiles": {profile_name: MemoryEvaluator.to_columnar_rows(profile_rows)},
+                "now": now,
+                "kDomains": K_DOMAINS,
+                "kTitles": K_TITLES,
+                "kSearches": K_SEARCHES
+            }
+            with driver_pool.driver() as firefox:
+                browser_out = MemoryEvaluator.run_eval_js_script(firefox, "dump_aggregates", EVAL_JS_DUMP_AGGREGATES_SCRIPT, request, [])[profile_name]
+            if "error" in browser_out:
+                raise RuntimeError(f"Dumping the browser's aggregates failed for profile \"{profile_name}\": {browser_out['error']}")
+            profile_diff = diff_profile(run_python_pipeline(profile_rows, now), browser_out, args.tolerance)
+            report["profiles"][profile_name] = profile_diff
+            print(f"[{idx+1}/{len(profile_files)}] {'match' if profile_diff['match'] else 'MISMATCH'} \"{profile_name}\"")
+    finally:
+        driver_pool.close()
+
+    n_mismatches = sum([not profile_diff["match"] for profile_diff in report["profiles"].values()])
+    atomic_write_json(args.output, report)
+    print(f"{len(profile_files) - n_mismatches}/{len(profile_files)} profiles match, report saved to {args.output}")
+    print("Only sessions and top-k aggregates are compared, the python backend's insight generation prompts are written for the port, not taken from Firefox")
+    if n_mismatches:
+        sys.exit(1)
+    print(f"Set memories_generation.parity_report: {args.output} to let the evaluator generate with the python backend")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+import os
+import glob
+import json
+import hashlib
+from argparse import ArgumentParser
+from typing import Dict, Iterable, List, Optional
+
+from utils import atomic_write_json, load_json_if_valid
+
+# Indexes are cached per websites bank in the user's cache directory, the bank itself may be read-only or shared
+QUERY_INDEX_CACHE_DIR = os.path.join(os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache"), "memories_eval")
+
+
+def default_index_path(websites_path: str) -> str:
+    """
+    Cache file of a websites bank's index, named after the bank's absolute path
+    """
+    bank_key = hashlib.sha256(os.path.abspath(websites_path).encode("utf-8")).hexdigest()[:16]
+    return os.path.join(QUERY_INDEX_CACHE_DIR, f"query_index_{bank_key}.json")
+
+
+def bank_fingerprint(websites_path: str) -> Dict[str, List[int]]:
+    """
+    Size and modification time of every persona file in the websites bank, to tell when a saved index is stale
+    """
+    fingerprint = {}
+    for website_file in sorted(glob.glob(f"{websites_path}/*.json")):
+        stat = os.stat(website_file)
+        fingerprint[os.path.basename(website_file)] = [stat.st_size, stat.st_mtime_ns]
+    return fingerprint
+
+
+def build_query_index(websites_path: str) -> Dict:
+    """
+    Builds a URL -> queries inverted index for every persona of the websites bank
+    Queries are stored once per persona in bank order, URLs point to query positions
+    """
+    personas = {}
+    for website_file in sorted(glob.glob(f"{websites_path}/*.json")):
+        with open(website_file, "r") as _j:
+            persona_bank = json.load(_j)
+        url_queries = {}
+        for query_idx, pages in enumerate(persona_bank.values()):
+            for page in pages:
+                query_ids = url_queries.setdefault(page["url"], [])
+                if not query_ids or query_ids[-1] != query_idx:
+                    query_ids.append(query_idx)
+        personas[os.path.basename(website_file).replace(".json", "")] = {
+            "queries": list(persona_bank.keys()),
+            "url_queries": url_queries
+        }
+    return {"bank": bank_fingerprint(websites_path), "personas": personas}
+
+
+def load_query_index(websites_path: str, index_path: Optional[str] = None, rebuild: bool = False) -> Dict:
+    """
+    Loads the saved inverted index, rebuilding and saving it when it is missing, stale or a rebuild is requested
+    An index that cannot be saved is still returned, it is only rebuilt again next time
+    """
+    index_path = index_path or default_index_path(websites_path)
+    if not rebuild:
+        query_index = load_json_if_valid(index_path)
+        if isinstance(query_index, dict) and query_index.get("bank") == bank_fingerprint(websites_path):
+            return query_index
+    query_index = build_query_index(websites_path)
+    try:
+        os.makedirs(os.path.dirname(os.path.abspath(index_path)), exist_ok=True)
+        atomic_write_json(index_path, query_index)
+    except OSError as e:
+        print(f"Could not save the query index to \"{index_path}\", continuing without the cache: {e}")
+    return query_index
+
+
+def find_used_queries(persona_index: Dict, urls: Iterable[str]) -> List[str]:
+    """
+    Bank queries with at least one page among the given URLs, in bank order
+    """
+    url_queries = persona_index["url_queries"]
+    query_ids = set()
+    for url in set(urls):
+        query_ids.update(url_queries.get(url, []))
+    return [persona_index["queries"][query_idx] for query_idx in sorted(query_ids)]
+
+
+def get_args():
+    parser = ArgumentParser()
+    parser.add_argument("--websites-path", dest="websites_path", required=True, help="bank of all the query-website records")
+    parser.add_argument("--index-path", dest="index_path", default=None, help=f"index file, defaults to a file per bank in {QUERY_INDEX_CACHE_DIR}")
+    return parser.parse_args()
+
+
+def main():
+    args = get_args()
+    query_index = load_query_index(args.websites_path, args.index_path, rebuild=True)
+    n_urls = sum([len(persona_index["url_queries"]) for persona_index in query_index["personas"].values()])
+    print(f"Indexed {n_urls} URLs for {len(query_index['personas'])} personas")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,37 @@
+import numpy as np
+from typing import Dict, List
+
+from text_similarity import cosine_similarity_matrix
+
+
+def shortlist_queries(memories: List[str], used_queries: List[str], top_k: int, min_similarity: float) -> List[List[str]]:
+    """
+    Scores every memory against every query in one pass and keeps, per memory, the top_k queries above min_similarity
+    Shortlisted queries keep their original order
+    """
+    similarity = cosine_similarity_matrix(memories, used_queries)
+    k = min(top_k, len(used_queries))
+    top_idx = np.argsort(-similarity, axis=1, kind="stable")[:, :k]
+    top_similarity = np.take_along_axis(similarity, top_idx, axis=1)
+    keep = top_similarity >= min_similarity
+    return [
+        [used_queries[query_idx] for query_idx in sorted(row_idx[row_keep])]
+        for row_idx, row_keep in zip(top_idx, keep)
+    ]
+
+
+def shortlist_recall(candidates: List[List[str]], prefiltered_related: List[List[str]], full_related: List[List[str]]) -> Dict:
+    """
+    Measures how many of the full-LLM memory/query matches survive the prefilter
+    """
+    full_pairs = {(idx, query) for idx, related_queries in enumerate(full_related) for query in related_queries}
+    shortlisted_pairs = {(idx, query) for idx, queries in enumerate(candidates) for query in queries}
+    prefiltered_pairs = {(idx, query) for idx, related_queries in enumerate(prefiltered_related) for query in related_queries}
+    return {
+        "full_llm_pairs": len(full_pairs),
+        "shortlisted_pairs": len(shortlisted_pairs),
+        "full_llm_pairs_shortlisted": len(full_pairs & shortlisted_pairs),
+        "full_llm_pairs_matched": len(full_pairs & prefiltered_pairs),
+        "shortlist_recall": len(full_pairs & shortlisted_pairs) / len(full_pairs) if full_pairs else 1.0,
+        "judge_recall": len(full_pairs & prefiltered_pairs) / len(full_pairs) if full_pairs else 1.0,
+    }
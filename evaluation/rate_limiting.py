@@ -0,0 +1,124 @@
+import time
+import random
+import asyncio
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import Optional
+
+
+def get_retry_after(error: Exception) -> Optional[float]:
+    """
+    Reads the Retry-After delay in seconds from an API error's response headers, if there is one
+    """
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None)
+    if not headers:
+        return None
+    retry_after_ms = headers.get("retry-after-ms")
+    if retry_after_ms is not None:
+        try:
+            return float(retry_after_ms) / 1000
+        except ValueError:
+            pass
+    retry_after = headers.get("retry-after")
+    if retry_after is None:
+        return None
+    try:
+        return float(retry_after)
+    except ValueError:
+        pass
+    try:
+        return max(0.0, (parsedate_to_datetime(retry_after) - datetime.now(timezone.utc)).total_seconds())
+    except (TypeError, ValueError):
+        return None
+
+
+class RetryPolicy:
+    """
+    Bounded retries with exponential backoff and full jitter
+    """
+
+    def __init__(self, max_attempts: int, base_delay: float, max_delay: float):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def backoff(self, attempt: int, retry_after: Optional[float] = None) -> float:
+        """
+        Seconds to wait before the next attempt, never less than the server's Retry-After
+        """
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (attempt - 1)))
+        if retry_after is not None:
+            delay = max(delay, retry_after)
+        return delay
+
+
+class AsyncTokenBucket:
+    """
+    Token bucket refilled continuously at a per-minute rate, holding at most one minute of tokens
+    """
+
+    def __init__(self, per_minute: float):
+        self.capacity = per_minute
+        self.tokens = per_minute
+        self.refill_per_second = per_minute / 60
+        self.updated_at = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self, amount: float = 1):
+        """
+        Waits until amount tokens are available and takes them
+        """
+        amount = min(amount, self.capacity)
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.refill_per_second)
+                self.updated_at = now
+                if self.tokens >= amount:
+                    self.tokens -= amount
+                    return
+                await asyncio.sleep((amount - self.tokens) / self.refill_per_second)
+
+    def charge(self, amount: float):
+        """
+        Takes tokens used beyond what was acquired, the bucket may go negative and later acquires wait the debt out
+        """
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.refill_per_second) - amount
+        self.updated_at = now
+
+
+class AsyncRateLimiter:
+    """
+    Shared request and token per-minute limits for every judge call, with a global pause when the API pushes back
+    """
+
+    def __init__(self, requests_per_minute: Optional[int] = None, tokens_per_minute: Optional[int] = None):
+        self.request_bucket = AsyncTokenBucket(requests_per_minute) if requests_per_minute else None
+        self.token_bucket = AsyncTokenBucket(tokens_per_minute) if tokens_per_minute else None
+        self.resume_at = 0.0
+
+    def pause(self, seconds: float):
+        """
+        Holds back every new request for the given number of seconds
+        """
+        self.resume_at = max(self.resume_at, time.monotonic() + seconds)
+
+    async def acquire(self, tokens: int):
+        """
+        Waits for any pause to end and for room in the request and token budgets
+        """
+        while (remaining := self.resume_at - time.monotonic()) > 0:
+            await asyncio.sleep(remaining)
+        if self.request_bucket is not None:
+            await self.request_bucket.acquire(1)
+        if self.token_bucket is not None:
+            await self.token_bucket.acquire(tokens)
+
+    def settle(self, acquired_tokens: int, used_tokens: int):
+        """
+        Charges the token budget for a request's actual usage beyond the estimate it acquired
+        """
+        if self.token_bucket is not None and used_tokens > acquired_tokens:
+            self.token_bucket.charge(used_tokens - acquired_tokens)
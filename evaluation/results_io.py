@@ -0,0 +1,366 @@
+import os
+import ast
+import threading
+import numpy as np
+import pandas as pd
+from typing import TYPE_CHECKING, Dict, Iterable, List, Optional, Tuple
+
+if TYPE_CHECKING:
+    import pyarrow as pa
+
+# Rows read at a time when a spooled CSV has to be rewritten with columns added after its header
+REWRITE_CHUNKSIZE = 100_000
+# Rows buffered into each Parquet row group, persona frames are too small to be row groups of their own
+PARQUET_ROW_GROUP_ROWS = 65_536
+
+METRICS_OUTPUT = "memories_eval_metrics"
+RESULTS_OUTPUT = "memories_eval_results"
+# Column of each output identifying a persona's run
+RUN_COLUMNS = {METRICS_OUTPUT: "run_id", RESULTS_OUTPUT: "run_idx"}
+# Types of the known columns of each output, named so that CSV-only runs do not need pyarrow, see arrow_type
+# They are typed up front as a persona's frame may only hold the missing metrics of failed passes, other metrics columns
+# are inferred and other results columns, extra fields of generated memories, are saved as strings
+COLUMN_TYPES = {
+    METRICS_OUTPUT: {
+        "persona_id": "dictionary",
+        "run_id": "int64",
+        "total_memories_generated": "int64",
+        "total_queries": "int64",
+        "coverage_count": "int64",
+        "coverage_perc": "float64",
+        "extra_count": "int64",
+        "extra_perc": "float64",
+        "missing_count": "int64",
+        "missing_perc": "float64",
+        "queries_without_a_memory": "list",
+        "duplicate_count": "int64",
+        "duplicate_perc": "float64"
+    },
+    RESULTS_OUTPUT: {
+        "persona_id": "dictionary",
+        "run_idx": "int64",
+        "insight_summary": "string",
+        "category": "string",
+        "intent": "string",
+        # Scores are rated 1 to 5 but models also return fractional ones, values that are not numbers are saved as nulls
+        "score": "float64",
+        "related_queries": "list",
+        "count_related_queries": "int64"
+    }
+}
+DEFAULT_TYPES = {METRICS_OUTPUT: None, RESULTS_OUTPUT: "string"}
+
+
+def import_pyarrow() -> Tuple:
+    """
+    Imports pyarrow and its Parquet module, which only Parquet outputs need
+    """
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError as e:
+        raise ImportError("Parquet outputs need pyarrow, install it or only save the csv output format") from e
+    return pa, pq
+
+
+def arrow_type(type_name: str) -> "pa.DataType":
+    """
+    Arrow type of a COLUMN_TYPES name, persona ids are dictionary-encoded and list columns hold strings
+    """
+    pa, _ = import_pyarrow()
+    return {
+        "dictionary": pa.dictionary(pa.int32(), pa.string()),
+        "int64": pa.int64(),
+        "float64": pa.float64(),
+        "string": pa.string(),
+        "list": pa.list_(pa.string())
+    }[type_name]
+
+
+class IncrementalCSVWriter:
+    """
+    Appends per-persona frames to a CSV as they are computed, so a run's outputs never need to be held in memory at once
+    Rows go to a temporary file that is renamed into place on close, so readers never see a partial file
+    Safe to append to from several threads
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.tmp_path = f"{path}.tmp"
+        self.columns = None
+        self.n_rows = 0
+        self._header_columns = None
+        self._file = None
+        self._lock = threading.Lock()
+
+    def append(self, df: pd.DataFrame):
+        """
+        Writes a frame's rows under the columns seen so far, columns it is the first to have are added at the end
+        """
+        with self._lock:
+            if self._file is None:
+                self.columns = df.columns.tolist()
+                self._header_columns = list(self.columns)
+                self._file = open(self.tmp_path, "w", newline="")
+                df.to_csv(self._file)
+            else:
+                self.columns += [column for column in df.columns if column not in self.columns]
+                df.reindex(columns=self.columns).to_csv(self._file, header=False)
+            self._file.flush()
+            self.n_rows += len(df)
+
+    def rewrite_header(self):
+        """
+        Pads the rows written before the last new column appeared, streaming the spooled file in chunks
+        """
+        padded_path = f"{self.tmp_path}.padded"
+        chunks = pd.read_csv(self.tmp_path, header=None, skiprows=1, names=[""] + self.columns, index_col=0, chunksize=REWRITE_CHUNKSIZE)
+        with open(padded_path, "w", newline="") as _o:
+            for chunk_idx, chunk in enumerate(chunks):
+                chunk.index.name = None
+                chunk.to_csv(_o, header=chunk_idx == 0)
+        os.replace(padded_path, self.tmp_path)
+
+    def close(self) -> int:
+        """
+        Moves the written rows into place and returns their count, a writer that got no rows writes an empty frame
+        """
+        with self._lock:
+            if self._file is None:
+                pd.DataFrame().to_csv(self.tmp_path)
+            else:
+                self._file.close()
+                if self.columns != self._header_columns:
+                    self.rewrite_header()
+            os.replace(self.tmp_path, self.path)
+            return self.n_rows
+
+    def discard(self):
+        """
+        Drops the rows of a failed run, leaving any earlier output at the path untouched
+        """
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+            if os.path.exists(self.tmp_path):
+                os.remove(self.tmp_path)
+
+
+def to_arrow_array(values: pd.Series, data_type: "pa.DataType") -> "pa.Array":
+    """
+    Converts a column to an Arrow type, stringifying values of string columns and coercing numeric ones
+    """
+    pa, _ = import_pyarrow()
+    values = values.astype(object)
+    if pa.types.is_string(data_type) or pa.types.is_dictionary(data_type):
+        values = values.map(lambda value: value if value is None or isinstance(value, str) else None if np.ndim(value) == 0 and pd.isna(value) else str(value))
+    elif pa.types.is_integer(data_type) or pa.types.is_floating(data_type):
+        values = pd.to_numeric(values, errors="coerce")
+    return pa.array(values, type=data_type, from_pandas=True)
+
+
+def pad_table(table: "pa.Table", schema: "pa.Schema") -> "pa.Table":
+    """
+    Adds the columns of a schema missing from a table as nulls
+    """
+    pa, _ = import_pyarrow()
+    return pa.Table.from_arrays(
+        [table.column(field.name) if field.name in table.column_names else pa.nulls(len(table), type=field.type) for field in schema],
+        schema=schema
+    )
+
+
+class IncrementalParquetWriter:
+    """
+    Appends per-persona frames to a Parquet file, with known columns typed by column_types and others either typed
+    default_type or inferred from the first frame that has them
+    Frames are buffered into row groups of PARQUET_ROW_GROUP_ROWS rows, written to a temporary file renamed into place on close
+    Safe to append to from several threads, raises ImportError when pyarrow is not installed
+    """
+
+    def __init__(
+        self,
+        path: str,
+        compression: str = "zstd",
+        column_types: Optional[Dict[str, "pa.DataType"]] = None,
+        default_type: Optional["pa.DataType"] = None
+    ):
+        self.pa, self.pq = import_pyarrow()
+        self.path = path
+        self.compression = compression
+        self.column_types = column_types or {}
+        self.default_type = default_type
+        self.schema = None
+        self.n_rows = 0
+        self._spool_path = f"{path}.tmp"
+        self._spool_generation = 0
+        self._writer = None
+        self._pending = []
+        self._lock = threading.Lock()
+
+    def column_type(self, df: pd.DataFrame, column: str) -> "pa.DataType":
+        if column in self.column_types:
+            return self.column_types[column]
+        if self.default_type is not None:
+            return self.default_type
+        try:
+            return self.pa.array(df[column], from_pandas=True).type
+        except (self.pa.ArrowInvalid, self.pa.ArrowTypeError):
+            return self.pa.string()
+
+    def to_table(self, df: pd.DataFrame) -> "pa.Table":
+        return self.pa.Table.from_arrays(
+            [to_arrow_array(df[field.name], field.type) if field.name in df.columns else self.pa.nulls(len(df), type=field.type) for field in self.schema],
+            schema=self.schema
+        )
+
+    def extend_schema(self, new_fields: List["pa.Field"]):
+        """
+        Adds columns first seen after rows were written, copying the written row groups to a new spool file with null columns
+        """
+        self.schema = self.pa.schema(list(self.schema) + new_fields)
+        self._pending = [pad_table(table, self.schema) for table in self._pending]
+        if self._writer is None:
+            return
+        self._writer.close()
+        old_spool_path = self._spool_path
+        self._spool_generation += 1
+        self._spool_path = f"{self.path}.{self._spool_generation}.tmp"
+        self._writer = self.pq.ParquetWriter(self._spool_path, self.schema, compression=self.compression)
+        written = self.pq.ParquetFile(old_spool_path)
+        for row_group in range(written.num_row_groups):
+            self._writer.write_table(pad_table(written.read_row_group(row_group), self.schema))
+        written.close()
+        os.remove(old_spool_path)
+
+    def flush(self):
+        """
+        Writes the buffered frames as one row group
+        """
+        if not self._pending:
+            return
+        if self._writer is None:
+            self._writer = self.pq.ParquetWriter(self._spool_path, self.schema, compression=self.compression)
+        self._writer.write_table(self.pa.concat_tables(self._pending), row_group_size=sum([len(table) for table in self._pending]))
+        self._pending = []
+
+    def append(self, df: pd.DataFrame):
+        with self._lock:
+            if self.schema is None:
+                self.schema = self.pa.schema([self.pa.field(column, self.column_type(df, column)) for column in df.columns])
+            else:
+                new_fields = [self.pa.field(column, self.column_type(df, column)) for column in df.columns if column not in self.schema.names]
+                if new_fields:
+                    self.extend_schema(new_fields)
+            self._pending.append(self.to_table(df))
+            self.n_rows += len(df)
+            if sum([len(table) for table in self._pending]) >= PARQUET_ROW_GROUP_ROWS:
+                self.flush()
+
+    def close(self) -> int:
+        """
+        Moves the written rows into place and returns their count, a writer that got no rows writes an empty table
+        """
+        with self._lock:
+            if self.schema is None:
+                self.pq.write_table(self.pa.table({}), self._spool_path, compression=self.compression)
+            else:
+                self.flush()
+                if self._writer is None:
+                    self.pq.write_table(self.schema.empty_table(), self._spool_path, compression=self.compression)
+                else:
+                    self._writer.close()
+            os.replace(self._spool_path, self.path)
+            return self.n_rows
+
+    def discard(self):
+        with self._lock:
+            if self._writer is not None:
+                self._writer.close()
+            if os.path.exists(self._spool_path):
+                os.remove(self._spool_path)
+
+
+def open_output_writers(outdir: str, output: str, formats: Iterable[str], compression: str = "zstd") -> List:
+    """
+    Writers of one of the evaluator's outputs, one per saved format
+    """
+    writers = []
+    if "csv" in formats:
+        writers.append(IncrementalCSVWriter(f"{outdir}/{output}.csv"))
+    if "parquet" in formats:
+        writers.append(IncrementalParquetWriter(
+            f"{outdir}/{output}.parquet",
+            compression=compression,
+            column_types={column: arrow_type(type_name) for column, type_name in COLUMN_TYPES[output].items()},
+            default_type=arrow_type(DEFAULT_TYPES[output]) if DEFAULT_TYPES[output] is not None else None
+        ))
+    return writers
+
+
+def output_formats(outdir: str, output: str) -> List[str]:
+    """
+    Formats an output was saved in, in the order they are preferred for loading
+    """
+    return [output_format for output_format in ["parquet", "csv"] if os.path.exists(f"{outdir}/{output}.{output_format}")]
+
+
+def load_output(
+    outdir: str,
+    output: str,
+    personas: Optional[Iterable[str]] = None,
+    runs: Optional[Iterable[int]] = None,
+    columns: Optional[List[str]] = None,
+    output_format: Optional[str] = None
+) -> pd.DataFrame:
+    """
+    Reads the metrics or results of a run as a typed frame, with persona_id as a category, list columns as lists
+    and nullable integers, from its Parquet file when there is one and its CSV otherwise
+    Parquet reads only load the row groups that can hold the given personas and runs
+    """
+    formats = output_formats(outdir, output)
+    if output_format is not None:
+        formats = [saved_format for saved_format in formats if saved_format == output_format]
+    if not formats:
+        raise FileNotFoundError(f"No saved {output} in \"{outdir}\"")
+    run_column = RUN_COLUMNS[output]
+    if formats[0] == "parquet":
+        filters = []
+        if personas is not None:
+            filters.append(("persona_id", "in", list(personas)))
+        if runs is not None:
+            filters.append((run_column, "in", list(runs)))
+        _, pq = import_pyarrow()
+        output_df = pq.read_table(f"{outdir}/{output}.parquet", columns=columns, filters=filters or None).to_pandas()
+    else:
+        output_df = pd.read_csv(f"{outdir}/{output}.csv", index_col=0).reset_index(drop=True)
+        if personas is not None:
+            output_df = output_df[output_df["persona_id"].isin(list(personas))]
+        if runs is not None:
+            output_df = output_df[output_df[run_column].isin(list(runs))]
+        if columns is not None:
+            output_df = output_df[columns]
+        output_df = output_df.reset_index(drop=True)
+
+    for column, type_name in COLUMN_TYPES[output].items():
+        if column not in output_df.columns:
+            continue
+        if type_name == "list":
+            output_df[column] = output_df[column].map(
+                lambda values: list(ast.literal_eval(values) if isinstance(values, str) else values) if np.ndim(values) > 0 or isinstance(values, str) else None
+            )
+        elif type_name == "dictionary":
+            output_df[column] = output_df[column].astype("category")
+        elif type_name == "int64":
+            output_df[column] = output_df[column].astype("Int64")
+        elif type_name == "float64":
+            output_df[column] = pd.to_numeric(output_df[column], errors="coerce").astype("float64")
+    return output_df
+
+
+def load_metrics(outdir: str, **kwargs) -> pd.DataFrame:
+    return load_output(outdir, METRICS_OUTPUT, **kwargs)
+
+
+def load_results(outdir: str, **kwargs) -> pd.DataFrame:
+    return load_output(outdir, RESULTS_OUTPUT, **kwargs)
@@ -0,0 +1,347 @@
+import os
+import json
+import time
+import sqlite3
+import numpy as np
+import pandas as pd
+from argparse import ArgumentParser
+from typing import Any, Dict, List, Optional, Tuple
+
+from metrics import METRICS_COLUMNS
+from results_io import METRICS_OUTPUT, RESULTS_OUTPUT, load_metrics, load_results, output_formats
+from utils import load_json_if_valid
+
+RUN_INFO_FILE = "run_info.json"
+DEFAULT_HISTORY_DB = "run_history.sqlite"
+# Columns saved per table, list columns are saved as JSON text
+RESULTS_COLUMNS = [
+    "persona_id", "run_idx", "insight_summary", "category", "intent", "score", "related_queries", "count_related_queries"
+]
+LIST_COLUMNS = ["queries_without_a_memory", "related_queries"]
+# Compared rates and whether an increase is a regression
+RATE_METRICS = {"coverage_perc": False, "extra_perc": True, "missing_perc": True, "duplicate_perc": True}
+# Values resampled at once by a chunk of bootstrap draws, bounding the memory of comparing runs with many personas and passes
+BOOTSTRAP_CHUNK_ELEMENTS = 1 << 22
+
+SCHEMA = [
+    "CREATE TABLE IF NOT EXISTS runs ("
+    "run_name TEXT PRIMARY KEY, outdir TEXT NOT NULL, ingested_at REAL NOT NULL, started_at REAL, stages TEXT, "
+    "generation_backend TEXT, generation_model TEXT, judge_model TEXT, "
+    "firefox_version TEXT, firefox_build_id TEXT, firefox_source_stamp TEXT, run_info TEXT)",
+    "CREATE TABLE IF NOT EXISTS metrics ("
+    "run_name TEXT NOT NULL, persona_id TEXT NOT NULL, run_id INTEGER NOT NULL, total_memories_generated INTEGER, "
+    "total_queries INTEGER, coverage_count INTEGER, coverage_perc REAL, extra_count INTEGER, extra_perc REAL, "
+    "missing_count INTEGER, missing_perc REAL, queries_without_a_memory TEXT, duplicate_count INTEGER, duplicate_perc REAL, "
+    "PRIMARY KEY (run_name, persona_id, run_id))",
+    "CREATE TABLE IF NOT EXISTS results ("
+    "run_name TEXT NOT NULL, persona_id TEXT NOT NULL, run_idx INTEGER NOT NULL, insight_summary TEXT, category TEXT, "
+    "intent TEXT, score REAL, related_queries TEXT, count_related_queries INTEGER)",
+    "CREATE INDEX IF NOT EXISTS results_run_persona ON results (run_name, persona_id, run_idx)"
+]
+
+
+def to_rows(output_df: pd.DataFrame, run_name: str, columns: List[str]) -> List[Tuple]:
+    """
+    SQLite rows of an output frame, with missing values as NULL and list columns as JSON
+    """
+    output_df = output_df.reindex(columns=columns).astype(object)
+    for column in LIST_COLUMNS:
+        if column in output_df.columns:
+            output_df[column] = output_df[column].map(lambda values: json.dumps(values) if isinstance(values, list) else None)
+    output_df = output_df.where(output_df.notna(), None)
+    return [(run_name, *row) for row in output_df.itertuples(index=False, name=None)]
+
+
+def bootstrap_chunks(n_bootstrap: int, draw_elements: int) -> List[slice]:
+    """
+    Splits bootstrap draws into chunks of at most BOOTSTRAP_CHUNK_ELEMENTS values, at least one draw each
+    """
+    chunk_size = max(1, BOOTSTRAP_CHUNK_ELEMENTS // max(draw_elements, 1))
+    return [slice(chunk_start, min(chunk_start + chunk_size, n_bootstrap)) for chunk_start in range(0, n_bootstrap, chunk_size)]
+
+
+def bootstrap_pass_means(values: np.ndarray, counts: np.ndarray, n_bootstrap: int, rng: np.random.Generator) -> np.ndarray:
+    """
+    Bootstrap means of every persona's passes, resampling each persona's passes with replacement, a chunk of draws at a time
+    values holds a row of passes per persona padded with NaN to the longest row, counts the passes of each row
+    Returns an n_bootstrap x personas array, NaN for personas without passes
+    """
+    n_personas, max_passes = values.shape
+    in_sample = np.arange(max_passes)[None, None, :] < counts[None, :, None]
+    means = np.empty((n_bootstrap, n_personas))
+    for chunk in bootstrap_chunks(n_bootstrap, n_personas * max_passes):
+        n_draws = chunk.stop - chunk.start
+        slots = np.floor(rng.random((n_draws, n_personas, max_passes)) * counts[None, :, None]).astype(int)
+        sampled = np.take_along_axis(np.broadcast_to(values, (n_draws, n_personas, max_passes)), slots, axis=2)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            means[chunk] = np.where(in_sample, sampled, 0.0).sum(axis=2) / counts[None, :]
+    return means
+
+
+def pass_matrix(metrics_df: pd.DataFrame, metric: str, personas: List[str]) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    A metric's values per persona and pass, padded with NaN, and each persona's number of passes with a value
+    """
+    valid_df = metrics_df.dropna(subset=[metric])
+    matrix_df = valid_df.assign(slot=valid_df.groupby("persona_id").cumcount()).pivot(index="persona_id", columns="slot", values=metric)
+    matrix_df = matrix_df.reindex(personas)
+    if matrix_df.shape[1] == 0:
+        matrix_df[0] = np.nan
+    return matrix_df.to_numpy(dtype=float), matrix_df.notna().sum(axis=1).to_numpy()
+
+
+def verdict(ci_low: float, ci_high: float, worse_if_higher: bool) -> str:
+    """
+    Whether a change is a regression or an improvement, i.e. its interval excludes zero
+    """
+    if np.isnan(ci_low) or np.isnan(ci_high) or ci_low <= 0 <= ci_high:
+        return "no change"
+    return "regressed" if (ci_low > 0) == worse_if_higher else "improved"
+
+
+class RunHistory:
+    """
+    SQLite store of evaluator runs, with their metrics, results and what they were run with, for comparing runs
+    """
+
+    def __init__(self, path: str = DEFAULT_HISTORY_DB):
+        self.path = path
+        self._conn = sqlite3.connect(path)
+        for statement in SCHEMA:
+            self._conn.execute(statement)
+        self._conn.commit()
+
+    def ingest(self, outdir: str, run_name: Optional[str] = None) -> str:
+        """
+        Saves a run's metrics and results under a name, the output directory name by default, replacing an earlier ingest
+        """
+        run_name = run_name or os.path.basename(os.path.normpath(outdir))
+        if not output_formats(outdir, METRICS_OUTPUT):
+            raise FileNotFoundError(f"No saved metrics in \"{outdir}\", only runs with the metrics stage can be ingested")
+        run_info = load_json_if_valid(f"{outdir}/{RUN_INFO_FILE}") or {}
+        firefox_build = run_info.get("firefox_build") or {}
+        metrics_df = load_metrics(outdir)
+        results_df = load_results(outdir) if output_formats(outdir, RESULTS_OUTPUT) else pd.DataFrame()
+
+        with self._conn:
+            for table in ["runs", "metrics", "results"]:
+                self._conn.execute(f"DELETE FROM {table} WHERE run_name = ?", (run_name,))
+            self._conn.execute(
+                "INSERT INTO runs (run_name, outdir, ingested_at, started_at, stages, generation_backend, generation_model, "
+                "judge_model, firefox_version, firefox_build_id, firefox_source_stamp, run_info) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    run_name, os.path.abspath(outdir), time.time(), run_info.get("started_at"),
+                    ",".join(run_info["stages"]) if "stages" in run_info else None,
+                    run_info.get("generation_backend"), run_info.get("generation_model"), run_info.get("judge_model"),
+                    firefox_build.get("version"), firefox_build.get("buildid"), firefox_build.get("sourcestamp"),
+                    json.dumps(run_info) if run_info else None
+                )
+            )
+            self._conn.executemany(
+                f"INSERT INTO metrics (run_name, {', '.join(METRICS_COLUMNS)}) VALUES ({', '.join(['?'] * (len(METRICS_COLUMNS) + 1))})",
+                to_rows(metrics_df, run_name, METRICS_COLUMNS)
+            )
+            self._conn.executemany(
+                f"INSERT INTO results (run_name, {', '.join(RESULTS_COLUMNS)}) VALUES ({', '.join(['?'] * (len(RESULTS_COLUMNS) + 1))})",
+                to_rows(results_df, run_name, RESULTS_COLUMNS)
+            )
+        print(f"Ingested \"{run_name}\": {len(metrics_df)} metrics rows, {len(results_df)} results rows")
+        return run_name
+
+    def runs(self) -> pd.DataFrame:
+        return pd.read_sql_query(
+            "SELECT run_name, outdir, datetime(ingested_at, 'unixepoch') AS ingested, generation_backend, generation_model, "
+            "judge_model, firefox_version, firefox_build_id, "
+            "(SELECT COUNT(DISTINCT persona_id) FROM metrics WHERE metrics.run_name = runs.run_name) AS personas "
+            "FROM runs ORDER BY ingested_at",
+            self._conn
+        )
+
+    def run_metrics(self, run_name: str) -> pd.DataFrame:
+        if self._conn.execute("SELECT 1 FROM runs WHERE run_name = ?", (run_name,)).fetchone() is None:
+            raise KeyError(f"No run named \"{run_name}\" in \"{self.path}\"")
+        return pd.read_sql_query(
+            f"SELECT persona_id, run_id, {', '.join(RATE_METRICS)} FROM metrics WHERE run_name = ? ORDER BY persona_id, run_id",
+            self._conn,
+            params=(run_name,)
+        )
+
+    def generation_backend(self, run_name: str) -> Optional[str]:
+        row = self._conn.execute("SELECT generation_backend FROM runs WHERE run_name = ?", (run_name,)).fetchone()
+        if row is None:
+            raise KeyError(f"No run named \"{run_name}\" in \"{self.path}\"")
+        return row[0]
+
+    def check_backends(self, base_run: str, candidate_run: str, allow_mixed_backends: bool = False):
+        """
+        Refuses to compare runs generated by different backends unless allowed, in which case it only warns
+        """
+        backends = [self.generation_backend(base_run), self.generation_backend(candidate_run)]
+        if None in backends:
+            print(f"WARNING: the generation backend of {'both runs' if backends == [None, None] else 'a run'} is unknown, the runs may not be comparable")
+        elif backends[0] != backends[1]:
+            message = (
+                f"Run \"{base_run}\" was generated by the {backends[0]} backend and \"{candidate_run}\" by the {backends[1]} backend, "
+                "their differences include the backends' own"
+            )
+            if not allow_mixed_backends:
+                raise ValueError(f"{message}, use --allow-mixed-backends to compare them anyway")
+            print(f"WARNING: {message}")
+
+    def compare(
+        self,
+        base_run: str,
+        candidate_run: str,
+        n_bootstrap: int = 2000,
+        confidence: float = 0.95,
+        seed: int = 0,
+        allow_mixed_backends: bool = False
+    ) -> Tuple[pd.DataFrame, pd.DataFrame]:
+        """
+        Per-persona and overall changes of the candidate's rates from the base's, with bootstrap confidence intervals
+        Persona intervals resample each persona's passes, the overall interval also resamples the personas
+        Only personas evaluated by both runs are compared, and only runs of the same generation backend unless allowed
+        """
+        self.check_backends(base_run, candidate_run, allow_mixed_backends)
+        base_df = self.run_metrics(base_run)
+        candidate_df = self.run_metrics(candidate_run)
+        personas = sorted(set(base_df["persona_id"]) & set(candidate_df["persona_id"]))
+        unpaired = sorted(set(base_df["persona_id"]) ^ set(candidate_df["persona_id"]))
+        if unpaired:
+            print(f"Skipping {len(unpaired)} personas evaluated by only one of the runs: {unpaired}")
+        if not personas:
+            raise ValueError(f"Runs \"{base_run}\" and \"{candidate_run}\" have no persona in common")
+
+        rng = np.random.default_rng(seed)
+        quantiles = [(1 - confidence) / 2 * 100, (1 + confidence) / 2 * 100]
+        persona_frames = []
+        summary_rows = []
+        for metric, worse_if_higher in RATE_METRICS.items():
+            base_values, base_counts = pass_matrix(base_df, metric, personas)
+            candidate_values, candidate_counts = pass_matrix(candidate_df, metric, personas)
+            with np.errstate(invalid="ignore", divide="ignore"):
+                base_means = np.nansum(base_values, axis=1) / base_counts
+                candidate_means = np.nansum(candidate_values, axis=1) / candidate_counts
+            deltas = candidate_means - base_means
+            bootstrap_deltas = (
+                bootstrap_pass_means(candidate_values, candidate_counts, n_bootstrap, rng)
+                - bootstrap_pass_means(base_values, base_counts, n_bootstrap, rng)
+            )
+            paired = ~np.isnan(deltas)
+            persona_ci = np.full((2, len(personas)), np.nan)
+            if paired.any():
+                persona_ci[:, paired] = np.percentile(bootstrap_deltas[:, paired], quantiles, axis=0)
+            persona_frames.append(pd.DataFrame({
+                "persona_id": personas,
+                "metric": metric,
+                "base_passes": base_counts,
+                "candidate_passes": candidate_counts,
+                "base_mean": base_means,
+                "candidate_mean": candidate_means,
+                "delta": deltas,
+                "ci_low": persona_ci[0],
+                "ci_high": persona_ci[1],
+                "verdict": [verdict(low, high, worse_if_higher) for low, high in persona_ci.T]
+            }))
+
+            # Hierarchical bootstrap of the mean change: resample personas, then each persona's passes
+            n_paired = int(paired.sum())
+            overall_ci = [np.nan, np.nan]
+            if n_paired:
+                paired_deltas = bootstrap_deltas[:, paired]
+                overall_means = np.empty(n_bootstrap)
+                for chunk in bootstrap_chunks(n_bootstrap, n_paired):
+                    persona_draws = rng.integers(0, n_paired, size=(chunk.stop - chunk.start, n_paired))
+                    overall_means[chunk] = np.take_along_axis(paired_deltas[chunk], persona_draws, axis=1).mean(axis=1)
+                overall_ci = np.percentile(overall_means, quantiles)
+            summary_rows.append({
+                "metric": metric,
+                "personas": n_paired,
+                "base_mean": base_means[paired].mean() if n_paired else np.nan,
+                "candidate_mean": candidate_means[paired].mean() if n_paired else np.nan,
+                "delta": deltas[paired].mean() if n_paired else np.nan,
+                "ci_low": overall_ci[0],
+                "ci_high": overall_ci[1],
+                "verdict": verdict(overall_ci[0], overall_ci[1], worse_if_higher)
+            })
+        return pd.DataFrame(summary_rows), pd.concat(persona_frames, ignore_index=True)
+
+    def close(self):
+        self._conn.close()
+
+
+def run_info(config: Any, stages: List[str], firefox_build: Optional[Dict[str, str]], **extra) -> Dict:
+    """
+    What a run was made with, saved to its output directory for ingesting, without the config's keys
+    """
+    def redact(value: Any) -> Any:
+        if isinstance(value, dict):
+            return {key: "<redacted>" if key.endswith("key") and value[key] else redact(item) for key, item in value.items()}
+        if isinstance(value, list):
+            return [redact(item) for item in value]
+        return value
+
+    return {
+        "started_at": time.time(),
+        "stages": stages,
+        "generation_backend": config.memories_generation.backend,
+        "generation_model": config.lite_llm.model,
+        "judge_model": config.openai.model,
+        "firefox_build": firefox_build,
+        **extra,
+        "config": redact(config.model_dump(mode="json"))
+    }
+
+
+def get_args():
+    parser = ArgumentParser()
+    parser.add_argument("--db", default=DEFAULT_HISTORY_DB, help="run history SQLite file")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    ingest_parser = subparsers.add_parser("ingest", help="save the metrics and results of evaluator output directories")
+    ingest_parser.add_argument("outdirs", nargs="+", help="evaluator output directories")
+    ingest_parser.add_argument("--name", default=None, help="run name, the output directory name by default, only with one directory")
+    subparsers.add_parser("list", help="list the ingested runs")
+    compare_parser = subparsers.add_parser("compare", help="compare a candidate run's rates to a base run's")
+    compare_parser.add_argument("base", help="name of the base run")
+    compare_parser.add_argument("candidate", help="name of the candidate run")
+    compare_parser.add_argument("--n-bootstrap", dest="n_bootstrap", type=int, default=2000, help="bootstrap resamples")
+    compare_parser.add_argument("--confidence", type=float, default=0.95, help="confidence level of the intervals")
+    compare_parser.add_argument("--seed", type=int, default=0)
+    compare_parser.add_argument(
+        "--allow-mixed-backends", dest="allow_mixed_backends", action="store_true",
+        help="compare runs generated by different backends, e.g. the python backend and Firefox"
+    )
+    compare_parser.add_argument("--output", default=None, help="CSV to save the per-persona deltas to")
+    return parser.parse_args()
+
+
+def main():
+    args = get_args()
+    history = RunHistory(args.db)
+    try:
+        if args.command == "ingest":
+            if args.name is not None and len(args.outdirs) > 1:
+                raise SystemExit("--name can only be given with one output directory")
+            for outdir in args.outdirs:
+                history.ingest(outdir, args.name)
+        elif args.command == "list":
+            print(history.runs().to_string(index=False))
+        else:
+            summary_df, persona_df = history.compare(
+                args.base, args.candidate, args.n_bootstrap, args.confidence, args.seed, args.allow_mixed_backends
+            )
+            print(f"\"{args.candidate}\" vs \"{args.base}\", {args.confidence:.0%} bootstrap intervals of the change:")
+            print(summary_df.to_string(index=False, float_format=lambda value: f"{value:.4f}"))
+            changed_df = persona_df[persona_df["verdict"] != "no change"]
+            if len(changed_df):
+                print("Personas with a significant change:")
+                print(changed_df.to_string(index=False, float_format=lambda value: f"{value:.4f}"))
+            if args.output is not None:
+                persona_df.to_csv(args.output, index=False)
+                print(f"Saved per-persona deltas to {args.output}")
+    finally:
+        history.close()
+
+
+if __name__ == "__main__":
+    main()
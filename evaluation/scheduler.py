@@ -0,0 +1,85 @@
+import time
+import queue
+import threading
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from concurrent.futures import ThreadPoolExecutor
+
+
+def run_work_queue(
+    items: List[Any],
+    worker_fn: Callable[[Any, str], Any],
+    n_workers: int,
+    label: str,
+    should_stop: Optional[Callable[[], bool]] = None
+) -> Tuple[List[Any], Dict]:
+    """
+    Runs worker_fn over items with n_workers threads pulling one item at a time from a shared queue
+    Items are handed out in list order, so sort them beforehand for longest-job-first scheduling
+    Once should_stop returns True no more items are handed out, the skipped items keep a None result
+    Returns results in item order, along with throughput and per-worker utilization stats
+    Throughput only counts the items that ran, skipped items are reported separately
+    """
+    work = queue.Queue()
+    for item_idx, item in enumerate(items):
+        work.put((item_idx, item))
+    results = [None] * len(items)
+    failed = threading.Event()
+    skipped = []
+
+    def worker(worker_id: int) -> Dict:
+        worker_stats = {"worker_id": worker_id, "items": 0, "busy_seconds": 0.0}
+        while not failed.is_set():
+            try:
+                item_idx, item = work.get_nowait()
+            except queue.Empty:
+                break
+            if should_stop is not None and should_stop():
+                skipped.append(item_idx)
+                continue
+            start = time.perf_counter()
+            try:
+                results[item_idx] = worker_fn(item, f"[Thread {worker_id}][{item_idx+1}/{len(items)}]")
+            except Exception:
+                # Stop handing out work, the error is raised from the executor below
+                failed.set()
+                raise
+            finally:
+                worker_stats["busy_seconds"] += time.perf_counter() - start
+            worker_stats["items"] += 1
+        return worker_stats
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=n_workers) as executor:
+        tasks = [executor.submit(worker, worker_id) for worker_id in range(min(n_workers, len(items)))]
+        workers_stats = [task.result() for task in tasks]
+    wall_seconds = time.perf_counter() - start
+
+    for worker_stats in workers_stats:
+        worker_stats["utilization"] = worker_stats["busy_seconds"] / wall_seconds if wall_seconds > 0 else 0.0
+    processed = sum([worker_stats["items"] for worker_stats in workers_stats])
+    stats = {
+        "label": label,
+        "items": len(items),
+        "processed": processed,
+        "skipped": len(skipped),
+        "wall_seconds": wall_seconds,
+        "items_per_minute": processed / wall_seconds * 60 if wall_seconds > 0 else 0.0,
+        "workers": workers_stats
+    }
+    return results, stats
+
+
+def format_schedule_stats(stats: Dict) -> str:
+    """
+    Summarizes a work queue run as throughput of the items that ran plus a line per worker
+    """
+    lines = [
+        f"{stats['label']}: {stats['processed']} items in {stats['wall_seconds']:.1f}s ({stats['items_per_minute']:.2f} items/min)"
+        + (f", {stats['skipped']} of {stats['items']} skipped" if stats.get("skipped") else "")
+    ]
+    for worker_stats in stats["workers"]:
+        lines.append(
+            f"  [Thread {worker_stats['worker_id']}] {worker_stats['items']} items, "
+            f"busy {worker_stats['busy_seconds']:.1f}s, utilization {worker_stats['utilization']:.0%}"
+        )
+    return "\n".join(lines)
@@ -0,0 +1,183 @@
+import os
+import sys
+import glob
+import shutil
+import hashlib
+import pandas as pd
+from argparse import ArgumentParser
+from typing import Dict, List, Tuple
+
+from results_io import METRICS_OUTPUT, RESULTS_OUTPUT, RUN_COLUMNS, load_output, open_output_writers, output_formats
+from utils import atomic_write_json, load_json_if_valid
+
+SHARD_FILE = "shard.json"
+MERGE_MANIFEST_FILE = "merge_manifest.json"
+# Per-persona artifact directories and append-only logs of a run, copied or concatenated when merging shards
+PERSONA_ARTIFACT_DIRS = ["1.memories_generation", "2.metrics_artifacts"]
+JSONL_ARTIFACTS = ["judge_failures.jsonl", "token_usage.jsonl"]
+
+
+def parse_shard(shard: str) -> Tuple[int, int]:
+    """
+    Parses an i/N shard spec, where 0 <= i < N
+    """
+    try:
+        shard_id, n_shards = [int(part) for part in shard.split("/")]
+    except ValueError:
+        raise ValueError(f"Invalid shard \"{shard}\", expected i/N such as 0/4")
+    if n_shards < 1 or not 0 <= shard_id < n_shards:
+        raise ValueError(f"Invalid shard \"{shard}\", expected 0 <= i < N")
+    return shard_id, n_shards
+
+
+def persona_shard(persona: str, n_shards: int) -> int:
+    """
+    Stable shard of a persona, the same on every machine and Python process unlike hash()
+    """
+    return int(hashlib.sha256(persona.encode("utf-8")).hexdigest(), 16) % n_shards
+
+
+def shard_personas(personas: List[str], shard_id: int, n_shards: int) -> List[str]:
+    return [persona for persona in personas if persona_shard(persona, n_shards) == shard_id]
+
+
+def shard_outdir_prefix(outdir_prefix: str, shard_id: int, n_shards: int) -> str:
+    """
+    Output directory prefix of a shard, so shards sharing a filesystem do not overwrite each other
+    """
+    return f"{outdir_prefix.strip('_')}_shard{shard_id}of{n_shards}"
+
+
+def load_shard_outputs(shard_dir: str) -> Dict:
+    """
+    Reads a shard's manifest and the formats its metrics and results were saved in
+    """
+    manifest = load_json_if_valid(f"{shard_dir}/{SHARD_FILE}")
+    if not isinstance(manifest, dict):
+        raise ValueError(f"\"{shard_dir}\" has no {SHARD_FILE}, it was not run with --shard")
+    outputs = {"dir": shard_dir, "manifest": manifest}
+    for output in [METRICS_OUTPUT, RESULTS_OUTPUT]:
+        outputs[output] = output_formats(shard_dir, output)
+    return outputs
+
+
+def check_shards(shards: List[Dict]) -> List[str]:
+    """
+    Consistency problems of a set of shards: mismatched shard counts, missing or repeated shards,
+    personas evaluated by several shards and assigned personas missing from a shard's metrics
+    """
+    problems = []
+    n_shards = sorted(set([shard["manifest"]["n_shards"] for shard in shards]))
+    if len(n_shards) > 1:
+        problems.append(f"Shards were run with different shard counts {n_shards}")
+    shard_ids = [shard["manifest"]["shard_id"] for shard in shards]
+    missing_shards = [shard_id for shard_id in range(max(n_shards)) if shard_id not in shard_ids]
+    repeated_shards = sorted(set([shard_id for shard_id in shard_ids if shard_ids.count(shard_id) > 1]))
+    if missing_shards:
+        problems.append(f"Missing shards {missing_shards} of {max(n_shards)}")
+    if repeated_shards:
+        problems.append(f"Shards {repeated_shards} were given more than once")
+
+    persona_owners = {}
+    for shard in shards:
+        metrics_df = load_output(shard["dir"], METRICS_OUTPUT) if shard[METRICS_OUTPUT] else pd.DataFrame()
+        # A shard that ran out of token budget before evaluating anyone saved an empty frame
+        evaluated = set(metrics_df["persona_id"]) if "persona_id" in metrics_df.columns else set()
+        missing_personas = sorted(set(shard["manifest"]["personas"]) - evaluated)
+        if missing_personas:
+            problems.append(f"Shard {shard['manifest']['shard_id']} ({shard['dir']}) has no metrics for {missing_personas}")
+        for persona in evaluated:
+            persona_owners.setdefault(persona, []).append(shard["manifest"]["shard_id"])
+    for persona, owners in sorted(persona_owners.items()):
+        if len(owners) > 1:
+            problems.append(f"Persona \"{persona}\" was evaluated by shards {owners}")
+    return problems
+
+
+def merge_shards(shard_dirs: List[str], outdir: str, allow_incomplete: bool = False) -> Dict:
+    """
+    Combines the metrics, results and artifacts of every shard of a run into one output directory
+    Shards are streamed into the merged outputs one at a time in shard order, so rows are sorted by persona and run within each shard
+    Raises on consistency problems unless allow_incomplete is set, in which case they are only reported
+    """
+    shards = [load_shard_outputs(shard_dir) for shard_dir in shard_dirs]
+    problems = check_shards(shards)
+    for problem in problems:
+        print(problem)
+    if problems and not allow_incomplete:
+        raise ValueError(f"{len(problems)} consistency problems across shards, nothing was merged")
+
+    os.makedirs(outdir, exist_ok=True)
+    for output in [METRICS_OUTPUT, RESULTS_OUTPUT]:
+        # Every format saved by any shard is merged, each shard's rows are read from that format or its other one
+        formats = sorted(set([output_format for shard in shards for output_format in shard[output]]))
+        writers = []
+        try:
+            for shard in sorted(shards, key=lambda shard: shard["manifest"]["shard_id"]):
+                shard_df = load_output(shard["dir"], output) if shard[output] else pd.DataFrame()
+                # A shard that ran out of token budget before evaluating anyone saved an empty frame
+                if "persona_id" not in shard_df.columns:
+                    continue
+                shard_df = shard_df.astype({"persona_id": str}).sort_values(["persona_id", RUN_COLUMNS[output]], kind="stable")
+                if not writers:
+                    writers = open_output_writers(outdir, output, formats)
+                for writer in writers:
+                    writer.append(shard_df.reset_index(drop=True))
+        except BaseException:
+            for writer in writers:
+                writer.discard()
+            raise
+        for writer in writers:
+            writer.close()
+
+    for artifact_dir in PERSONA_ARTIFACT_DIRS:
+        for shard in shards:
+            for persona_dir in sorted(glob.glob(f"{glob.escape(shard['dir'])}/{artifact_dir}/*/")):
+                shutil.copytree(persona_dir, f"{outdir}/{artifact_dir}/{os.path.basename(os.path.normpath(persona_dir))}", dirs_exist_ok=True)
+    for jsonl_name in JSONL_ARTIFACTS:
+        shard_logs = [f"{shard['dir']}/{jsonl_name}" for shard in shards if os.path.exists(f"{shard['dir']}/{jsonl_name}")]
+        if shard_logs:
+            with open(f"{outdir}/{jsonl_name}", "w") as _o:
+                for shard_log in shard_logs:
+                    with open(shard_log, "r") as _j:
+                        shutil.copyfileobj(_j, _o)
+
+    manifest = {
+        "shards": [{"dir": os.path.abspath(shard["dir"]), **shard["manifest"]} for shard in shards],
+        "problems": problems
+    }
+    atomic_write_json(f"{outdir}/{MERGE_MANIFEST_FILE}", manifest)
+    return manifest
+
+
+def get_args():
+    parser = ArgumentParser()
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    merge_parser = subparsers.add_parser("merge", help="combine the output directories of every shard of a run")
+    merge_parser.add_argument("shard_dirs", nargs="+", help="output directories of the shards")
+    merge_parser.add_argument("-o", "--output", required=True, help="merged output directory")
+    merge_parser.add_argument("--allow-incomplete", dest="allow_incomplete", action="store_true", help="merge even with missing shards or personas")
+    assign_parser = subparsers.add_parser("assign", help="print how the profiles of a records directory are spread over N shards")
+    assign_parser.add_argument("--records-path", dest="records_path", required=True, help="directory of the profile CSV files")
+    assign_parser.add_argument("-n", "--n-shards", dest="n_shards", type=int, required=True)
+    return parser.parse_args()
+
+
+def main():
+    args = get_args()
+    if args.command == "assign":
+        personas = [os.path.basename(profile_file).replace(".csv", "") for profile_file in sorted(glob.glob(f"{args.records_path}/*.csv"))]
+        for shard_id in range(args.n_shards):
+            print(f"Shard {shard_id}/{args.n_shards}: {len(shard_personas(personas, shard_id, args.n_shards))} profiles")
+        return
+    if os.path.exists(args.output) and os.listdir(args.output):
+        sys.exit(f"Merged output directory \"{args.output}\" is not empty")
+    try:
+        manifest = merge_shards(args.shard_dirs, args.output, args.allow_incomplete)
+    except ValueError as e:
+        sys.exit(str(e))
+    print(f"Merged {len(manifest['shards'])} shards into \"{args.output}\"")
+
+
+if __name__ == "__main__":
+    main()
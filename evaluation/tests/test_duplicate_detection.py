@@ -0,0 +1,81 @@
+import random
+
+import pytest
+
+from duplicate_detection import DuplicateDetector, UnionFind
+from text_similarity import cosine_similarity_matrix
+
+
+def connected_components(n_items: int, edges: list) -> list:
+    """
+    Groups of more than one item linked by edges, in order of their first item, found by walking the graph
+    """
+    neighbours = {item: set() for item in range(n_items)}
+    for item_a, item_b in edges:
+        neighbours[item_a].add(item_b)
+        neighbours[item_b].add(item_a)
+    seen = set()
+    groups = []
+    for item in range(n_items):
+        if item in seen:
+            continue
+        seen.add(item)
+        stack, group = [item], []
+        while stack:
+            node = stack.pop()
+            group.append(node)
+            for neighbour in neighbours[node] - seen:
+                seen.add(neighbour)
+                stack.append(neighbour)
+        if len(group) > 1:
+            groups.append(sorted(group))
+    return groups
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_union_find_matches_connected_components(seed):
+    rng = random.Random(seed)
+    n_items = 40
+    edges = [(rng.randrange(n_items), rng.randrange(n_items)) for _ in range(30)]
+    union_find = UnionFind(n_items)
+    for item_a, item_b in edges:
+        union_find.union(item_a, item_b)
+    assert union_find.groups() == connected_components(n_items, edges)
+
+
+def test_duplicate_detector_matches_connected_components():
+    memories = [
+        "Plans a budget trip to Japan",
+        "Planning a budget trip to Japan",
+        "Plans a budget trip to Japan",
+        "Researches Tokyo hotels for a trip",
+        "Bakes sourdough bread at home",
+        "Maintains a sourdough starter",
+        "Trains for a spring marathon",
+        "Follows a marathon training plan",
+        "Compares home espresso machines"
+    ]
+    detector = DuplicateDetector(auto_merge_threshold=0.6, borderline_threshold=0.2, max_pairs_per_request=2)
+    union_find, auto_merged_count, borderline_pairs = detector.auto_merge(memories)
+    verdicts = [pair_idx % 2 == 0 for pair_idx in range(len(borderline_pairs))]
+    duplicates_out = detector.to_duplicates_out(memories, union_find, auto_merged_count, borderline_pairs, verdicts)
+
+    similarity = cosine_similarity_matrix(memories, memories)
+    pairs = [(row, col) for row in range(len(memories)) for col in range(row + 1, len(memories))]
+    auto_edges = [(row, col) for row, col in pairs if similarity[row, col] >= 0.6 or memories[row] == memories[col]]
+    auto_groups = connected_components(len(memories), auto_edges)
+    auto_group_of = {item: group_idx for group_idx, group in enumerate(auto_groups) for item in group}
+    expected_borderline = [
+        (row, col) for row, col in pairs
+        if 0.2 <= similarity[row, col] < 0.6 and memories[row] != memories[col]
+        and (row not in auto_group_of or auto_group_of.get(row) != auto_group_of.get(col))
+    ]
+    confirmed_edges = [(row, col) for (row, col, _), is_duplicate in zip(borderline_pairs, verdicts) if is_duplicate]
+
+    assert auto_merged_count == len(auto_edges) > 0
+    assert [(row, col) for row, col, _ in borderline_pairs] == expected_borderline
+    assert len(borderline_pairs) > 1
+    assert all([len(chunk) <= 2 for chunk in detector.pair_chunks(borderline_pairs)])
+    assert duplicates_out["similar_statement_groups"] == [
+        [memories[item] for item in group] for group in connected_components(len(memories), auto_edges + confirmed_edges)
+    ]
@@ -0,0 +1,87 @@
+import random
+import pandas as pd
+
+from metrics import compute_metrics_frame
+
+USED_QUERIES = {
+    "persona_a": ["budget travel japan", "tokyo hotels", "sourdough starter", "marathon training plan", "used car prices"],
+    "persona_b": ["electric bike commute", "home espresso machine", "watercolor painting basics"]
+}
+DUPLICATE_GROUPS = {
+    ("persona_a", 0): [["Bakes sourdough bread", "Bakes bread at home"]],
+    # Statements of a group that are not memories of the run are not counted
+    ("persona_a", 1): [["Trains for a marathon", "Not a memory of this run"]],
+    ("persona_b", 0): [],
+    ("persona_b", 2): [["Learns watercolor", "Learns watercolor"]]
+}
+
+
+def fixture_results() -> pd.DataFrame:
+    return pd.DataFrame([
+        ("persona_a", 0, "Plans a trip to Japan", ["budget travel japan", "tokyo hotels"]),
+        ("persona_a", 0, "Bakes sourdough bread", ["sourdough starter"]),
+        ("persona_a", 0, "Bakes bread at home", []),
+        ("persona_a", 1, "Trains for a marathon", ["marathon training plan"]),
+        ("persona_a", 1, "Shops for running shoes", ["marathon training plan"]),
+        ("persona_b", 0, "Compares espresso machines", []),
+        ("persona_b", 0, "Commutes by e-bike", ["electric bike commute", "electric bike commute"]),
+        ("persona_b", 2, "Learns watercolor", ["watercolor painting basics"])
+    ], columns=["persona_id", "run_idx", "insight_summary", "related_queries"])
+
+
+def per_run_metrics(results_df: pd.DataFrame, used_queries: dict, duplicate_groups: dict) -> pd.DataFrame:
+    """
+    The per-run loop compute_metrics_frame replaced
+    """
+    rows = []
+    for (persona, run_id), run_df in results_df.groupby(["persona_id", "run_idx"], sort=True):
+        total_rows = len(run_df)
+        covered = int((run_df["related_queries"].map(len) > 0).sum())
+        query_memories = {query: set() for query in used_queries[persona]}
+        for memory, related_queries in zip(run_df["insight_summary"], run_df["related_queries"]):
+            for query in related_queries:
+                query_memories[query].add(memory)
+        queries_without_a_memory = [query for query, memories in query_memories.items() if not memories]
+        generated_memories = run_df["insight_summary"].tolist()
+        duplicate_memories = set()
+        for group in duplicate_groups[(persona, run_id)]:
+            duplicate_memories |= set([memory for memory in group if memory in generated_memories])
+        rows.append({
+            "persona_id": persona,
+            "run_id": run_id,
+            "total_memories_generated": total_rows,
+            "total_queries": len(used_queries[persona]),
+            "coverage_count": covered,
+            "coverage_perc": covered / total_rows,
+            "extra_count": total_rows - covered,
+            "extra_perc": (total_rows - covered) / total_rows,
+            "missing_count": len(queries_without_a_memory),
+            "missing_perc": len(queries_without_a_memory) / len(used_queries[persona]),
+            "queries_without_a_memory": queries_without_a_memory,
+            "duplicate_count": len(duplicate_memories),
+            "duplicate_perc": len(duplicate_memories) / total_rows
+        })
+    return pd.DataFrame(rows)
+
+
+def test_metrics_frame_matches_per_run_loop():
+    results_df = fixture_results()
+    metrics_df = compute_metrics_frame(results_df, USED_QUERIES, DUPLICATE_GROUPS)
+    pd.testing.assert_frame_equal(metrics_df, per_run_metrics(results_df, USED_QUERIES, DUPLICATE_GROUPS), check_dtype=False)
+
+
+def test_metrics_frame_matches_per_run_loop_on_random_runs():
+    rng = random.Random(0)
+    queries = [f"query {query_idx}" for query_idx in range(12)]
+    rows = [
+        (f"persona_{persona_idx}", run_idx, f"memory {memory_idx % 5}", rng.sample(queries, rng.choice([0, 0, 1, 2, 3])))
+        for persona_idx in range(4) for run_idx in range(3) for memory_idx in range(rng.randint(1, 8))
+    ]
+    results_df = pd.DataFrame(rows, columns=["persona_id", "run_idx", "insight_summary", "related_queries"])
+    used_queries = {persona: queries for persona in results_df["persona_id"].unique()}
+    duplicate_groups = {
+        run_key: [["memory 0", "memory 1"]] if run_key[1] % 2 else []
+        for run_key in results_df.groupby(["persona_id", "run_idx"]).groups
+    }
+    metrics_df = compute_metrics_frame(results_df, used_queries, duplicate_groups)
+    pd.testing.assert_frame_equal(metrics_df, per_run_metrics(results_df, used_queries, duplicate_groups), check_dtype=False)
@@ -0,0 +1,76 @@
+import types
+import itertools
+import pytest
+
+import judge_cache
+from judge_cache import JudgeResponseCache
+
+RESPONSE = "x" * 1000
+
+
+@pytest.fixture(autouse=True)
+def ticking_clock(monkeypatch):
+    """
+    Every read of the cache's clock is a second later, so access times never tie
+    """
+    ticks = itertools.count(1)
+    monkeypatch.setattr(judge_cache, "time", types.SimpleNamespace(time=lambda: float(next(ticks))))
+
+
+def stored_keys(cache: JudgeResponseCache) -> list:
+    return [key for key, in cache._conn.execute("SELECT key FROM responses ORDER BY key")]
+
+
+def test_least_recently_used_responses_are_evicted(tmp_path):
+    cache = JudgeResponseCache(str(tmp_path / "judge_cache.sqlite"), max_size_mb=3000 / 1024 ** 2)
+    for key in ["a", "b", "c"]:
+        cache.put(key, RESPONSE)
+    assert cache.get("a") == RESPONSE
+    cache.put("d", RESPONSE)
+    # The hit on a was flushed before evicting, so b is the least recently used
+    assert stored_keys(cache) == ["a", "c", "d"]
+    assert cache.total_size == 3000
+    assert cache.stats() == {"hits": 1, "misses": 0}
+    cache.close()
+
+
+def test_replacing_and_deleting_responses_keeps_the_size(tmp_path):
+    cache = JudgeResponseCache(str(tmp_path / "judge_cache.sqlite"), max_size_mb=1)
+    cache.put("a", RESPONSE)
+    cache.put("a", "short")
+    cache.put("b", RESPONSE)
+    cache.delete("b")
+    cache.delete("missing")
+    assert cache.total_size == len("short")
+    assert cache.get("b") is None
+    cache.close()
+
+    reopened = JudgeResponseCache(str(tmp_path / "judge_cache.sqlite"), max_size_mb=1)
+    assert reopened.total_size == len("short")
+    assert reopened.get("a") == "short"
+    reopened.close()
+
+
+def test_hits_are_flushed_in_batches(tmp_path, monkeypatch):
+    monkeypatch.setattr(judge_cache, "ACCESS_FLUSH_SIZE", 3)
+    path = str(tmp_path / "judge_cache.sqlite")
+    cache = JudgeResponseCache(path, max_size_mb=1)
+    for key in ["a", "b", "c"]:
+        cache.put(key, RESPONSE)
+    written_access = dict(cache._conn.execute("SELECT key, last_access FROM responses"))
+
+    cache.get("a")
+    cache.get("b")
+    assert dict(cache._conn.execute("SELECT key, last_access FROM responses")) == written_access
+    cache.get("a")
+    cache.get("c")
+    flushed_access = dict(cache._conn.execute("SELECT key, last_access FROM responses"))
+    assert all([flushed_access[key] > written_access[key] for key in ["a", "b", "c"]])
+    assert cache._pending_access == {}
+
+    # Hits still buffered when the cache closes are written
+    cache.get("b")
+    cache.close()
+    reopened = JudgeResponseCache(path, max_size_mb=1)
+    assert dict(reopened._conn.execute("SELECT key, last_access FROM responses"))["b"] > flushed_access["b"]
+    reopened.close()
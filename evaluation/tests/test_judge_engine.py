@@ -0,0 +1,166 @@
+import re
+import json
+import types
+import pytest
+
+from judge_engine import AsyncJudgeEngine, JudgeParseError, JudgeRequestError, parse_duplicate_groups
+from rate_limiting import RetryPolicy
+
+MEMORIES = ["Plans a trip to Japan", "Bakes sourdough bread", "Trains for a marathon", "Learns watercolor"]
+USED_QUERIES = ["budget travel japan", "sourdough starter", "marathon training plan"]
+
+
+class FakeAPIError(Exception):
+
+    def __init__(self, status_code: int, headers: dict = None):
+        super().__init__(f"Error code: {status_code}")
+        self.status_code = status_code
+        self.response = types.SimpleNamespace(headers=headers or {})
+
+
+class FakeClient:
+    """
+    Stands in for AsyncOpenAI, answering each request's user prompt with respond, which returns content or raises
+    """
+
+    def __init__(self, respond):
+        self.respond = respond
+        self.prompts = []
+        self.chat = types.SimpleNamespace(completions=self)
+
+    async def create(self, model, messages):
+        self.prompts.append(messages[-1]["content"])
+        content = self.respond(messages[-1]["content"])
+        usage = types.SimpleNamespace(prompt_tokens=10, completion_tokens=5)
+        return types.SimpleNamespace(choices=[types.SimpleNamespace(message=types.SimpleNamespace(content=content))], usage=usage)
+
+    async def close(self):
+        pass
+
+
+def as_json(out) -> str:
+    return f"```json\n{json.dumps(out)}\n```"
+
+
+def batch_statements(prompt: str) -> list:
+    return re.findall(r'^\d+\. "(.*)"$', prompt.split("Search Queries:")[0], re.M)
+
+
+def answer_batches(prompt: str) -> str:
+    """
+    Relates every statement to the first query, batched prompts get a numbered object
+    """
+    if "Statements:" in prompt:
+        return as_json({str(idx+1): USED_QUERIES[:1] for idx in range(len(batch_statements(prompt)))})
+    return as_json(USED_QUERIES[:1])
+
+
+@pytest.fixture
+def make_engine(tmp_path):
+    engines = []
+
+    def make(respond, max_attempts: int = 3, **kwargs) -> AsyncJudgeEngine:
+        engine = AsyncJudgeEngine(
+            "test", "test-judge", max_concurrent_requests=4,
+            retry_policy=RetryPolicy(max_attempts=max_attempts, base_delay=0.0, max_delay=0.0),
+            failures_path=str(tmp_path / "judge_failures.jsonl"), **kwargs
+        )
+        engine._client = FakeClient(respond)
+        engines.append(engine)
+        return engine
+
+    yield make
+    for engine in engines:
+        engine.close()
+
+
+def test_api_errors_are_retried(make_engine):
+    errors = [FakeAPIError(500), FakeAPIError(408)]
+
+    def respond(prompt):
+        if errors:
+            raise errors.pop(0)
+        return answer_batches(prompt)
+
+    engine = make_engine(respond)
+    assert engine.run(engine.compare_memory_to_queries(MEMORIES[0], USED_QUERIES)) == USED_QUERIES[:1]
+    assert len(engine._client.prompts) == 3
+
+
+def test_non_retryable_errors_give_up_at_once(make_engine, tmp_path):
+    def respond(prompt):
+        raise FakeAPIError(400)
+
+    engine = make_engine(respond)
+    with pytest.raises(JudgeRequestError) as error:
+        engine.run(engine.compare_memory_to_queries(MEMORIES[0], USED_QUERIES))
+    assert not isinstance(error.value, JudgeParseError)
+    assert len(engine._client.prompts) == 1
+    with open(tmp_path / "judge_failures.jsonl", "r") as _f:
+        failures = [json.loads(line) for line in _f]
+    assert [(failure["attempts"], failure["error_type"]) for failure in failures] == [(1, "FakeAPIError")]
+
+
+def test_rate_limited_batches_pause_the_limiter_and_are_not_split(make_engine):
+    def respond(prompt):
+        raise FakeAPIError(429, {"retry-after": "0"})
+
+    engine = make_engine(respond, batch_size=4)
+    with pytest.raises(JudgeRequestError) as error:
+        engine.run(engine.compare_memory_batch_to_queries(MEMORIES, USED_QUERIES))
+    assert not isinstance(error.value, JudgeParseError)
+    # Every attempt was the whole batch, splitting a rate limited batch would only add requests
+    assert len(engine._client.prompts) == 3
+    assert all([batch_statements(prompt) == MEMORIES for prompt in engine._client.prompts])
+    assert engine.rate_limiter.resume_at > 0
+
+
+def test_unparseable_batches_are_split_until_they_parse(make_engine):
+    def respond(prompt):
+        if len(batch_statements(prompt)) > 1:
+            return "Sorry, I cannot help with that"
+        return answer_batches(prompt)
+
+    engine = make_engine(respond, batch_size=4)
+    assert engine.run(engine.compare_memories_to_queries(MEMORIES, USED_QUERIES)) == [USED_QUERIES[:1]] * len(MEMORIES)
+    # One request for the batch, two for its halves and one for each memory
+    assert len(engine._client.prompts) == 7
+
+
+def test_memories_of_a_failed_split_get_none(make_engine):
+    def respond(prompt):
+        if "Bakes sourdough bread" in prompt:
+            return "not json"
+        return answer_batches(prompt)
+
+    engine = make_engine(respond, batch_size=4)
+    assert engine.run(engine.compare_memories_to_queries(MEMORIES, USED_QUERIES)) == [USED_QUERIES[:1], None, USED_QUERIES[:1], USED_QUERIES[:1]]
+
+
+def test_parse_duplicate_groups_maps_indices_to_statements():
+    dup_json_out = {"justification": "x", "similar_statement_groups": [[0, "Bakes sourdough bread"], ["Not a memory", 3]]}
+    assert parse_duplicate_groups(dup_json_out, MEMORIES) == {
+        "justification": "x",
+        "similar_statement_groups": [[MEMORIES[0], MEMORIES[1]], ["Not a memory", MEMORIES[3]]]
+    }
+
+
+@pytest.mark.parametrize("dup_json_out", [
+    [["Plans a trip to Japan"]],
+    {"groups": []},
+    {"similar_statement_groups": ["Plans a trip to Japan"]},
+    {"similar_statement_groups": [[0, 4]]},
+    {"similar_statement_groups": [[-1, 0]]},
+    {"similar_statement_groups": [[True, 0]]},
+    {"similar_statement_groups": [[{"statement": 0}]]}
+])
+def test_parse_duplicate_groups_rejects_malformed_responses(dup_json_out):
+    with pytest.raises(JudgeParseError):
+        parse_duplicate_groups(dup_json_out, MEMORIES)
+
+
+def test_malformed_duplicate_groups_are_retried(make_engine):
+    responses = [as_json({"similar_statement_groups": [[0, 7]]}), as_json({"similar_statement_groups": [[0, 1]]})]
+    engine = make_engine(lambda prompt: responses.pop(0))
+    assert engine.run(engine.find_duplicates(MEMORIES))["similar_statement_groups"] == [MEMORIES[:2]]
+    assert len(engine._client.prompts) == 2
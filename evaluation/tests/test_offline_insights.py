@@ -0,0 +1,114 @@
+import random
+import numpy as np
+import pandas as pd
+import pytest
+
+from offline_insights import (
+    MAX_SESSION_SECONDS, MS_PER_DAY, PORT_CONSTANTS, SESSION_GAP_SECONDS, aggregate_sessions, check_parity_report, extract_search_query,
+    generate_profile_inputs, rank_aggregate, sessionize_visits
+)
+from utils import atomic_write_json
+
+MINUTE_MICROS = 60 * 1_000_000
+
+
+def naive_session_ids(visit_ms: list, gap_seconds: float, max_session_seconds: float) -> list:
+    """
+    One visit at a time, a visit starts a new session after a long gap or once its session would run too long
+    """
+    session_ids = []
+    session_start = previous = None
+    for visit in sorted(visit_ms):
+        if session_start is None or visit - previous > gap_seconds * 1000 or visit - session_start > max_session_seconds * 1000:
+            session_start = visit
+        session_ids.append(session_start)
+        previous = visit
+    return session_ids
+
+
+def visits_frame(visit_minutes: list) -> pd.DataFrame:
+    return pd.DataFrame({
+        "url": [f"https://example.com/{idx}" for idx in range(len(visit_minutes))],
+        "visitDateMicros": [None if minute is None else 1_760_000_000_000_000 + minute * MINUTE_MICROS for minute in visit_minutes]
+    })
+
+
+def test_sessions_split_on_long_gaps():
+    visits = sessionize_visits(visits_frame([50, 0, 10, 24, 66, 67]))
+    session_minutes = ((visits["session_id"] - visits["visitTimeMs"].min()) // 60_000).tolist()
+    assert session_minutes == [0, 0, 0, 50, 66, 66]
+    assert visits["url"].tolist() == ["https://example.com/1", "https://example.com/2", "https://example.com/3", "https://example.com/0", "https://example.com/4", "https://example.com/5"]
+
+
+def test_sessions_split_once_they_get_too_long():
+    # A visit every 10 minutes for 5 hours never leaves a long gap
+    visits = sessionize_visits(visits_frame(list(range(0, 300, 10))))
+    session_minutes = ((visits["session_id"] - visits["visitTimeMs"].min()) // 60_000).tolist()
+    assert session_minutes == [0] * 13 + [130] * 13 + [260] * 4
+
+
+def test_visits_without_a_time_are_dropped():
+    assert sessionize_visits(visits_frame([None, 5, None]))["url"].tolist() == ["https://example.com/1"]
+    assert sessionize_visits(visits_frame([None]))["session_id"].tolist() == []
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_sessions_match_a_visit_by_visit_walk(seed):
+    rng = random.Random(seed)
+    # Mostly short steps, so gap sessions often run past the maximum session length
+    visit_minutes = [rng.choice([0, 1, 5, 14, 14, 14, 14, 16, 60]) for _ in range(300)]
+    visits = sessionize_visits(visits_frame(list(np.cumsum(visit_minutes))))
+    assert visits["session_id"].tolist() == naive_session_ids(visits["visitTimeMs"].tolist(), SESSION_GAP_SECONDS, MAX_SESSION_SECONDS)
+
+
+@pytest.mark.parametrize("url, title, query", [
+    ("https://www.google.com/search?q=tokyo+hotels&hl=en", "tokyo hotels - Google Search", "tokyo hotels"),
+    ("https://www.bing.com/search?q=+&query=sourdough", None, "sourdough"),
+    ("https://duckduckgo.com/", "Search: marathon plan", "marathon plan"),
+    ("https://duckduckgo.com/", "", None)
+])
+def test_extract_search_query(url, title, query):
+    assert extract_search_query(url, title) == query
+
+
+def test_profile_aggregates_keep_the_best_score_per_session():
+    sessionized = sessionize_visits(pd.DataFrame({
+        "url": ["https://a.com/1", "https://a.com/2", "https://www.google.com/search?q=tokyo", "https://a.com/1"],
+        "title": ["Tokyo hotels", "Tokyo hotels", "tokyo - Google Search", "Tokyo hotels"],
+        "domain": ["a.com", "a.com", "www.google.com", "a.com"],
+        "source": ["history", "history", "search", "history"],
+        "frequencyPct": [10.0, 30.0, 0.0, 5.0],
+        "domainFrequencyPct": [20.0, 40.0, 0.0, 50.0],
+        "visitDateMicros": [0, MINUTE_MICROS, 2 * MINUTE_MICROS, 600 * MINUTE_MICROS]
+    }))
+    domain_agg, title_agg, search_agg = aggregate_sessions(generate_profile_inputs(sessionized))
+    assert domain_agg.loc["a.com", "score"] == 40.0 + 50.0
+    assert title_agg.loc["Tokyo hotels", "score"] == 30.0 + 5.0
+    assert title_agg.loc["Tokyo hotels", "num_sessions"] == 2
+    assert search_agg.loc["tokyo"].tolist() == [1, 1, 2 * 60_000]
+
+
+def test_rank_aggregate_decays_scores_by_age():
+    agg = pd.DataFrame({"score": [8.0, 6.0, 6.0], "num_sessions": [2, 1, 3], "last_seen": [0, 14 * MS_PER_DAY, 14 * MS_PER_DAY]}, index=["old", "b", "a"])
+    assert rank_aggregate(agg, 2, now_ms=14 * MS_PER_DAY, half_life_days=14.0) == [["a", 6.0, 3], ["b", 6.0, 1]]
+    assert rank_aggregate(agg, 5, now_ms=14 * MS_PER_DAY, half_life_days=14.0)[-1] == ["old", 4.0, 2]
+
+
+def test_parity_report_must_match_firefox_with_the_current_constants(tmp_path):
+    report_path = str(tmp_path / "parity_report.json")
+    with pytest.raises(ValueError, match="No parity report"):
+        check_parity_report(None)
+    with pytest.raises(ValueError, match="is not a parity report"):
+        check_parity_report(report_path)
+
+    atomic_write_json(report_path, {"port_constants": PORT_CONSTANTS, "profiles": {"id_0_Persona": {"match": True}}})
+    assert check_parity_report(report_path)["profiles"] == {"id_0_Persona": {"match": True}}
+    atomic_write_json(report_path, {"port_constants": {**PORT_CONSTANTS, "session_gap_seconds": 1800}, "profiles": {"id_0_Persona": {"match": True}}})
+    with pytest.raises(ValueError, match="was made with constants"):
+        check_parity_report(report_path)
+    atomic_write_json(report_path, {"port_constants": PORT_CONSTANTS, "profiles": {}})
+    with pytest.raises(ValueError, match="compared no profiles"):
+        check_parity_report(report_path)
+    atomic_write_json(report_path, {"port_constants": PORT_CONSTANTS, "profiles": {"id_0_Persona": {"match": True}, "id_1_Persona": {"match": False}}})
+    with pytest.raises(ValueError, match=r"1 profiles that differ from Firefox: \['id_1_Persona'\]"):
+        check_parity_report(report_path)
@@ -0,0 +1,74 @@
+import json
+import pytest
+
+import query_index
+from query_index import default_index_path, find_used_queries, load_query_index
+
+BANK = {
+    "tokyo hotels": [{"url": "https://a.com/1"}, {"url": "https://b.com/1"}],
+    "budget travel japan": [{"url": "https://a.com/1"}],
+    "sourdough starter": [{"url": "https://c.com/1"}]
+}
+
+
+@pytest.fixture
+def builds(monkeypatch):
+    """
+    Counts the index builds, to tell a cache hit from a rebuild
+    """
+    build_calls = []
+    build_query_index = query_index.build_query_index
+    monkeypatch.setattr(query_index, "build_query_index", lambda websites_path: build_calls.append(websites_path) or build_query_index(websites_path))
+    return build_calls
+
+
+def write_bank(websites_dir, persona: str, bank: dict):
+    websites_dir.mkdir(exist_ok=True)
+    with open(websites_dir / f"{persona}.json", "w") as _j:
+        json.dump(bank, _j)
+
+
+def test_query_index_maps_urls_to_bank_queries(tmp_path):
+    write_bank(tmp_path / "websites", "id_0_Persona", BANK)
+    persona_index = load_query_index(str(tmp_path / "websites"), str(tmp_path / "query_index.json"))["personas"]["id_0_Persona"]
+    assert find_used_queries(persona_index, ["https://a.com/1", "https://a.com/1", "https://unknown.com"]) == ["tokyo hotels", "budget travel japan"]
+    assert find_used_queries(persona_index, ["https://c.com/1"]) == ["sourdough starter"]
+
+
+def test_saved_index_is_rebuilt_when_the_bank_changes(tmp_path, builds):
+    websites_dir = tmp_path / "websites"
+    index_path = str(tmp_path / "query_index.json")
+    write_bank(websites_dir, "id_0_Persona", BANK)
+    load_query_index(str(websites_dir), index_path)
+    load_query_index(str(websites_dir), index_path)
+    assert len(builds) == 1
+
+    write_bank(websites_dir, "id_0_Persona", {**BANK, "marathon training plan": [{"url": "https://d.com/1"}]})
+    assert load_query_index(str(websites_dir), index_path)["personas"]["id_0_Persona"]["queries"][-1] == "marathon training plan"
+    write_bank(websites_dir, "id_1_Persona", BANK)
+    assert sorted(load_query_index(str(websites_dir), index_path)["personas"]) == ["id_0_Persona", "id_1_Persona"]
+    load_query_index(str(websites_dir), index_path, rebuild=True)
+    assert len(builds) == 4
+
+
+def test_index_is_cached_outside_the_bank(tmp_path, monkeypatch, builds):
+    monkeypatch.setattr(query_index, "QUERY_INDEX_CACHE_DIR", str(tmp_path / "cache"))
+    write_bank(tmp_path / "websites", "id_0_Persona", BANK)
+    write_bank(tmp_path / "other_websites", "id_0_Persona", BANK)
+    load_query_index(str(tmp_path / "websites"))
+    load_query_index(str(tmp_path / "other_websites"))
+    load_query_index(str(tmp_path / "websites"))
+    assert len(builds) == 2
+    assert sorted([str(path) for path in (tmp_path / "cache").iterdir()]) == sorted([
+        default_index_path(str(tmp_path / websites_dir)) for websites_dir in ["websites", "other_websites"]
+    ])
+    assert [path.name for path in (tmp_path / "websites").iterdir()] == ["id_0_Persona.json"]
+
+
+def test_unsaveable_index_is_still_returned(tmp_path, builds):
+    write_bank(tmp_path / "websites", "id_0_Persona", BANK)
+    (tmp_path / "not_a_directory").write_text("")
+    index_path = str(tmp_path / "not_a_directory" / "query_index.json")
+    assert list(load_query_index(str(tmp_path / "websites"), index_path)["personas"]) == ["id_0_Persona"]
+    load_query_index(str(tmp_path / "websites"), index_path)
+    assert len(builds) == 2
@@ -0,0 +1,99 @@
+import types
+import asyncio
+import pytest
+from datetime import datetime, timedelta, timezone
+from email.utils import format_datetime
+
+import rate_limiting
+from rate_limiting import AsyncRateLimiter, AsyncTokenBucket, RetryPolicy, get_retry_after
+
+
+class FakeClock:
+    """
+    Monotonic clock that only moves when the code under test sleeps
+    """
+
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = []
+
+    def monotonic(self) -> float:
+        return self.now
+
+    async def sleep(self, seconds: float):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(rate_limiting, "time", types.SimpleNamespace(monotonic=clock.monotonic))
+    monkeypatch.setattr(rate_limiting, "asyncio", types.SimpleNamespace(Lock=asyncio.Lock, sleep=clock.sleep))
+    return clock
+
+
+def error_with_headers(headers: dict) -> Exception:
+    error = Exception("rate limited")
+    error.response = types.SimpleNamespace(headers=headers)
+    return error
+
+
+def test_token_bucket_waits_for_the_refill(clock):
+    bucket = AsyncTokenBucket(per_minute=60)
+    asyncio.run(bucket.acquire(50))
+    assert clock.sleeps == []
+    asyncio.run(bucket.acquire(20))
+    assert clock.sleeps == [pytest.approx(10.0)]
+    assert bucket.tokens == pytest.approx(0.0)
+
+
+def test_token_bucket_never_holds_more_than_its_capacity(clock):
+    bucket = AsyncTokenBucket(per_minute=60)
+    clock.now += 600
+    # Requests larger than the bucket wait for a full bucket rather than forever
+    asyncio.run(bucket.acquire(1000))
+    assert clock.sleeps == []
+    assert bucket.tokens == pytest.approx(0.0)
+
+
+def test_charged_debt_delays_later_acquires(clock):
+    limiter = AsyncRateLimiter(tokens_per_minute=60)
+    asyncio.run(limiter.acquire(10))
+    limiter.settle(10, 80)
+    assert limiter.token_bucket.tokens == pytest.approx(-20.0)
+    asyncio.run(limiter.acquire(10))
+    assert clock.sleeps == [pytest.approx(30.0)]
+    # Responses within their estimate leave the bucket alone
+    limiter.settle(10, 4)
+    assert limiter.token_bucket.tokens == pytest.approx(0.0)
+
+
+def test_pause_holds_back_every_request(clock):
+    limiter = AsyncRateLimiter(requests_per_minute=600)
+    limiter.pause(5)
+    limiter.pause(2)
+    asyncio.run(limiter.acquire(1))
+    assert clock.now == pytest.approx(5.0)
+
+
+@pytest.mark.parametrize("attempt", range(1, 10))
+def test_backoff_is_bounded(attempt):
+    policy = RetryPolicy(max_attempts=10, base_delay=0.5, max_delay=8.0)
+    delays = [policy.backoff(attempt) for _ in range(200)]
+    assert all([0 <= delay <= min(8.0, 0.5 * 2 ** (attempt - 1)) for delay in delays])
+
+
+def test_backoff_respects_retry_after():
+    policy = RetryPolicy(max_attempts=3, base_delay=0.5, max_delay=1.0)
+    assert all([policy.backoff(1, retry_after=30.0) == 30.0 for _ in range(20)])
+
+
+def test_get_retry_after_reads_the_response_headers():
+    assert get_retry_after(error_with_headers({"retry-after-ms": "1500", "retry-after": "9"})) == 1.5
+    assert get_retry_after(error_with_headers({"retry-after": "7"})) == 7.0
+    retry_at = format_datetime(datetime.now(timezone.utc) + timedelta(seconds=60), usegmt=True)
+    assert 50 < get_retry_after(error_with_headers({"retry-after": retry_at})) <= 60
+    assert get_retry_after(error_with_headers({"retry-after": "soon"})) is None
+    assert get_retry_after(error_with_headers({})) is None
+    assert get_retry_after(Exception("no response")) is None
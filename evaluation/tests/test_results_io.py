@@ -0,0 +1,86 @@
+import os
+import pandas as pd
+import pyarrow.parquet as pq
+
+import results_io
+from results_io import METRICS_OUTPUT, RESULTS_OUTPUT, IncrementalCSVWriter, load_output, open_output_writers
+
+
+def results_frame(persona: str, extra_columns: dict = None) -> pd.DataFrame:
+    return pd.DataFrame({
+        "persona_id": [persona, persona],
+        "run_idx": [0, 1],
+        "insight_summary": [f"{persona} plans a trip", f"{persona} bakes bread"],
+        "score": [4, "n/a"],
+        "related_queries": [["tokyo hotels"], []],
+        **(extra_columns or {})
+    })
+
+
+def write_results(outdir: str, frames: list, output_format: str) -> int:
+    writer, = open_output_writers(outdir, RESULTS_OUTPUT, [output_format])
+    for df in frames:
+        writer.append(df)
+    return writer.close()
+
+
+def test_parquet_columns_first_seen_in_later_frames_are_added(tmp_path, monkeypatch):
+    # Every frame is its own row group, so the new columns are added to row groups already on disk
+    monkeypatch.setattr(results_io, "PARQUET_ROW_GROUP_ROWS", 2)
+    frames = [
+        results_frame("id_0_Persona"),
+        results_frame("id_1_Persona", {"source": ["history", "bookmarks"]}),
+        results_frame("id_2_Persona", {"source": ["history", None], "count_related_queries": [1, 0]})
+    ]
+    assert write_results(str(tmp_path), frames, "parquet") == 6
+    assert os.listdir(tmp_path) == [f"{RESULTS_OUTPUT}.parquet"]
+
+    parquet_file = pq.ParquetFile(tmp_path / f"{RESULTS_OUTPUT}.parquet")
+    assert parquet_file.num_row_groups == 3
+    schema = parquet_file.schema_arrow
+    assert schema.names == ["persona_id", "run_idx", "insight_summary", "score", "related_queries", "source", "count_related_queries"]
+    # Unknown results columns are saved as strings, known ones keep their types
+    assert str(schema.field("source").type) == "string"
+    assert str(schema.field("count_related_queries").type) == "int64"
+    parquet_file.close()
+
+    results_df = load_output(str(tmp_path), RESULTS_OUTPUT)
+    assert results_df["source"].fillna("").tolist() == ["", "", "history", "bookmarks", "history", ""]
+    assert results_df["count_related_queries"].tolist() == [pd.NA, pd.NA, pd.NA, pd.NA, 1, 0]
+    # Scores that are not numbers are saved as nulls
+    assert results_df["score"].isna().tolist() == [False, True] * 3
+    assert results_df["score"].dropna().tolist() == [4.0] * 3
+    assert results_df["related_queries"].tolist() == [["tokyo hotels"], []] * 3
+
+
+def test_parquet_columns_are_added_to_buffered_frames(tmp_path):
+    frames = [results_frame("id_0_Persona"), results_frame("id_1_Persona", {"source": ["history", "bookmarks"]})]
+    write_results(str(tmp_path), frames, "parquet")
+    assert pq.ParquetFile(tmp_path / f"{RESULTS_OUTPUT}.parquet").num_row_groups == 1
+    assert load_output(str(tmp_path), RESULTS_OUTPUT)["source"].fillna("").tolist() == ["", "", "history", "bookmarks"]
+
+
+def test_csv_columns_first_seen_in_later_frames_are_added(tmp_path, monkeypatch):
+    monkeypatch.setattr(results_io, "REWRITE_CHUNKSIZE", 1)
+    frames = [results_frame("id_0_Persona"), results_frame("id_1_Persona", {"source": ["history", "bookmarks"]})]
+    assert write_results(str(tmp_path), frames, "csv") == 4
+    results_df = load_output(str(tmp_path), RESULTS_OUTPUT)
+    assert results_df.columns.tolist() == ["persona_id", "run_idx", "insight_summary", "score", "related_queries", "source"]
+    assert results_df["source"].isna().tolist() == [True, True, False, False]
+    assert results_df["related_queries"].tolist() == [["tokyo hotels"], []] * 2
+
+
+def test_outputs_without_rows_are_still_written(tmp_path):
+    for output_format in ["csv", "parquet"]:
+        writer, = open_output_writers(str(tmp_path), METRICS_OUTPUT, [output_format])
+        assert writer.close() == 0
+    assert sorted(os.listdir(tmp_path)) == [f"{METRICS_OUTPUT}.csv", f"{METRICS_OUTPUT}.parquet"]
+
+
+def test_discarded_writers_leave_earlier_outputs_untouched(tmp_path):
+    write_results(str(tmp_path), [results_frame("id_0_Persona")], "csv")
+    writer = IncrementalCSVWriter(f"{tmp_path}/{RESULTS_OUTPUT}.csv")
+    writer.append(results_frame("id_1_Persona"))
+    writer.discard()
+    assert os.listdir(tmp_path) == [f"{RESULTS_OUTPUT}.csv"]
+    assert load_output(str(tmp_path), RESULTS_OUTPUT)["persona_id"].tolist() == ["id_0_Persona"] * 2
@@ -0,0 +1,90 @@
+import os
+import json
+import types
+import pandas as pd
+import pytest
+
+from generation_store import GENERATION_FAILED_SUFFIX
+from memories_evaluator import MEMORIES_GENERATION, METRICS_ARTIFACTS, MemoriesGenerationConfig, MemoryEvaluator
+from utils import atomic_write_csv, atomic_write_json, load_json_if_valid
+
+PROFILE = "id_0_Persona"
+
+
+def make_run(tmp_path, n_passes: int = 3):
+    """
+    The parts of a MemoryEvaluator the resume helpers read, with an output directory of its own
+    """
+    outdir = MemoryEvaluator.setup_output_dir(str(tmp_path / "run"))
+    os.makedirs(f"{outdir}/{MEMORIES_GENERATION}/{PROFILE}")
+    config = types.SimpleNamespace(memories_generation=MemoriesGenerationConfig(max_threads=1, n_passes=n_passes))
+    return types.SimpleNamespace(outdir=outdir, config=config)
+
+
+def test_atomic_write_json_keeps_the_previous_file_when_writing_fails(tmp_path):
+    path = str(tmp_path / "artifact.json")
+    atomic_write_json(path, {"pass": 0})
+    with pytest.raises(TypeError):
+        atomic_write_json(path, {"pass": object()})
+    assert load_json_if_valid(path) == {"pass": 0}
+
+
+def test_atomic_write_csv_replaces_the_file(tmp_path):
+    path = str(tmp_path / "artifact.csv")
+    atomic_write_csv(pd.DataFrame({"memory": ["a"]}), path, index=False)
+    atomic_write_csv(pd.DataFrame({"memory": ["b", "c"]}), path, index=False)
+    assert pd.read_csv(path)["memory"].tolist() == ["b", "c"]
+    assert os.listdir(tmp_path) == ["artifact.csv"]
+
+
+def test_partial_json_artifacts_are_not_loaded(tmp_path):
+    with open(tmp_path / "partial.json", "w") as _o:
+        _o.write('[{"insight_summary": "Plans a tr')
+    assert load_json_if_valid(str(tmp_path / "partial.json")) is None
+    assert load_json_if_valid(str(tmp_path / "missing.json")) is None
+
+
+def test_setup_output_dir_only_keeps_artifacts_on_resume(tmp_path):
+    outdir = MemoryEvaluator.setup_output_dir(str(tmp_path / "run"))
+    atomic_write_json(f"{outdir}/{MEMORIES_GENERATION}/saved.json", [])
+    assert MemoryEvaluator.setup_output_dir(str(tmp_path / "run"), resume=True) == outdir
+    assert os.path.exists(f"{outdir}/{MEMORIES_GENERATION}/saved.json")
+    MemoryEvaluator.setup_output_dir(str(tmp_path / "run"))
+    assert os.listdir(f"{outdir}/{MEMORIES_GENERATION}") == []
+    assert os.path.isdir(f"{outdir}/{METRICS_ARTIFACTS}")
+
+
+def test_load_completed_passes_skips_missing_and_unreadable_passes(tmp_path):
+    run = make_run(tmp_path)
+    profile_dir = f"{run.outdir}/{MEMORIES_GENERATION}/{PROFILE}"
+    atomic_write_json(f"{profile_dir}/pass_0_generated_memories.json", [{"insight_summary": "Plans a trip"}])
+    with open(f"{profile_dir}/pass_1_generated_memories.json", "w") as _o:
+        _o.write('[{"insight_sum')
+    atomic_write_json(f"{profile_dir}/pass_2_generated_memories.json", {"error": "not a pass"})
+    assert MemoryEvaluator.load_completed_passes(run, PROFILE) == [[{"insight_summary": "Plans a trip"}], None, None]
+
+
+def test_regenerated_passes_replace_failures_and_stale_judgments(tmp_path):
+    run = make_run(tmp_path, n_passes=2)
+    profile_dir = f"{run.outdir}/{MEMORIES_GENERATION}/{PROFILE}"
+    artifacts_dir = f"{run.outdir}/{METRICS_ARTIFACTS}/{PROFILE}"
+    os.makedirs(artifacts_dir)
+    atomic_write_json(f"{artifacts_dir}/pass_1_related_queries.json", [])
+    atomic_write_json(f"{artifacts_dir}/pass_0_related_queries.json", [])
+    group_profiles = {PROFILE: (profile_dir, None)}
+    group_results = {PROFILE: [None, None]}
+
+    MemoryEvaluator.save_generated_passes(
+        run, {PROFILE: MemoryEvaluator.failed_passes(1, "Firefox crashed")}, group_profiles, {PROFILE: [1]}, group_results, {}
+    )
+    with open(f"{profile_dir}/pass_1_{GENERATION_FAILED_SUFFIX}", "r") as _j:
+        assert json.load(_j) == {"error": "Firefox crashed"}
+    assert MemoryEvaluator.load_completed_passes(run, PROFILE) == [None, None]
+
+    memories = [{"insight_summary": "Plans a trip"}]
+    MemoryEvaluator.save_generated_passes(run, {PROFILE: {"passes": [memories]}}, group_profiles, {PROFILE: [1]}, group_results, {})
+    assert group_results[PROFILE] == [None, memories]
+    assert MemoryEvaluator.load_completed_passes(run, PROFILE) == [None, memories]
+    assert not os.path.exists(f"{profile_dir}/pass_1_{GENERATION_FAILED_SUFFIX}")
+    # Only the regenerated pass's judgments are dropped
+    assert os.listdir(artifacts_dir) == ["pass_0_related_queries.json"]
@@ -0,0 +1,30 @@
+import numpy as np
+import pytest
+
+import run_history
+
+
+def naive_bootstrap_pass_means(values: np.ndarray, counts: np.ndarray, n_bootstrap: int, rng: np.random.Generator) -> np.ndarray:
+    """
+    One draw and persona at a time, from the same uniforms as bootstrap_pass_means
+    """
+    uniforms = rng.random((n_bootstrap,) + values.shape)
+    means = np.full((n_bootstrap, len(values)), np.nan)
+    for draw in range(n_bootstrap):
+        for persona_idx, count in enumerate(counts):
+            if count:
+                slots = np.floor(uniforms[draw, persona_idx, :count] * count).astype(int)
+                means[draw, persona_idx] = values[persona_idx, slots].mean()
+    return means
+
+
+@pytest.mark.parametrize("chunk_elements", [1, 37, 1 << 22])
+def test_bootstrap_pass_means_matches_naive_loop(monkeypatch, chunk_elements):
+    rng = np.random.default_rng(1)
+    counts = np.array([3, 0, 1, 5, 2])
+    values = rng.random((len(counts), counts.max()))
+    values[np.arange(counts.max())[None, :] >= counts[:, None]] = np.nan
+    monkeypatch.setattr(run_history, "BOOTSTRAP_CHUNK_ELEMENTS", chunk_elements)
+    means = run_history.bootstrap_pass_means(values, counts, 200, np.random.default_rng(7))
+    np.testing.assert_allclose(means, naive_bootstrap_pass_means(values, counts, 200, np.random.default_rng(7)), rtol=1e-12)
+    assert np.isnan(means[:, 1]).all()
@@ -0,0 +1,77 @@
+import hashlib
+import pandas as pd
+import pytest
+
+from metrics import compute_metrics_frame
+from results_io import METRICS_OUTPUT, RESULTS_OUTPUT, RUN_COLUMNS, load_output, open_output_writers
+from sharding import SHARD_FILE, check_shards, load_shard_outputs, merge_shards, persona_shard, shard_personas
+from utils import atomic_write_json
+
+SHARD_PERSONAS = [f"id_{persona_idx}_Persona" for persona_idx in range(24)]
+
+
+def test_persona_shard_is_a_stable_hash():
+    for persona in SHARD_PERSONAS:
+        assert persona_shard(persona, 7) == int(hashlib.sha256(persona.encode("utf-8")).hexdigest(), 16) % 7
+
+
+@pytest.mark.parametrize("n_shards", [1, 3, 5])
+def test_shard_personas_partition_the_personas(n_shards):
+    shards = [shard_personas(SHARD_PERSONAS, shard_id, n_shards) for shard_id in range(n_shards)]
+    assert sorted([persona for personas in shards for persona in personas]) == sorted(SHARD_PERSONAS)
+    assert sum([len(personas) for personas in shards]) == len(SHARD_PERSONAS)
+
+
+def shard_outputs(personas: list) -> dict:
+    results_df = pd.DataFrame([
+        (persona, run_idx, f"{persona} memory {memory_idx}", ["query 0"] if memory_idx % 2 else [], 3.5)
+        for persona in personas for run_idx in range(2) for memory_idx in range(3)
+    ], columns=["persona_id", "run_idx", "insight_summary", "related_queries", "score"])
+    metrics_df = compute_metrics_frame(
+        results_df,
+        {persona: ["query 0", "query 1"] for persona in personas},
+        {(persona, run_idx): [] for persona in personas for run_idx in range(2)}
+    )
+    return {METRICS_OUTPUT: metrics_df, RESULTS_OUTPUT: results_df}
+
+
+def write_shard(shard_dir, shard_id: int, n_shards: int, output_format: str, evaluated: list = None) -> str:
+    personas = shard_personas(SHARD_PERSONAS, shard_id, n_shards)
+    shard_dir.mkdir()
+    atomic_write_json(f"{shard_dir}/{SHARD_FILE}", {"shard_id": shard_id, "n_shards": n_shards, "personas": personas})
+    for output, output_df in shard_outputs(personas if evaluated is None else evaluated).items():
+        for writer in open_output_writers(str(shard_dir), output, [output_format]):
+            writer.append(output_df)
+            writer.close()
+    return str(shard_dir)
+
+
+@pytest.mark.parametrize("output_format", ["csv", "parquet"])
+def test_merge_shards_matches_concatenated_shards(tmp_path, output_format):
+    shard_dirs = [write_shard(tmp_path / f"shard{shard_id}", shard_id, 3, output_format) for shard_id in [2, 0, 1]]
+    manifest = merge_shards(shard_dirs, str(tmp_path / "merged"))
+    assert manifest["problems"] == []
+    for output in [METRICS_OUTPUT, RESULTS_OUTPUT]:
+        sort_columns = ["persona_id", RUN_COLUMNS[output]]
+        # The merge used to concatenate every shard in memory and sort the whole run
+        expected_df = pd.concat([load_output(shard_dir, output).astype({"persona_id": str}) for shard_dir in shard_dirs])
+        expected_df = expected_df.sort_values(sort_columns, kind="stable").reset_index(drop=True)
+        merged_df = load_output(str(tmp_path / "merged"), output).astype({"persona_id": str})
+        pd.testing.assert_frame_equal(merged_df.sort_values(sort_columns, kind="stable").reset_index(drop=True), expected_df)
+        assert len(merged_df) == len(expected_df) > 0
+
+
+def test_check_shards_reports_missing_repeated_and_incomplete_shards(tmp_path):
+    shard_0 = write_shard(tmp_path / "shard0", 0, 3, "csv")
+    shard_1 = write_shard(tmp_path / "shard1", 1, 3, "csv", evaluated=shard_personas(SHARD_PERSONAS, 1, 3)[1:])
+    missing_persona = shard_personas(SHARD_PERSONAS, 1, 3)[0]
+
+    problems = check_shards([load_shard_outputs(shard_dir) for shard_dir in [shard_0, shard_1]])
+    assert problems == ["Missing shards [2] of 3", f"Shard 1 ({shard_1}) has no metrics for ['{missing_persona}']"]
+    with pytest.raises(ValueError):
+        merge_shards([shard_0, shard_1], str(tmp_path / "merged"))
+    assert merge_shards([shard_0, shard_1], str(tmp_path / "merged"), allow_incomplete=True)["problems"] == problems
+
+    repeated_problems = check_shards([load_shard_outputs(shard_dir) for shard_dir in [shard_0, shard_0]])
+    assert "Shards [0] were given more than once" in repeated_problems
+    assert any([problem.endswith("was evaluated by shards [0, 0]") for problem in repeated_problems])
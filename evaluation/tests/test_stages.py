@@ -0,0 +1,82 @@
+import pytest
+
+from generation_store import GENERATION_FAILED_SUFFIX, SavedGenerations
+from memories_evaluator import MEMORIES_GENERATION, STAGES, MemoryEvaluator, MemoryEvaluatorConfig
+from utils import atomic_write_json
+
+MEMORIES = [{"insight_summary": "Plans a trip to Japan"}]
+
+
+def make_config(outdir_prefix: str) -> MemoryEvaluatorConfig:
+    return MemoryEvaluatorConfig(
+        data={"records_path": "records", "websites_path": "websites"},
+        lite_llm={"api_key": "test", "endpoint": "http://localhost", "fastly_request_key": "test", "model": "test-insights"},
+        firefox_repo_path="",
+        openai={"api_key": "test", "model": "test-judge"},
+        memories_generation={"max_threads": 1, "n_passes": 2},
+        metrics_computation={"max_threads": 1},
+        output={"outdir_prefix": outdir_prefix}
+    )
+
+
+def write_generation_dir(tmp_path) -> str:
+    generation_dir = tmp_path / "earlier_run" / MEMORIES_GENERATION
+    for persona in ["id_0_Persona", "id_1_Persona"]:
+        (generation_dir / persona).mkdir(parents=True)
+        atomic_write_json(str(generation_dir / persona / "pass_0_generated_memories.json"), MEMORIES)
+    atomic_write_json(str(generation_dir / "id_0_Persona" / "pass_1_generated_memories.json"), MEMORIES)
+    atomic_write_json(str(generation_dir / "id_1_Persona" / f"pass_1_{GENERATION_FAILED_SUFFIX}"), {"error": "Firefox crashed"})
+    return str(generation_dir)
+
+
+@pytest.mark.parametrize("stages, from_generation, expected", [
+    (STAGES, None, STAGES),
+    (["metrics", "generate", "judge"], None, STAGES),
+    (["generate"], None, ["generate"]),
+    (["judge", "metrics"], "earlier_run", ["judge", "metrics"]),
+    (["metrics"], "earlier_run", ["metrics"])
+])
+def test_check_stages_orders_contiguous_stages(stages, from_generation, expected):
+    assert MemoryEvaluator.check_stages(stages, from_generation) == expected
+
+
+@pytest.mark.parametrize("stages, from_generation", [
+    ([], None),
+    (["generate", "evaluate"], None),
+    (["generate", "metrics"], None),
+    (["judge", "metrics"], None),
+    (STAGES, "earlier_run")
+])
+def test_check_stages_rejects_invalid_stages(stages, from_generation):
+    with pytest.raises(ValueError):
+        MemoryEvaluator.check_stages(stages, from_generation)
+
+
+def test_from_generation_must_not_be_the_output_directory(tmp_path):
+    config = make_config(str(tmp_path / "rerun"))
+    with pytest.raises(ValueError, match="must differ"):
+        MemoryEvaluator(config, stages=["judge", "metrics"], from_generation=MemoryEvaluator.output_dir_path(str(tmp_path / "rerun")))
+
+
+def test_saved_generations_read_passes_and_failures(tmp_path):
+    generations = SavedGenerations(write_generation_dir(tmp_path), n_passes=2)
+    assert list(generations) == ["id_0_Persona", "id_1_Persona"]
+    assert generations["id_0_Persona"] == [MEMORIES, MEMORIES]
+    assert generations["id_1_Persona"] == [MEMORIES, None]
+    assert list(SavedGenerations(write_generation_dir(tmp_path / "shard"), n_passes=2, personas=["id_1_Persona"])) == ["id_1_Persona"]
+
+
+def test_saved_generations_reject_missing_and_unreadable_passes(tmp_path):
+    generation_dir = write_generation_dir(tmp_path)
+    with pytest.raises(ValueError, match="fewer than 3 passes"):
+        SavedGenerations(generation_dir, n_passes=3)
+    with pytest.raises(ValueError, match="No generated memories directory"):
+        SavedGenerations(str(tmp_path / "missing"), n_passes=2)
+
+    with open(f"{generation_dir}/id_0_Persona/pass_1_generated_memories.json", "w") as _o:
+        _o.write("[{")
+    generations = SavedGenerations(generation_dir, n_passes=2)
+    with pytest.raises(ValueError, match="Unreadable saved passes"):
+        generations["id_0_Persona"]
+    with pytest.raises(KeyError):
+        generations["id_2_Persona"]
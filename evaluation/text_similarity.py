@@ -0,0 +1,59 @@
+import re
+import numpy as np
+from typing import List
+
+
+# Lowercased alphanumeric word tokens
+TOKEN_REGEX = re.compile(r"[a-z0-9]+")
+
+# Common English words that carry no topical signal
+STOP_WORDS = frozenset([
+    "a", "an", "and", "are", "as", "at", "be", "by", "for", "from", "has", "have", "how", "i", "in", "into",
+    "is", "it", "its", "of", "on", "or", "that", "the", "their", "they", "this", "to", "was", "what", "when",
+    "where", "which", "who", "why", "with", "user", "users",
+])
+
+
+def normalize_token(token: str) -> str:
+    """
+    Strips simple plural suffixes so that e.g. "bills" and "bill" match
+    """
+    if len(token) > 4 and token.endswith("ies"):
+        return token[:-3] + "y"
+    if len(token) > 3 and token.endswith("s") and not token.endswith("ss"):
+        return token[:-1]
+    return token
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    Splits text into normalized word tokens without stop words
+    """
+    return [normalize_token(token) for token in TOKEN_REGEX.findall(text.lower()) if token not in STOP_WORDS]
+
+
+def tfidf_vectors(texts: List[str]) -> np.ndarray:
+    """
+    Builds L2-normalized sublinear TF-IDF vectors for a set of texts
+    """
+    docs = [tokenize(text) for text in texts]
+    vocabulary = {token: idx for idx, token in enumerate(sorted({token for doc in docs for token in doc}))}
+    counts = np.zeros((len(docs), len(vocabulary)))
+    doc_idx = np.array([row for row, doc in enumerate(docs) for _ in doc], dtype=int)
+    token_idx = np.array([vocabulary[token] for doc in docs for token in doc], dtype=int)
+    np.add.at(counts, (doc_idx, token_idx), 1)
+
+    doc_freq = (counts > 0).sum(axis=0)
+    idf = np.log((1 + len(docs)) / (1 + doc_freq)) + 1
+    tfidf = np.log1p(counts) * idf
+    norms = np.linalg.norm(tfidf, axis=1, keepdims=True)
+    norms[norms == 0] = 1
+    return tfidf / norms
+
+
+def cosine_similarity_matrix(texts_a: List[str], texts_b: List[str]) -> np.ndarray:
+    """
+    TF-IDF cosine similarity between every text of texts_a (rows) and every text of texts_b (columns)
+    """
+    vectors = tfidf_vectors(list(texts_a) + list(texts_b))
+    return vectors[:len(texts_a)] @ vectors[len(texts_a):].T
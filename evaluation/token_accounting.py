@@ -0,0 +1,142 @@
+import json
+import time
+import threading
+import pandas as pd
+from typing import Any, Dict, Optional
+
+from tracing import TRACE_TAGS
+
+TOKEN_USAGE_FILE = "token_usage.jsonl"
+TOKEN_COSTS_FILE = "token_costs.csv"
+
+
+def read_usage(usage: Any) -> Dict[str, int]:
+    """
+    Reads prompt, completion and cached prompt tokens from an OpenAI usage object or dict
+    """
+    if usage is None:
+        return {"prompt_tokens": 0, "completion_tokens": 0, "cached_tokens": 0}
+    if isinstance(usage, dict):
+        prompt_details = usage.get("prompt_tokens_details") or {}
+        return {
+            "prompt_tokens": usage.get("prompt_tokens") or 0,
+            "completion_tokens": usage.get("completion_tokens") or 0,
+            "cached_tokens": prompt_details.get("cached_tokens") or 0
+        }
+    prompt_details = getattr(usage, "prompt_tokens_details", None)
+    return {
+        "prompt_tokens": getattr(usage, "prompt_tokens", None) or 0,
+        "completion_tokens": getattr(usage, "completion_tokens", None) or 0,
+        "cached_tokens": getattr(prompt_details, "cached_tokens", None) or 0
+    }
+
+
+def load_json_line(line: str) -> Optional[Dict]:
+    """
+    Parses one JSONL record, skipping a partially written last line
+    """
+    try:
+        return json.loads(line)
+    except ValueError:
+        return None
+
+
+class TokenLedger:
+    """
+    Per-call token accounting priced from a USD per million tokens table, appended to a JSONL file
+    Calls already in the file, e.g. from the interrupted run being resumed, count toward the budget
+    """
+
+    def __init__(
+        self,
+        prices: Dict[str, Dict[str, Optional[float]]],
+        path: Optional[str] = None,
+        max_cost_usd: Optional[float] = None,
+        max_tokens: Optional[int] = None
+    ):
+        self.prices = prices
+        self.path = path
+        self.max_cost_usd = max_cost_usd
+        self.max_tokens = max_tokens
+        self.calls = []
+        self.unpriced_models = set()
+        self._lock = threading.Lock()
+        if path is not None:
+            try:
+                with open(path, "r") as _j:
+                    self.calls = [call for call in map(load_json_line, _j) if call is not None]
+            except OSError:
+                pass
+        self.total_tokens = sum([call["prompt_tokens"] + call["completion_tokens"] for call in self.calls])
+        self.total_cost_usd = sum([call["cost_usd"] or 0.0 for call in self.calls])
+
+    def price(self, model: str, prompt_tokens: int, completion_tokens: int, cached_tokens: int) -> Optional[float]:
+        """
+        Cost of a call in USD, cached prompt tokens use the cached price when the table has one
+        """
+        model_prices = self.prices.get(model)
+        if model_prices is None:
+            # Without a price table costs are simply not tracked, only a table missing this model is worth a warning
+            if self.prices and model not in self.unpriced_models:
+                self.unpriced_models.add(model)
+                print(f"No price for model \"{model}\", its calls are counted without a cost")
+            return None
+        cached_price = model_prices.get("cached_prompt")
+        cached_price = cached_price if cached_price is not None else model_prices["prompt"]
+        return (
+            (prompt_tokens - cached_tokens) * model_prices["prompt"]
+            + cached_tokens * cached_price
+            + completion_tokens * model_prices["completion"]
+        ) / 1_000_000
+
+    def record(self, stage: str, model: str, usage: Any, **tags):
+        """
+        Records one API call's tokens and cost, tagged with the current persona and pass
+        """
+        tokens = read_usage(usage)
+        call = {
+            "timestamp": time.time(),
+            "stage": stage,
+            "model": model,
+            **tokens,
+            "cost_usd": self.price(model, tokens["prompt_tokens"], tokens["completion_tokens"], tokens["cached_tokens"]),
+            **{key: value for key, value in {**TRACE_TAGS.get(), **tags}.items() if key in ["persona", "pass_id"]}
+        }
+        with self._lock:
+            self.calls.append(call)
+            self.total_tokens += tokens["prompt_tokens"] + tokens["completion_tokens"]
+            self.total_cost_usd += call["cost_usd"] or 0.0
+            if self.path is not None:
+                with open(self.path, "a") as _o:
+                    _o.write(json.dumps(call, default=str) + "\n")
+
+    def budget_exceeded(self) -> bool:
+        """
+        Whether the run has used up its cost or token budget
+        """
+        return (
+            (self.max_cost_usd is not None and self.total_cost_usd >= self.max_cost_usd)
+            or (self.max_tokens is not None and self.total_tokens >= self.max_tokens)
+        )
+
+    def summary(self) -> pd.DataFrame:
+        """
+        Calls, tokens and cost rolled up per stage, per persona and for the whole run
+        """
+        columns = ["calls", "prompt_tokens", "completion_tokens", "cached_tokens", "cost_usd"]
+        with self._lock:
+            calls_df = pd.DataFrame(self.calls)
+        if calls_df.empty:
+            return pd.DataFrame(columns=["group", "key"] + columns)
+        calls_df["calls"] = 1
+        calls_df["cost_usd"] = pd.to_numeric(calls_df["cost_usd"])
+        if "persona" not in calls_df.columns:
+            calls_df["persona"] = None
+        calls_df["persona"] = calls_df["persona"].map(lambda persona: persona if isinstance(persona, str) else "(none)")
+        calls_df["run"] = "total"
+        rollups = []
+        for group in ["stage", "persona", "run"]:
+            rollup = calls_df.groupby(group, sort=True)[columns].sum(min_count=1).reset_index().rename(columns={group: "key"})
+            rollup.insert(0, "group", group)
+            rollups.append(rollup)
+        return pd.concat(rollups, ignore_index=True)
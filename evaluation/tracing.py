@@ -0,0 +1,150 @@
+import json
+import time
+import threading
+import contextvars
+import numpy as np
+import pandas as pd
+from contextlib import contextmanager
+from typing import Coroutine, Dict, List, Optional
+
+# Tags applied to every span recorded in the current context, such as the persona being evaluated
+# Judge engine coroutines copy the context of the thread that scheduled them, so they inherit its tags
+TRACE_TAGS = contextvars.ContextVar("trace_tags", default={})
+
+
+@contextmanager
+def trace_tags(**tags):
+    """
+    Adds tags to every span recorded in the enclosed block
+    """
+    token = TRACE_TAGS.set({**TRACE_TAGS.get(), **tags})
+    try:
+        yield
+    finally:
+        TRACE_TAGS.reset(token)
+
+
+async def traced(coroutine: Coroutine, **tags):
+    """
+    Awaits a coroutine with extra tags on the spans it records
+    """
+    with trace_tags(**tags):
+        return await coroutine
+
+
+class Tracer:
+    """
+    Records timed spans to a JSONL trace file, a disabled tracer without a path records nothing
+    """
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path
+        self.spans = []
+        self.origin = time.perf_counter()
+        self._lock = threading.Lock()
+        self._file = open(path, "a") if path is not None else None
+
+    @contextmanager
+    def span(self, name: str, **tags):
+        """
+        Times the enclosed block, which can add tags only known at its end to the yielded dict
+        """
+        span_tags = {**TRACE_TAGS.get(), **tags}
+        start = time.perf_counter()
+        try:
+            yield span_tags
+        except BaseException as e:
+            span_tags["error"] = type(e).__name__
+            raise
+        finally:
+            if self._file is not None:
+                self.record(name, start, time.perf_counter() - start, span_tags)
+
+    def record(self, name: str, start: float, duration: float, tags: Dict):
+        """
+        Appends a finished span to the trace
+        """
+        span = {
+            "name": name,
+            "start": start - self.origin,
+            "duration": duration,
+            "thread": threading.current_thread().name,
+            "tags": tags
+        }
+        with self._lock:
+            self.spans.append(span)
+            self._file.write(json.dumps(span, default=str) + "\n")
+            self._file.flush()
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+
+def assign_lanes(spans: List[Dict]) -> List[int]:
+    """
+    Spreads each thread's spans over lanes so that spans sharing a lane are either disjoint or nested
+    Concurrent judge requests on the event loop thread overlap without nesting and need their own lanes
+    """
+    lanes = [0] * len(spans)
+    open_stacks = {}
+    for span_idx in sorted(range(len(spans)), key=lambda idx: (spans[idx]["start"], -spans[idx]["duration"])):
+        span = spans[span_idx]
+        end = span["start"] + span["duration"]
+        thread_stacks = open_stacks.setdefault(span["thread"], [])
+        for lane, stack in enumerate(thread_stacks + [[]]):
+            while stack and stack[-1] <= span["start"]:
+                stack.pop()
+            if not stack or end <= stack[-1]:
+                break
+        if lane == len(thread_stacks):
+            thread_stacks.append([])
+        thread_stacks[lane].append(end)
+        lanes[span_idx] = lane
+    return lanes
+
+
+def to_chrome_trace(spans: List[Dict]) -> Dict:
+    """
+    Converts spans to the Chrome trace event format, readable by chrome://tracing and Perfetto
+    """
+    thread_ids = {}
+    events = []
+    for span, lane in zip(spans, assign_lanes(spans)):
+        thread_key = (span["thread"], lane)
+        if thread_key not in thread_ids:
+            thread_ids[thread_key] = len(thread_ids) + 1
+            events.append({
+                "name": "thread_name",
+                "ph": "M",
+                "pid": 1,
+                "tid": thread_ids[thread_key],
+                "args": {"name": span["thread"] if lane == 0 else f"{span['thread']} ({lane})"}
+            })
+        events.append({
+            "name": span["name"],
+            "ph": "X",
+            "pid": 1,
+            "tid": thread_ids[thread_key],
+            "ts": span["start"] * 1e6,
+            "dur": span["duration"] * 1e6,
+            "args": span["tags"]
+        })
+    return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+
+def summarize_spans(spans: List[Dict]) -> pd.DataFrame:
+    """
+    Count, total and p50/p95/p99/max duration per span name, in the spans' duration unit
+    """
+    spans_df = pd.DataFrame([{"stage": span["name"], "duration": span["duration"]} for span in spans], columns=["stage", "duration"])
+    return spans_df.groupby("stage", sort=True)["duration"].agg(
+        count="size",
+        total="sum",
+        p50=lambda durations: np.percentile(durations, 50),
+        p95=lambda durations: np.percentile(durations, 95),
+        p99=lambda durations: np.percentile(durations, 99),
+        max="max"
+    ).sort_values("total", ascending=False)
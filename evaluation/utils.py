@@ -0,0 +1,34 @@
+import os
+import json
+import pandas as pd
+from typing import Any, Optional
+
+
+def atomic_write_json(path: str, obj: Any):
+    """
+    Writes JSON to a temporary file and renames it into place, so readers never see a partial file
+    """
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as _o:
+        json.dump(obj, _o, indent=2)
+    os.replace(tmp_path, path)
+
+
+def atomic_write_csv(df: pd.DataFrame, path: str, **to_csv_kwargs):
+    """
+    Writes a DataFrame to CSV through a temporary file and a rename
+    """
+    tmp_path = f"{path}.tmp"
+    df.to_csv(tmp_path, **to_csv_kwargs)
+    os.replace(tmp_path, path)
+
+
+def load_json_if_valid(path: str) -> Optional[Any]:
+    """
+    Loads a JSON artifact, returning None if it is missing or unreadable
+    """
+    try:
+        with open(path, "r") as _j:
+            return json.load(_j)
+    except (OSError, ValueError):
+        return None